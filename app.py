@@ -13,12 +13,19 @@ if env_ == "prod":
     _REGION_1 = "us-west-1"
     _REGION_2 = "us-east-1"
     _REGIONS = [_REGION_1, _REGION_2]
+    _PROXY_API = "rest"
+    _TENANT_API = "dedicated"
+    # False once `scripts/migrate_models_layout.py finish` has run
+    _LEGACY_MODELS_LAYOUT = True
 elif env_ == "dev":
     DOMAIN_NAME = "playingwithml.com"
     _PREFIX = "playingwithml"
     _REGION_1 = "us-east-1"
     _REGION_2 = "us-west-1"
     _REGIONS = [_REGION_1, _REGION_2]
+    _PROXY_API = "http"
+    _TENANT_API = "shared"
+    _LEGACY_MODELS_LAYOUT = True
 else:
     raise Exception("Invalid env var: env")
 
@@ -67,7 +74,11 @@ for region in _REGIONS:
             "logs_bucket": base[f"RegionalBase-{region}"].logs_bucket,
         },
         vpc=base[f"RegionalBase-{region}"].vpc,
+        interface_endpoints=base[f"RegionalBase-{region}"].interface_endpoints,
         env_=env_,
+        proxy_api=_PROXY_API,
+        tenant_api=_TENANT_API,
+        legacy_models_layout=_LEGACY_MODELS_LAYOUT,
         env=cdk.Environment(account=_ACCOUNT, region=region),
         tags={
             "stack": "main",
@@ -27,7 +27,58 @@ class BaseStack(Stack):
         # # DynamoDB tables
         users = self.create_table("users_table", name="Users")
         creds = self.create_table("creds_table", name="Creds")
-        models = self.create_table("models_table", name="Models")
+        # sparse indexes of the model rows (API-key rows have no "model") and
+        # of the API-key rows by model (see src/helpers/api_keys.py)
+        models = self.create_table(
+            "models_table",
+            name="Models",
+            global_secondary_indexes=[
+                dynamodb.CfnGlobalTable.GlobalSecondaryIndexProperty(
+                    index_name="models",
+                    key_schema=[
+                        dynamodb.CfnGlobalTable.KeySchemaProperty(
+                            attribute_name="pk", key_type="HASH"
+                        ),
+                        dynamodb.CfnGlobalTable.KeySchemaProperty(
+                            attribute_name="model", key_type="RANGE"
+                        ),
+                    ],
+                    projection=dynamodb.CfnGlobalTable.ProjectionProperty(
+                        projection_type="INCLUDE",
+                        non_key_attributes=[
+                            "library",
+                            "filetype",
+                            "created_at",
+                            "updated_at",
+                            "is_public",
+                        ],
+                    ),
+                ),
+                dynamodb.CfnGlobalTable.GlobalSecondaryIndexProperty(
+                    index_name="api_keys",
+                    key_schema=[
+                        dynamodb.CfnGlobalTable.KeySchemaProperty(
+                            attribute_name="pk", key_type="HASH"
+                        ),
+                        dynamodb.CfnGlobalTable.KeySchemaProperty(
+                            attribute_name="api_key_model", key_type="RANGE"
+                        ),
+                    ],
+                    projection=dynamodb.CfnGlobalTable.ProjectionProperty(
+                        projection_type="INCLUDE",
+                        non_key_attributes=[
+                            "hashed_key",
+                            "model_name",
+                            "last8",
+                            "description",
+                            "created_at",
+                            "expires_at",
+                        ],
+                    ),
+                ),
+            ],
+            index_attributes=["model", "api_key_model"],
+        )
         usages = self.create_table("usages_table", name="Usages")
 
         # Secrets
@@ -40,19 +91,27 @@ class BaseStack(Stack):
         )
 
     def create_table(
-        self, id: str, name: str, enable_ttl: bool = True, ttl_atribute: str = "ttl"
+        self,
+        id: str,
+        name: str,
+        enable_ttl: bool = True,
+        ttl_atribute: str = "ttl",
+        global_secondary_indexes: List[
+            dynamodb.CfnGlobalTable.GlobalSecondaryIndexProperty
+        ]
+        | None = None,
+        index_attributes: List[str] | None = None,  # string keys of the indexes
     ):
         cfn_global_table = dynamodb.CfnGlobalTable(
             self,
             id,
             attribute_definitions=[
                 dynamodb.CfnGlobalTable.AttributeDefinitionProperty(
-                    attribute_name="pk", attribute_type="S"
-                ),
-                dynamodb.CfnGlobalTable.AttributeDefinitionProperty(
-                    attribute_name="sk", attribute_type="S"
-                ),
+                    attribute_name=attribute_name, attribute_type="S"
+                )
+                for attribute_name in ["pk", "sk", *(index_attributes or [])]
             ],
+            global_secondary_indexes=global_secondary_indexes,
             key_schema=[
                 dynamodb.CfnGlobalTable.KeySchemaProperty(
                     attribute_name="pk", key_type="HASH"
@@ -60,17 +60,34 @@ class RegionalBaseStack(Stack):
                 ),
             ],
             nat_gateways=0,
-            gateway_endpoints={
-                "s3": ec2.GatewayVpcEndpointOptions(
-                    service=ec2.GatewayVpcEndpointAwsService.S3
-                ),
-                "dynamodb": ec2.GatewayVpcEndpointOptions(
-                    service=ec2.GatewayVpcEndpointAwsService.DYNAMODB
-                ),
-            },
-        )
-        self.vpc.add_interface_endpoint(
-            f"{prefix}-lambda-interface-endpoint",
-            service=ec2.InterfaceVpcEndpointAwsService.LAMBDA_,
-            subnets=ec2.SubnetSelection(subnets=self.vpc.private_subnets),
         )
+
+        # VPC endpoints, so that functions in the private subnets reach
+        # S3, DynamoDB, Lambda and Secrets Manager without leaving the VPC
+        self.gateway_endpoints = {
+            "s3": self.vpc.add_gateway_endpoint(
+                "s3",
+                service=ec2.GatewayVpcEndpointAwsService.S3,
+            ),
+            "dynamodb": self.vpc.add_gateway_endpoint(
+                "dynamodb",
+                service=ec2.GatewayVpcEndpointAwsService.DYNAMODB,
+            ),
+        }
+        self.interface_endpoints = {
+            "lambda": self.vpc.add_interface_endpoint(
+                f"{prefix}-lambda-interface-endpoint",
+                service=ec2.InterfaceVpcEndpointAwsService.LAMBDA_,
+                subnets=ec2.SubnetSelection(subnets=self.vpc.private_subnets),
+            ),
+            "secretsmanager": self.vpc.add_interface_endpoint(
+                f"{prefix}-secretsmanager-interface-endpoint",
+                service=ec2.InterfaceVpcEndpointAwsService.SECRETS_MANAGER,
+                subnets=ec2.SubnetSelection(subnets=self.vpc.private_subnets),
+            ),
+        }
+        for name, endpoint in {
+            **self.gateway_endpoints,
+            **self.interface_endpoints,
+        }.items():
+            add_tags(endpoint, {"endpoint": name})
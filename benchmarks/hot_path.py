@@ -0,0 +1,194 @@
+"""Measure the latency of the AWS calls on the inference hot path.
+
+The proxy function makes, per request, DynamoDB reads on the Models table,
+an S3 read of the preprocessing source (models with preprocessing), one or two
+Lambda invocations and a DynamoDB write to the Usages table. This script times
+the same calls so that the route they take (NAT gateway vs VPC endpoints) can
+be compared. Run it from a host in a private subnet of the regional VPC, once
+before and once after deploying the endpoints, then compare the two runs:
+
+    python benchmarks/hot_path.py run --label nat --username bench --model-name iris
+    python benchmarks/hot_path.py run --label endpoints --username bench --model-name iris
+    python benchmarks/hot_path.py compare hot_path_nat.json hot_path_endpoints.json
+
+The Lambda call invokes the execution function with an empty payload, so it
+measures the round trip to the Lambda service, not the model. Usage rows are
+written under the `<username>|<model>` partition with a `bench-` sort key
+prefix and deleted afterwards.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import boto3
+
+
+def percentile(durations: List[float], p: float) -> float:
+    ordered = sorted(durations)
+    return ordered[min(len(ordered) - 1, math.ceil(p * len(ordered)) - 1)]
+
+
+def summarize(durations: List[float]) -> dict:
+    return {
+        "n": len(durations),
+        "p50": statistics.median(durations),
+        "p95": percentile(durations, 0.95),
+        "mean": statistics.fmean(durations),
+    }
+
+
+def hot_path_calls(
+    prefix: str, region: str, username: str, model_name: str
+) -> Dict[str, Callable[[], None]]:
+    usages_table = boto3.resource("dynamodb", region_name=region).Table(
+        f"{prefix}_Usages"
+    )
+    s3 = boto3.client("s3", region_name=region)
+    lambda_ = boto3.client("lambda", region_name=region)
+
+    bucket = f"{prefix}-models-{region}"
+    key = f"{username}/{model_name}_preprocessing"
+    models_table = boto3.resource("dynamodb", region_name=region).Table(
+        f"{prefix}_Models"
+    )
+
+    def dynamodb_query():
+        # the model record and the API key record, as read by the proxy
+        models_table.get_item(Key={"pk": f"username|{username}", "sk": model_name})
+        models_table.get_item(
+            Key={"pk": f"username|{username}", "sk": "api_key|bench"},
+            ConsistentRead=True,
+        )
+
+    def dynamodb_put():
+        usages_table.put_item(
+            Item={
+                "pk": f"{username}|{model_name}",
+                "sk": f"bench-{datetime.utcnow().isoformat()}",
+                "status_code": 200,
+            }
+        )
+
+    def s3_put():
+        s3.put_object(Bucket=bucket, Key=f"{key}.bench", Body=b"bench")
+
+    def s3_get():
+        s3.get_object(Bucket=bucket, Key=f"{key}.bench")["Body"].read()
+
+    def lambda_invoke():
+        lambda_.invoke(
+            FunctionName=f"{prefix}_execution",
+            InvocationType="RequestResponse",
+            Payload=json.dumps({}),
+        )
+
+    return {
+        "dynamodb_query": dynamodb_query,
+        "dynamodb_put": dynamodb_put,
+        "s3_put": s3_put,
+        "s3_get": s3_get,
+        "lambda_invoke": lambda_invoke,
+    }
+
+
+def clean_up(prefix: str, region: str, username: str, model_name: str) -> None:
+    table = boto3.resource("dynamodb", region_name=region).Table(f"{prefix}_Usages")
+    pk = f"{username}|{model_name}"
+    response = table.query(
+        KeyConditionExpression="pk = :pk AND begins_with(sk, :sk)",
+        ExpressionAttributeValues={":pk": pk, ":sk": "bench-"},
+        ProjectionExpression="pk, sk",
+    )
+    with table.batch_writer() as batch:
+        for item in response["Items"]:
+            batch.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
+
+    boto3.client("s3", region_name=region).delete_object(
+        Bucket=f"{prefix}-models-{region}",
+        Key=f"{username}/{model_name}_preprocessing.bench",
+    )
+
+
+def run(args: argparse.Namespace) -> None:
+    calls = hot_path_calls(args.prefix, args.region, args.username, args.model_name)
+    results = {}
+    try:
+        for name, call in calls.items():
+            # the first calls pay for the TLS handshake and DNS resolution
+            for _ in range(args.warmup):
+                call()
+            durations = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                call()
+                durations.append((time.perf_counter() - start) * 1000)
+            results[name] = summarize(durations)
+            print(
+                f"{name:<16} p50 {results[name]['p50']:8.2f} ms"
+                f"  p95 {results[name]['p95']:8.2f} ms",
+                file=sys.stderr,
+            )
+    finally:
+        clean_up(args.prefix, args.region, args.username, args.model_name)
+
+    output = args.output or f"hot_path_{args.label}.json"
+    with open(output, "w") as f:
+        json.dump({"label": args.label, "region": args.region, "calls": results}, f)
+    print(f"wrote {output}", file=sys.stderr)
+
+
+def compare(args: argparse.Namespace) -> None:
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(
+        f"{'call':<16} {before['label'] + ' p50':>14} {after['label'] + ' p50':>14}"
+        f" {'delta':>8} {before['label'] + ' p95':>14} {after['label'] + ' p95':>14}"
+    )
+    for name, old in before["calls"].items():
+        new = after["calls"].get(name)
+        if new is None:
+            continue
+        delta = (new["p50"] - old["p50"]) / old["p50"] * 100
+        print(
+            f"{name:<16} {old['p50']:>14.2f} {new['p50']:>14.2f} {delta:>7.1f}%"
+            f" {old['p95']:>14.2f} {new['p95']:>14.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="time the hot-path calls")
+    run_parser.add_argument("--label", required=True)
+    run_parser.add_argument("--username", required=True)
+    run_parser.add_argument("--model-name", required=True)
+    run_parser.add_argument("--prefix", default="playingwithml")
+    run_parser.add_argument(
+        "--region", default=os.environ.get("AWS_REGION", "us-east-1")
+    )
+    run_parser.add_argument("--iterations", type=int, default=100)
+    run_parser.add_argument("--warmup", type=int, default=5)
+    run_parser.add_argument("--output")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two runs")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
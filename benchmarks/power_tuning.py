@@ -0,0 +1,506 @@
+"""Replay recorded API Gateway events against Lambda handlers and report
+latency and cost across memory sizes and architectures.
+
+Two modes:
+
+local   Runs each handler in-process against moto stand-ins for DynamoDB, S3,
+        SQS and Secrets Manager (seeded from fixtures.json). Wall-clock time
+        with at least one AWS call in flight is measured separately and
+        replaced by --service-latency-ms per wait (calls made in parallel
+        count as one wait); the remaining (CPU) time is projected onto each
+        memory size using Lambda's CPU allocation, which is proportional to
+        memory up to one vCPU at 1769 MB, and onto arm64 with --arm64-factor
+        (measure it with remote mode, there is no default). A handler that
+        raises or answers with an error status stops the run.
+
+remote  Reconfigures a deployed function for every (memory, architecture)
+        pair, invokes it with the recorded events and reads the billed
+        duration from the REPORT line of each invocation's log tail. The
+        original configuration is restored afterwards. Only use against dev.
+
+Examples:
+
+    python benchmarks/power_tuning.py local proxy ml_models_list_GET --arm64-factor 1.1
+    python benchmarks/power_tuning.py remote proxy --function-name playingwithml_proxy
+
+The output is a CSV of (handler, architecture, memory, p50, p95, cost) rows
+followed by a suggested FunctionProfile per handler for main/profiles.py.
+"""
+import argparse
+import csv
+import importlib
+import io
+import json
+import math
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC_DIR = ROOT / "src"
+EVENTS_DIR = Path(__file__).resolve().parent / "events"
+FIXTURES = Path(__file__).resolve().parent / "fixtures.json"
+
+sys.path.insert(0, str(ROOT))
+from main.profiles import FunctionProfile, get_profile  # noqa: E402
+
+MEMORY_SIZES = [128, 256, 512, 1024, 1769, 3008]
+ARCHITECTURES = ["x86_64", "arm64"]
+
+# USD, us-east-1
+_PRICE_PER_GB_SECOND = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+_PRICE_PER_REQUEST = 0.0000002
+_FULL_VCPU_MEMORY = 1769
+
+_PREFIX = "bench"
+_REGION = "us-east-1"
+_TABLES = ["Users", "Creds", "Models", "Usages", "Apis"]
+# global secondary indexes of base/base_stack.py: (sort key, projected attributes)
+_INDEXES = {
+    "Models": {
+        "models": (
+            "model",
+            ["library", "filetype", "created_at", "updated_at", "is_public"],
+        ),
+        "api_keys": (
+            "api_key_model",
+            [
+                "hashed_key",
+                "model_name",
+                "last8",
+                "description",
+                "created_at",
+                "expires_at",
+            ],
+        ),
+    },
+}
+
+
+class HandlerError(Exception):
+    """A handler raised or answered with an error status."""
+
+
+class Measurement(NamedTuple):
+    handler: str
+    architecture: str
+    memory_size: int
+    durations: List[float]  # milliseconds
+
+    @property
+    def p50(self) -> float:
+        return statistics.median(self.durations)
+
+    @property
+    def p95(self) -> float:
+        ordered = sorted(self.durations)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+    @property
+    def cost_per_million(self) -> float:
+        # Lambda bills per started millisecond
+        gb_seconds = [
+            math.ceil(d) / 1000 * self.memory_size / 1024 for d in self.durations
+        ]
+        per_invocation = statistics.mean(gb_seconds) * _PRICE_PER_GB_SECOND[
+            self.architecture
+        ] + (_PRICE_PER_REQUEST)
+        return per_invocation * 1_000_000
+
+
+def load_events(handler: str) -> List[dict]:
+    return json.loads((EVENTS_DIR / f"{handler}.json").read_text())
+
+
+# --------------------------------------------------------------------------- #
+# local mode
+# --------------------------------------------------------------------------- #
+class _Response:
+    status_code = 200
+    headers: dict = {}
+
+
+class LocalStandIns:
+    """moto-backed AWS resources shaped like a deployed stack."""
+
+    def __init__(self, fixtures: dict):
+        from moto import mock_aws
+
+        self.fixtures = fixtures
+        self.mock = mock_aws()
+        # wall-clock time with at least one AWS call in flight, and the number
+        # of such waits (parallel calls overlap into one)
+        self.service_waits = 0
+        self.service_time = 0.0
+        self.in_flight = 0
+        self.busy_since = 0.0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        os.environ.update(
+            {
+                "AWS_ACCESS_KEY_ID": "testing",
+                "AWS_SECRET_ACCESS_KEY": "testing",
+                "AWS_DEFAULT_REGION": _REGION,
+                "prefix": _PREFIX,
+                "region_name": _REGION,
+                "jwt_secret": "jwt_secret",
+                "domain_name": "playingwithml.com",
+                "hosted_zone_id": "Z0000000000000000000",
+                "lambda": f"arn:aws:lambda:{_REGION}:123456789012:function:{_PREFIX}_execution:prod",
+                "preprocessing_lambda": f"arn:aws:lambda:{_REGION}:123456789012:function:{_PREFIX}_preprocessing",
+            }
+        )
+        self.mock.start()
+        self.seed()
+        self.instrument()
+        return self
+
+    def __exit__(self, *exc):
+        self.mock.stop()
+
+    def seed(self):
+        import boto3
+
+        dynamodb = boto3.resource("dynamodb", region_name=_REGION)
+        for name in _TABLES:
+            indexes = _INDEXES.get(name, {})
+            params = {}
+            if indexes:
+                params["GlobalSecondaryIndexes"] = [
+                    {
+                        "IndexName": index_name,
+                        "KeySchema": [
+                            {"AttributeName": "pk", "KeyType": "HASH"},
+                            {"AttributeName": sort_key, "KeyType": "RANGE"},
+                        ],
+                        "Projection": {
+                            "ProjectionType": "INCLUDE",
+                            "NonKeyAttributes": attributes,
+                        },
+                    }
+                    for index_name, (sort_key, attributes) in indexes.items()
+                ]
+            table = dynamodb.create_table(
+                TableName=f"{_PREFIX}_{name}",
+                KeySchema=[
+                    {"AttributeName": "pk", "KeyType": "HASH"},
+                    {"AttributeName": "sk", "KeyType": "RANGE"},
+                ],
+                AttributeDefinitions=[
+                    {"AttributeName": attribute_name, "AttributeType": "S"}
+                    for attribute_name in [
+                        "pk",
+                        "sk",
+                        *(sort_key for sort_key, _ in indexes.values()),
+                    ]
+                ],
+                BillingMode="PAY_PER_REQUEST",
+                **params,
+            )
+            for item in self.fixtures.get(name, []):
+                table.put_item(Item=item)
+
+        s3 = boto3.client("s3", region_name=_REGION)
+        for bucket in ["models", "logs", "staging"]:
+            s3.create_bucket(Bucket=f"{_PREFIX}-{bucket}-{_REGION}")
+
+        sqs = boto3.client("sqs", region_name=_REGION)
+        queue = sqs.create_queue(
+            QueueName=f"{_PREFIX}-bench.fifo", Attributes={"FifoQueue": "true"}
+        )
+        os.environ["queue"] = queue["QueueUrl"]
+
+        self.jwt_secret = sha256(b"power-tuning").hexdigest()
+        secret = json.dumps({"current": self.jwt_secret, "previous": "unused"})
+        boto3.client("secretsmanager", region_name=_REGION).create_secret(
+            Name="jwt_secret", SecretString=secret
+        )
+
+    def instrument(self):
+        """Time every AWS call and stand in for the Lambda functions moto cannot run."""
+        import boto3
+        from botocore.response import StreamingBody
+
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        session = boto3.DEFAULT_SESSION
+        execution_output = json.dumps(self.fixtures["execution"]).encode()
+
+        def before(model, context, **kwargs):
+            with self.lock:
+                if not self.in_flight:
+                    self.busy_since = time.perf_counter()
+                    self.service_waits += 1
+                self.in_flight += 1
+            if model.service_model.service_name == "lambda" and model.name == "Invoke":
+                payload = StreamingBody(
+                    io.BytesIO(execution_output), len(execution_output)
+                )
+                return _Response(), {"StatusCode": 200, "Payload": payload}
+
+        def after(model, context, **kwargs):
+            with self.lock:
+                self.in_flight -= 1
+                if not self.in_flight:
+                    self.service_time += time.perf_counter() - self.busy_since
+
+        session.events.register("before-call.*.*", before)
+        session.events.register("after-call.*.*", after)
+        session.events.register("after-call-error.*.*", after)
+
+    def authorize(self, event: dict) -> dict:
+        import jwt
+        from datetime import datetime, timedelta
+
+        headers = dict(event.get("headers") or {})
+        if "Authorization" in headers:
+            payload = {"username": "bench", "exp": datetime.utcnow() + timedelta(1)}
+            token = jwt.encode(payload, self.jwt_secret, algorithm="HS256")
+            headers["Authorization"] = f"Bearer {token}"
+        return {**event, "headers": headers}
+
+
+def run_local(
+    handler: str,
+    events: List[dict],
+    stand_ins: LocalStandIns,
+    repetitions: int,
+    service_latency_ms: float,
+    arm64_factor: float,
+) -> List[Measurement]:
+    if str(SRC_DIR) not in sys.path:
+        sys.path.insert(0, str(SRC_DIR))
+
+    start = time.perf_counter()
+    module = importlib.import_module(handler)
+    init_ms = (time.perf_counter() - start) * 1000
+    print(f"# {handler}: import {init_ms:.1f} ms", file=sys.stderr)
+
+    def invoke(event: dict):
+        response = module.handler(event, None) or {}
+        if response.get("statusCode", 200) >= 400:
+            # a stand-in out of date with the code measures an error path
+            raise HandlerError(
+                f"{handler}: {response['statusCode']} {response.get('body')}"
+            )
+
+    # warm up, then record (cpu milliseconds, number of AWS waits) per invocation
+    for event in events:
+        invoke(stand_ins.authorize(event))
+
+    samples = []
+    for _ in range(repetitions):
+        for event in events:
+            event = stand_ins.authorize(event)
+            waits, service_time = stand_ins.service_waits, stand_ins.service_time
+            start = time.perf_counter()
+            invoke(event)
+            elapsed = time.perf_counter() - start
+            waits = stand_ins.service_waits - waits
+            service_time = stand_ins.service_time - service_time
+            samples.append(((elapsed - service_time) * 1000, waits))
+
+    measurements = []
+    for architecture in ARCHITECTURES:
+        factor = arm64_factor if architecture == "arm64" else 1.0
+        for memory_size in MEMORY_SIZES:
+            scale = max(1.0, _FULL_VCPU_MEMORY / memory_size) * factor
+            durations = [
+                cpu_ms * scale + waits * service_latency_ms for cpu_ms, waits in samples
+            ]
+            measurements.append(
+                Measurement(handler, architecture, memory_size, durations)
+            )
+    return measurements
+
+
+# --------------------------------------------------------------------------- #
+# remote mode
+# --------------------------------------------------------------------------- #
+_BILLED = re.compile(r"Billed Duration: (\d+) ms")
+
+
+def run_remote(
+    handler: str,
+    events: List[dict],
+    function_name: str,
+    repetitions: int,
+    token: str | None,
+) -> List[Measurement]:
+    import base64
+    import boto3
+
+    client = boto3.client("lambda")
+    waiter = client.get_waiter("function_updated")
+    function = client.get_function(FunctionName=function_name)
+    config = function["Configuration"]
+    original_memory = config["MemorySize"]
+    original_architecture = config.get("Architectures", ["x86_64"])[0]
+
+    code = None
+    if config.get("PackageType", "Zip") == "Zip":
+        with urllib.request.urlopen(function["Code"]["Location"]) as response:
+            code = response.read()
+
+    def set_architecture(architecture: str):
+        client.update_function_code(
+            FunctionName=function_name, ZipFile=code, Architectures=[architecture]
+        )
+        waiter.wait(FunctionName=function_name)
+
+    def set_memory(memory_size: int):
+        client.update_function_configuration(
+            FunctionName=function_name, MemorySize=memory_size
+        )
+        waiter.wait(FunctionName=function_name)
+
+    if token:
+        events = [
+            {**e, "headers": {**e["headers"], "Authorization": f"Bearer {token}"}}
+            if "Authorization" in (e.get("headers") or {})
+            else e
+            for e in events
+        ]
+
+    measurements = []
+    try:
+        for architecture in ARCHITECTURES:
+            if architecture != original_architecture:
+                if code is None:
+                    print(f"# {handler}: image functions cannot switch architecture")
+                    continue
+                set_architecture(architecture)
+            for memory_size in MEMORY_SIZES:
+                set_memory(memory_size)
+                durations = []
+                for k in range(repetitions + 1):
+                    for event in events:
+                        response = client.invoke(
+                            FunctionName=function_name,
+                            Payload=json.dumps(event),
+                            LogType="Tail",
+                        )
+                        logs = base64.b64decode(response["LogResult"]).decode()
+                        billed = _BILLED.search(logs)
+                        # the first round absorbs the cold start
+                        if k and billed:
+                            durations.append(float(billed.group(1)))
+                measurements.append(
+                    Measurement(handler, architecture, memory_size, durations)
+                )
+    finally:
+        if code is not None:
+            set_architecture(original_architecture)
+        set_memory(original_memory)
+
+    return measurements
+
+
+# --------------------------------------------------------------------------- #
+# output
+# --------------------------------------------------------------------------- #
+def recommend(measurements: List[Measurement], tolerance: float) -> Measurement | None:
+    """Cheapest configuration whose p95 is within `tolerance` of the fastest one."""
+    if not measurements:
+        return None
+    # compare in billed (whole) milliseconds so sub-millisecond handlers are not
+    # pushed to large memory sizes for no measurable gain
+    fastest = math.ceil(min(m.p95 for m in measurements) * (1 + tolerance))
+    candidates = [m for m in measurements if math.ceil(m.p95) <= fastest]
+    return min(candidates, key=lambda m: (m.cost_per_million, m.p95))
+
+
+def write_csv(measurements: List[Measurement], output: io.TextIOBase):
+    writer = csv.writer(output)
+    writer.writerow(
+        ["handler", "architecture", "memory_mb", "p50_ms", "p95_ms", "usd_per_1m"]
+    )
+    for m in measurements:
+        writer.writerow(
+            [
+                m.handler,
+                m.architecture,
+                m.memory_size,
+                f"{m.p50:.1f}",
+                f"{m.p95:.1f}",
+                f"{m.cost_per_million:.4f}",
+            ]
+        )
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["local", "remote"])
+    parser.add_argument("handlers", nargs="*", help="default: every recorded event")
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--output", help="CSV file (default: stdout)")
+    parser.add_argument("--service-latency-ms", type=float, default=8.0)
+    parser.add_argument(
+        "--arm64-factor",
+        type=float,
+        help="local mode (required): arm64 CPU time relative to x86_64, e.g."
+        " the ratio of their p50s measured in remote mode",
+    )
+    parser.add_argument("--function-name", help="remote mode: deployed function")
+    parser.add_argument("--token", help="remote mode: JWT for Authorization headers")
+    args = parser.parse_args(argv)
+
+    handlers = args.handlers or sorted(p.stem for p in EVENTS_DIR.glob("*.json"))
+    if args.mode == "remote" and (len(handlers) != 1 or not args.function_name):
+        parser.error("remote mode takes exactly one handler and --function-name")
+    if args.mode == "local" and not args.arm64_factor:
+        parser.error("local mode takes --arm64-factor")
+
+    results: Dict[str, List[Measurement]] = {}
+    if args.mode == "local":
+        fixtures = json.loads(FIXTURES.read_text())
+        with LocalStandIns(fixtures) as stand_ins:
+            for handler in handlers:
+                results[handler] = run_local(
+                    handler,
+                    load_events(handler),
+                    stand_ins,
+                    repetitions=args.repetitions,
+                    service_latency_ms=args.service_latency_ms,
+                    arm64_factor=args.arm64_factor,
+                )
+    else:
+        handler = handlers[0]
+        results[handler] = run_remote(
+            handler,
+            load_events(handler),
+            function_name=args.function_name,
+            repetitions=args.repetitions,
+            token=args.token,
+        )
+
+    measurements = [m for rows in results.values() for m in rows]
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            write_csv(measurements, output)
+    else:
+        write_csv(measurements, sys.stdout)
+
+    print("\n# suggested profiles (main/profiles.py)")
+    for handler, rows in results.items():
+        best = recommend(rows, args.tolerance)
+        if not best:
+            continue
+        current: FunctionProfile = get_profile(handler)
+        suggested = current._replace(
+            memory_size=best.memory_size, architecture=best.architecture
+        )
+        print(f'    "{handler}": {suggested!r},  # p95 {best.p95:.0f} ms')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import ast
+import io
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Set
+
+SRC_DIR = Path(__file__).resolve().parent / "src"
+BUNDLES_DIR = Path(__file__).resolve().parent / ".bundles"
+
+
+class BundleReport(NamedTuple):
+    handler: str
+    files: int
+    size: int
+    zipped_size: int
+    import_time: float | None
+    error: str | None
+
+
+def local_modules(src: Path = SRC_DIR) -> Dict[str, Path]:
+    """Return a mapping of dotted module names to the files under `src`."""
+    modules = {}
+    for path in sorted(src.rglob("*.py")):
+        parts = path.relative_to(src).with_suffix("").parts
+        if "__pycache__" in parts:
+            continue
+        if parts[-1] == "__init__":
+            parts = parts[:-1]
+        if parts:
+            modules[".".join(parts)] = path
+    return modules
+
+
+def imported_names(path: Path, module: str) -> Set[str]:
+    """Return every dotted name `module` could be importing (modules or attributes)."""
+    tree = ast.parse(path.read_text(), filename=str(path))
+    package = module if path.name == "__init__.py" else module.rpartition(".")[0]
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                anchor = package.split(".") if package else []
+                anchor = anchor[: len(anchor) - (node.level - 1)]
+                base = ".".join([*anchor, base] if base else anchor)
+            names.add(base)
+            # `from helpers import cors` imports the submodule helpers.cors
+            names.update(
+                f"{base}.{alias.name}" if base else alias.name for alias in node.names
+            )
+    return names
+
+
+def import_closure(handler: str, src: Path = SRC_DIR) -> Set[str]:
+    """Return the local modules (under `src`) that `handler` transitively imports."""
+    modules = local_modules(src)
+    if handler not in modules:
+        raise Exception(f"Handler module '{handler}' not found in {src}")
+
+    closure, pending = set(), [handler]
+    while pending:
+        module = pending.pop()
+        if module in closure:
+            continue
+        closure.add(module)
+
+        # importing a.b.c also imports the packages a and a.b
+        parts = module.split(".")
+        pending.extend(
+            ".".join(parts[:k])
+            for k in range(1, len(parts))
+            if ".".join(parts[:k]) in modules
+        )
+
+        for name in imported_names(modules[module], module):
+            if name in modules:
+                pending.append(name)
+    return closure
+
+
+def bundle(handler: str, src: Path = SRC_DIR, out: Path = BUNDLES_DIR) -> str:
+    """Copy the import closure of `handler` into its own asset directory and return its path."""
+    modules = local_modules(src)
+    dest = out / handler
+    shutil.rmtree(dest, ignore_errors=True)
+    for module in import_closure(handler, src):
+        source = modules[module]
+        target = dest / source.relative_to(src)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(source, target)
+    return str(dest)
+
+
+def measure_import_time(handler: str, path: str) -> tuple[float | None, str | None]:
+    # import in a fresh interpreter so that nothing is already cached
+    code = "\n".join(
+        [
+            "import importlib, time",
+            "start = time.perf_counter()",
+            f"importlib.import_module({handler!r})",
+            "print(time.perf_counter() - start)",
+        ]
+    )
+    env = {**os.environ, "PYTHONPATH": path}
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=path,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return None, lines[-1] if lines else f"exit code {result.returncode}"
+    return float(result.stdout.strip().splitlines()[-1]), None
+
+
+def report(handler: str, out: Path = BUNDLES_DIR) -> BundleReport:
+    path = bundle(handler, out=out)
+    files = [p for p in Path(path).rglob("*") if p.is_file()]
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for file in files:
+            archive.write(file, file.relative_to(path))
+
+    import_time, error = measure_import_time(handler, path)
+    return BundleReport(
+        handler=handler,
+        files=len(files),
+        size=sum(file.stat().st_size for file in files),
+        zipped_size=len(buffer.getvalue()),
+        import_time=import_time,
+        error=error,
+    )
+
+
+def handlers(src: Path = SRC_DIR) -> List[str]:
+    """Return every top-level module in `src` that defines a `handler` function."""
+    names = []
+    for module, path in local_modules(src).items():
+        if "." in module or path.name == "__init__.py":
+            continue
+        tree = ast.parse(path.read_text(), filename=str(path))
+        if any(
+            isinstance(node, ast.FunctionDef) and node.name == "handler"
+            for node in tree.body
+        ):
+            names.append(module)
+    return names
+
+
+if __name__ == "__main__":
+    # usage: python bundling.py [handler ...]
+    #
+    # Import times are measured with the current environment, so set the
+    # environment variables a handler reads at import time (prefix,
+    # region_name, ...) and AWS credentials to get a number for it.
+    selected = sys.argv[1:] or handlers()
+    whole = sum(p.stat().st_size for p in SRC_DIR.rglob("*.py"))
+    print(f"src/ total: {whole} bytes")
+    print(
+        f"{'handler':<32} {'files':>5} {'bytes':>8} {'zipped':>8} {'import (ms)':>12}"
+    )
+    for name in selected:
+        row = report(name)
+        import_time = (
+            f"{row.import_time * 1000:.1f}" if row.import_time is not None else "-"
+        )
+        print(
+            f"{row.handler:<32} {row.files:>5} {row.size:>8} {row.zipped_size:>8} {import_time:>12}"
+            + (f"  ({row.error})" if row.error else "")
+        )
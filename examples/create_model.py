@@ -1,3 +1,5 @@
+import base64
+import hashlib
 import requests
 from pprint import pprint
 
@@ -8,6 +10,12 @@ model_type = "tensorflow"
 persistence_type = "h5"
 is_public = False
 
+# Assumes: there is a 'model.h5' file in this directory
+with open("model.h5", "rb") as f:
+    content = f.read()
+# base64 SHA-256 of the file: S3 rejects an upload that does not match it
+checksum = base64.b64encode(hashlib.sha256(content).digest()).decode()
+
 # Create model
 http_response = requests.put(
     url=(
@@ -17,14 +25,13 @@ http_response = requests.put(
         f"&is_public={is_public}"
     ),
     headers={"Authorization": f"Bearer {token}"},
+    json={"checksum": checksum},
 )
 x = http_response.json()
 pprint(x)
 
 # Upload h5 file to update mode
-# Assumes: there is a 'model.h5' file in this directory
-response = requests.post(
-    x["url"], data=x["fields"], files={"file": open("model.h5", "rb")}
-)
+model = x["model"]
+response = requests.post(model["url"], data=model["fields"], files={"file": content})
 
 print(response.status_code)
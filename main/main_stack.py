@@ -1,15 +1,21 @@
 from typing import NamedTuple, Tuple, List, Dict
 from tagging import add_tags
+from bundling import bundle
+from main.profiles import get_profile
 import aws_cdk as cdk
 from aws_cdk import (
     Duration,
     RemovalPolicy,
     Stack,
     aws_apigateway as apigw,
+    aws_apigatewayv2 as apigwv2,
     aws_certificatemanager as acm,
+    aws_cloudwatch as cloudwatch,
     aws_dynamodb as dynamodb,
     aws_ec2 as ec2,
     aws_ecr as ecr,
+    aws_events as events,
+    aws_events_targets as events_targets,
     aws_iam as iam,
     aws_lambda as lambda_,
     aws_lambda_event_sources as event_sources,
@@ -19,6 +25,7 @@ from aws_cdk import (
     aws_sns as sns,
     aws_sns_subscriptions as sns_subs,
     aws_sqs as sqs,
+    custom_resources as cr,
 )
 from constructs import Construct
 from enum import Enum
@@ -47,9 +54,20 @@ _APIGW_FULL_PERMISSION_POLICY = "AmazonAPIGatewayAdministrator"
 _IAM_FULL_PERMISSION_POLICY = "IAMFullAccess"
 _SNS_FULL_PERMISSION_POLICY = "AmazonSNSFullAccess"
 
+_ARCHITECTURES = {
+    "x86_64": lambda_.Architecture.X86_64,
+    "arm64": lambda_.Architecture.ARM_64,
+}
+
 _JWT_SECRET_NAME = "jwt_secret"
 _USER_API = "user-api"
 
+# reserved concurrency of the functions calling the control-plane APIs through
+# src/helpers/throttling.py, whose token buckets are per execution environment
+_NEW_USER_CONCURRENCY = 2
+_DELETE_USER_CONCURRENCY = 2
+_DNS_CHANGES_CONCURRENCY = 1  # per region
+
 
 # https://aws-sdk-pandas.readthedocs.io/en/stable/layers.html
 # for python 3.10
@@ -104,14 +122,76 @@ class RouteResource:
 
 
 class MainStack(Stack):
-    def import_dynamodb_table(self, name: str) -> dynamodb.ITable:
+    def import_dynamodb_table(
+        self, name: str, global_indexes: List[str] | None = None
+    ) -> dynamodb.ITable:
+        if global_indexes:
+            # grants then cover the indexes too
+            return dynamodb.Table.from_table_attributes(
+                self,
+                name,
+                table_name=f"{self.prefix}_{name}",
+                global_indexes=global_indexes,
+            )
         return dynamodb.Table.from_table_name(self, name, f"{self.prefix}_{name}")
 
     def import_databases(self):
         self.users: dynamodb.ITable = self.import_dynamodb_table("Users")
         self.creds: dynamodb.ITable = self.import_dynamodb_table("Creds")
-        self.models: dynamodb.ITable = self.import_dynamodb_table("Models")
+        self.models: dynamodb.ITable = self.import_dynamodb_table(
+            "Models", global_indexes=["models", "api_keys"]
+        )
         self.usages: dynamodb.ITable = self.import_dynamodb_table("Usages")
+        self.apis: dynamodb.ITable = self.import_dynamodb_table("Apis")
+
+    def import_table_stream(self, table: dynamodb.ITable) -> dynamodb.ITable:
+        """The table with the ARN of its stream in this region (the stream of
+        a replica is only known once the replica exists)."""
+        name = table.node.id
+        describe_table = cr.AwsSdkCall(
+            service="DynamoDB",
+            action="describeTable",
+            parameters={"TableName": table.table_name},
+            physical_resource_id=cr.PhysicalResourceId.from_response(
+                "Table.LatestStreamArn"
+            ),
+            output_paths=["Table.LatestStreamArn"],
+        )
+        stream = cr.AwsCustomResource(
+            self,
+            f"{name}_stream",
+            on_create=describe_table,
+            on_update=describe_table,
+            policy=cr.AwsCustomResourcePolicy.from_sdk_calls(
+                resources=[table.table_arn]
+            ),
+        )
+        return dynamodb.Table.from_table_attributes(
+            self,
+            f"{name}_with_stream",
+            table_name=table.table_name,
+            table_stream_arn=stream.get_response_field("Table.LatestStreamArn"),
+        )
+
+    def create_aggregates_table(self) -> dynamodb.Table:
+        # regional: each region counts the writes its replicas receive
+        # (see src/helpers/aggregates.py)
+        table = dynamodb.Table(
+            self,
+            "aggregates_table",
+            table_name=f"{self.prefix}_Aggregates",
+            partition_key=dynamodb.Attribute(
+                name="pk", type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(name="sk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            point_in_time_recovery=True,
+            time_to_live_attribute="ttl",
+            removal_policy=RemovalPolicy.RETAIN,
+        )
+        add_tags(table, {"table": "Aggregates"})
+        return table
 
     def import_secrets(self):
         self.jwt_secret = sm.Secret.from_secret_name_v2(
@@ -146,6 +226,14 @@ class MainStack(Stack):
         )
         return zone
 
+    def resource_profile(self, name: str) -> dict:
+        profile = get_profile(name)
+        return {
+            "memory_size": profile.memory_size,
+            "architecture": _ARCHITECTURES[profile.architecture],
+            "timeout": Duration.seconds(profile.timeout),
+        }
+
     def create_lambda(
         self,
         id: str,
@@ -158,6 +246,7 @@ class MainStack(Stack):
         env = {table.table_name: table.table_arn for (table, _) in tables or []}
         env["region_name"] = self.region_name
         env["prefix"] = self.prefix
+        env["legacy_models_layout"] = str(self.legacy_models_layout).lower()
         if queue:
             env["queue"] = queue.queue_url
 
@@ -167,11 +256,11 @@ class MainStack(Stack):
             id,
             function_name=f"{self.prefix}_{id}",
             runtime=lambda_.Runtime.PYTHON_3_10,
-            code=lambda_.Code.from_asset("src"),
+            code=lambda_.Code.from_asset(bundle(id)),
             handler=f"{id}.handler",
             environment=env,
-            timeout=Duration.seconds(29),
             layers=layers or [],
+            **self.resource_profile(id),
         )
         add_tags(_lambda, {"lambda": id})
 
@@ -195,6 +284,31 @@ class MainStack(Stack):
 
         return _lambda
 
+    def create_dead_letter_queue(
+        self, name: str, max_receive_count: int, fifo: bool = False
+    ) -> sqs.DeadLetterQueue:
+        """Dead-letter queue of the queue `name`, with an alarm as soon as it
+        holds a message."""
+        queue = sqs.Queue(
+            self,
+            f"{name}_dead_letter_queue",
+            retention_period=Duration.days(14),
+            fifo=fifo or None,
+        )
+        add_tags(queue, {"queue": f"{name}_dead_letter"})
+        queue.metric_approximate_number_of_messages_visible(
+            period=Duration.minutes(5), statistic="Maximum"
+        ).create_alarm(
+            self,
+            f"{name}_dead_letter_alarm",
+            alarm_name=f"{self.prefix}-{name}-dead-letters-{self.region_name}",
+            threshold=1,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+        return sqs.DeadLetterQueue(max_receive_count=max_receive_count, queue=queue)
+
     def add(
         self,
         path: str,
@@ -220,6 +334,11 @@ class MainStack(Stack):
                 fifo=True,
                 content_based_deduplication=False,
                 deduplication_scope=sqs.DeduplicationScope.MESSAGE_GROUP,
+                # new_user redelivers a message every 5 to 30 s while
+                # provisioning waits (about 1.5 h in all)
+                dead_letter_queue=self.create_dead_letter_queue(
+                    resource_name, max_receive_count=200, fifo=True
+                ),
             )
             if create_queue
             else None
@@ -283,6 +402,9 @@ class MainStack(Stack):
                 # "/ml-models/{model_name}/preprocessing",
                 "/ml-models/{model_name}/logs",
                 "/ml-models/{model_name}/logs/{log_timestamp}",
+                "/ml-models/{model_name}/metrics",
+                "/ml-models/{model_name}/uploads",
+                "/ml-models/{model_name}/uploads/{upload_id}",
                 "/sessions",
                 "/users",
             ],
@@ -309,6 +431,7 @@ class MainStack(Stack):
             create_queue=True,
         )
         POST_users.lambda_function.add_environment("domain_name", self.domain_name)
+        self.aggregates.grant_read_data(POST_users.lambda_function)
         POST_users.lambda_function.add_environment(
             "hosted_zone_id", self.hosted_zone.hosted_zone_id
         )
@@ -671,6 +794,7 @@ class MainStack(Stack):
             tables=[
                 (self.users, _READ),
                 (self.creds, _READ),
+                (self.models, _READ),
                 (self.usages, _READ_WRITE),
             ],
             secrets=[("jwt_secret", self.jwt_secret)],
@@ -691,6 +815,62 @@ class MainStack(Stack):
             layers=[self.py_jwt_layer],
         )
 
+        # ml-models - metrics (rollups of the Aggregates table)
+        OPTIONS_ml_models_metrics = self.add(
+            "/ml-models/{model_name}/metrics",
+            "OPTIONS",
+            "ml-models-metrics",
+            filename_overwrite="ml_models_metrics_OPTIONS",
+        )
+        GET_ml_models_metrics = self.add(
+            "/ml-models/{model_name}/metrics",
+            "GET",
+            "ml-models-metrics",
+            filename_overwrite="ml_models_metrics_GET",
+            tables=[
+                (self.users, _READ),
+                (self.creds, _READ),
+                (self.models, _READ),
+            ],
+            secrets=[("jwt_secret", self.jwt_secret)],
+            layers=[self.py_jwt_layer],
+        )
+        self.aggregates.grant_read_data(GET_ml_models_metrics.lambda_function)
+
+        # ml-models - multipart uploads
+        OPTIONS_ml_models_uploads = self.add(
+            "/ml-models/{model_name}/uploads",
+            "OPTIONS",
+            "ml-models-uploads",
+            filename_overwrite="ml_models_uploads_OPTIONS",
+        )
+        OPTIONS_ml_models_uploads_proxy = self.add(
+            "/ml-models/{model_name}/uploads/{upload_id}",
+            "OPTIONS",
+            "ml-models-uploads-id",
+            filename_overwrite="ml_models_uploads_proxy_OPTIONS",
+        )
+        for path, http_method in [
+            ("/ml-models/{model_name}/uploads", "POST"),
+            ("/ml-models/{model_name}/uploads/{upload_id}", "GET"),
+            ("/ml-models/{model_name}/uploads/{upload_id}", "PUT"),
+            ("/ml-models/{model_name}/uploads/{upload_id}", "DELETE"),
+        ]:
+            self.add(
+                path,
+                http_method,
+                "ml-models-uploads",
+                filename_overwrite=f"ml_models_uploads_{http_method}",
+                tables=[
+                    (self.users, _READ),
+                    (self.creds, _READ),
+                    (self.models, _READ),
+                ],
+                buckets=[(self.staging_bucket, _READ_WRITE)],
+                secrets=[("jwt_secret", self.jwt_secret)],
+                layers=[self.py_jwt_layer],
+            )
+
         # DNS records
         target = route53.CfnRecordSet.AliasTargetProperty(
             dns_name=domain_name.domain_name_alias_domain_name,
@@ -722,28 +902,90 @@ class MainStack(Stack):
             },
         )
 
+    def create_dns_changes_lambda(
+        self, regions: List[str]
+    ) -> Tuple[lambda_.Function, sqs.Queue]:
+        # Route 53 changes of the user APIs, applied in batches: Route 53
+        # allows 5 requests per second per account
+        dns_queue = sqs.Queue(
+            self,
+            "dns_changes_queue",
+            visibility_timeout=Duration.minutes(4),
+            retention_period=Duration.hours(12),
+            dead_letter_queue=self.create_dead_letter_queue(
+                "dns_changes", max_receive_count=5
+            ),
+        )
+        add_tags(dns_queue, {"queue": "dns_changes"})
+        dns_changes_lambda = lambda_.Function(
+            self,
+            "dns_changes_lambda",
+            function_name=f"{self.prefix}_dns_changes",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(bundle("dns_changes")),
+            handler="dns_changes.handler",
+            environment={
+                "prefix": self.prefix,
+                "dns_queue": dns_queue.queue_url,
+                # the Route 53 quota is per account: shared by every region
+                "throttling_share": str(_DNS_CHANGES_CONCURRENCY * len(regions)),
+            },
+            # one batch at a time per region
+            reserved_concurrent_executions=_DNS_CHANGES_CONCURRENCY,
+            **self.resource_profile("dns_changes"),
+        )
+        add_tags(dns_changes_lambda, {"lambda": "dns_changes"})
+        dns_changes_lambda.add_event_source(
+            event_sources.SqsEventSource(
+                dns_queue,
+                batch_size=500,
+                max_batching_window=Duration.seconds(10),
+                report_batch_item_failures=True,
+            )
+        )
+        self.apis.grant_read_write_data(dns_changes_lambda)
+        dns_changes_lambda.role.add_managed_policy(
+            iam.ManagedPolicy.from_aws_managed_policy_name(
+                _ROUTE_53_FULL_PERMISSION_POLICY
+            )
+        )
+
+        return dns_changes_lambda, dns_queue
+
     def create_new_user_lambda(self) -> lambda_.Function:
         new_user_lambda = lambda_.Function(
             self,
             "new_user_lambda",
             function_name=f"{self.prefix}_new_user",
             runtime=lambda_.Runtime.PYTHON_3_10,
-            code=lambda_.Code.from_asset("src"),
+            code=lambda_.Code.from_asset(bundle("new_user")),
             handler="new_user.handler",
-            timeout=Duration.seconds(300),
             environment={
                 "hosted_zone_id": self.hosted_zone.hosted_zone_id,
+                "prefix": self.prefix,
                 "region_name": self.region_name,
                 "queue": self.POST_signup.queue.queue_url,
+                "dns_queue": self.dns_queue.queue_url,
+                "tenant_api": self.tenant_api,
+                # API Gateway and ACM quotas (per account and region) are
+                # shared with delete_user
+                "throttling_share": str(
+                    _NEW_USER_CONCURRENCY + _DELETE_USER_CONCURRENCY
+                ),
             },
             layers=[],
-            reserved_concurrent_executions=2,
+            reserved_concurrent_executions=_NEW_USER_CONCURRENCY,
+            **self.resource_profile("new_user"),
         )
         add_tags(new_user_lambda, {"lambda": "new_user_lambda"})
+        self.apis.grant_read_write_data(new_user_lambda)
+        self.dns_queue.grant_send_messages(new_user_lambda)
         self.POST_signup.queue.grant_consume_messages(new_user_lambda)
         self.POST_signup.queue.grant_send_messages(new_user_lambda)
         new_user_lambda.add_event_source(
-            event_sources.SqsEventSource(self.POST_signup.queue, batch_size=1)
+            event_sources.SqsEventSource(
+                self.POST_signup.queue, batch_size=1, report_batch_item_failures=True
+            )
         )
         permissions = [
             _ACM_FULL_PERMISSION_POLICY,
@@ -767,25 +1009,43 @@ class MainStack(Stack):
             fifo=True,
             content_based_deduplication=False,
             deduplication_scope=sqs.DeduplicationScope.MESSAGE_GROUP,
+            # failed teardowns are retried with backoff up to 15 minutes
+            dead_letter_queue=self.create_dead_letter_queue(
+                "delete_user", max_receive_count=20, fifo=True
+            ),
         )
         delete_user_lambda = lambda_.Function(
             self,
             "delete_user_lambda",
             function_name=f"{self.prefix}_delete_user",
             runtime=lambda_.Runtime.PYTHON_3_10,
-            code=lambda_.Code.from_asset("src"),
+            code=lambda_.Code.from_asset(bundle("delete_user")),
             handler="delete_user.handler",
-            timeout=Duration.seconds(300),
             environment={
                 "hosted_zone_id": self.hosted_zone.hosted_zone_id,
+                "prefix": self.prefix,
                 "region_name": self.region_name,
                 "queue": delete_queue.queue_url,
+                "dns_queue": self.dns_queue.queue_url,
+                # API Gateway and ACM quotas (per account and region) are
+                # shared with new_user
+                "throttling_share": str(
+                    _NEW_USER_CONCURRENCY + _DELETE_USER_CONCURRENCY
+                ),
             },
             layers=[],
-            reserved_concurrent_executions=2,
+            reserved_concurrent_executions=_DELETE_USER_CONCURRENCY,
+            **self.resource_profile("delete_user"),
         )
+        self.apis.grant_read_write_data(delete_user_lambda)
+        self.dns_queue.grant_send_messages(delete_user_lambda)
         delete_queue.grant_send_messages(delete_user_lambda)
         delete_queue.grant_consume_messages(delete_user_lambda)
+        delete_user_lambda.add_event_source(
+            event_sources.SqsEventSource(
+                delete_queue, batch_size=10, report_batch_item_failures=True
+            )
+        )
         permissions = [
             _ACM_FULL_PERMISSION_POLICY,
             _SQS_FULL_PERMISSION_POLICY,
@@ -799,6 +1059,126 @@ class MainStack(Stack):
 
         return delete_user_lambda
 
+    def create_delete_model_lambda(self, regions: List[str]) -> lambda_.Function:
+        # deletes the usages, logs and files of deleted models in the background;
+        # a cleanup that keeps failing ends up in the dead-letter queue
+        cleanup_queue = sqs.Queue(
+            self,
+            "delete_model_queue",
+            visibility_timeout=Duration.minutes(15),
+            retention_period=Duration.days(4),
+            fifo=True,
+            content_based_deduplication=False,
+            deduplication_scope=sqs.DeduplicationScope.MESSAGE_GROUP,
+            dead_letter_queue=self.create_dead_letter_queue(
+                "delete_model", max_receive_count=5, fifo=True
+            ),
+        )
+        add_tags(cleanup_queue, {"queue": "delete_model"})
+        delete_model_lambda = lambda_.Function(
+            self,
+            "delete_model_lambda",
+            function_name=f"{self.prefix}_delete_model",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(bundle("delete_model")),
+            handler="delete_model.handler",
+            environment={
+                "prefix": self.prefix,
+                "queue": cleanup_queue.queue_url,
+                "legacy_models_layout": str(self.legacy_models_layout).lower(),
+                **{f"region_{k}": region for k, region in enumerate(regions)},
+            },
+            **self.resource_profile("delete_model"),
+        )
+        add_tags(delete_model_lambda, {"lambda": "delete_model"})
+        cleanup_queue.grant_send_messages(delete_model_lambda)
+        delete_model_lambda.add_event_source(
+            event_sources.SqsEventSource(cleanup_queue, batch_size=1)
+        )
+        self.models.grant_read_write_data(delete_model_lambda)
+        self.usages.grant_read_write_data(delete_model_lambda)
+        buckets = [
+            f"arn:aws:s3:::{self.prefix}-{kind}-{region}"
+            for kind in ["models", "logs"]
+            for region in regions
+        ]
+        delete_model_lambda.add_to_role_policy(
+            iam.PolicyStatement(actions=["s3:ListBucket"], resources=buckets)
+        )
+        delete_model_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["s3:GetObject", "s3:DeleteObject"],
+                resources=[f"{bucket}/*" for bucket in buckets],
+            )
+        )
+
+        # DELETE /ml-models/{model_name} schedules the cleanup
+        DELETE_ml_models = self.DELETE_ml_models.lambda_function
+        DELETE_ml_models.add_environment("queue", cleanup_queue.queue_url)
+        cleanup_queue.grant_send_messages(DELETE_ml_models)
+
+        return delete_model_lambda
+
+    def create_aggregates_lambda(self) -> lambda_.Function:
+        # applies the counts of the Users, Models and Usages streams to the
+        # Aggregates table; batches that keep failing are recorded in a queue
+        failures_queue = sqs.Queue(
+            self,
+            "aggregates_failures_queue",
+            retention_period=Duration.days(14),
+        )
+        add_tags(failures_queue, {"queue": "aggregates_failures"})
+        aggregates_lambda = lambda_.Function(
+            self,
+            "aggregates_lambda",
+            function_name=f"{self.prefix}_aggregates",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(bundle("aggregates")),
+            handler="aggregates.handler",
+            environment={
+                "prefix": self.prefix,
+                "region_name": self.region_name,
+                "legacy_models_layout": str(self.legacy_models_layout).lower(),
+            },
+            **self.resource_profile("aggregates"),
+        )
+        add_tags(aggregates_lambda, {"lambda": "aggregates"})
+        self.aggregates.grant_write_data(aggregates_lambda)
+
+        inserts_and_removes = lambda_.FilterCriteria.filter(
+            {"eventName": lambda_.FilterRule.or_("INSERT", "REMOVE")}
+        )
+        inserts = lambda_.FilterCriteria.filter(
+            {"eventName": lambda_.FilterRule.is_equal("INSERT")}
+        )
+        # a batch updates at most 100 aggregates (one transaction): a user
+        # record updates one, a model record one, a usage record three (its
+        # minute, hour and day rollups)
+        for table, filters, batch_size in [
+            (self.users, [inserts_and_removes], 100),
+            (self.models, None, 100),
+            (self.usages, [inserts], 33),
+        ]:
+            aggregates_lambda.add_event_source(
+                event_sources.DynamoEventSource(
+                    self.import_table_stream(table),
+                    starting_position=lambda_.StartingPosition.LATEST,
+                    batch_size=batch_size,
+                    max_batching_window=Duration.seconds(1),
+                    # a retried batch must be the same batch (idempotency)
+                    bisect_batch_on_error=False,
+                    retry_attempts=10,
+                    # and must be retried while DynamoDB still knows the
+                    # transaction's token (10 minutes, less the timeout of
+                    # the last attempt)
+                    max_record_age=Duration.minutes(9),
+                    on_failure=event_sources.SqsDlq(failures_queue),
+                    filters=filters,
+                )
+            )
+
+        return aggregates_lambda
+
     def create_proxy_lambda(self) -> Tuple[lambda_.Alias, LambdaQueueTuple]:
         execution_lambda = lambda_.DockerImageFunction(
             self,
@@ -814,15 +1194,14 @@ class MainStack(Stack):
             ),
             vpc=self.vpc,
             vpc_subnets=ec2.SubnetSelection(subnets=self.subnets.subnets),
-            timeout=Duration.seconds(28),
             environment={
                 "region_name": self.region_name,
                 "bucket": self.models_bucket.bucket_name,
                 "base_image": self.lambda_image_digest,
                 "domain_name": self.domain_name,
             },
-            memory_size=3008,
             security_groups=[self.sg],
+            **self.resource_profile("execution"),
         )
         add_tags(execution_lambda, {"lambda": "execution"})
         execution_version = execution_lambda.current_version
@@ -845,11 +1224,10 @@ class MainStack(Stack):
             "preprocessing_lambda",
             function_name=f"{self.prefix}_preprocessing",
             runtime=lambda_.Runtime.PYTHON_3_10,
-            code=lambda_.Code.from_asset("src"),
+            code=lambda_.Code.from_asset(bundle("preprocessing")),
             handler="preprocessing.handler",
             vpc=self.vpc,
             vpc_subnets=ec2.SubnetSelection(subnets=self.subnets.subnets),
-            timeout=Duration.seconds(10),
             environment={
                 "region_name": self.region_name,
                 "lambda": execution_alias.function_arn,
@@ -857,6 +1235,7 @@ class MainStack(Stack):
             },
             security_groups=[self.sg],
             layers=[pandas_layer],
+            **self.resource_profile("preprocessing"),
         )
         add_tags(preprocessing_lambda, {"lambda": "preprocessing"})
 
@@ -865,18 +1244,19 @@ class MainStack(Stack):
             "proxy_lambda",
             function_name=f"{self.prefix}_proxy",
             runtime=lambda_.Runtime.PYTHON_3_10,
-            code=lambda_.Code.from_asset("src"),
+            code=lambda_.Code.from_asset(bundle("proxy")),
             handler="proxy.handler",
             vpc=self.vpc,
             vpc_subnets=ec2.SubnetSelection(subnets=self.subnets.subnets),
-            timeout=Duration.seconds(30),
             environment={
                 "region_name": self.region_name,
                 "lambda": execution_alias.function_arn,
                 "preprocessing_lambda": preprocessing_lambda.function_arn,
                 "prefix": self.prefix,
+                "legacy_models_layout": str(self.legacy_models_layout).lower(),
             },
             security_groups=[self.sg],
+            **self.resource_profile("proxy"),
         )
         add_tags(proxy_lambda, {"lambda": "proxy"})
         execution_alias.grant_invoke(proxy_lambda)
@@ -904,6 +1284,32 @@ class MainStack(Stack):
         # SQS queue permission
         logs_queue.grant_send_messages(proxy_lambda)
 
+        # API in front of the proxy at api.<domain>
+        if self.proxy_api == "http":
+            target = self.create_proxy_http_api(proxy_lambda)
+        else:
+            target = self.create_proxy_rest_api(proxy_lambda)
+
+        # DNS records: latency routing across the regional stacks; Route 53
+        # stops answering with this region while its health check fails
+        health_check = self.create_proxy_health_check(target)
+        self.api_record = route53.CfnRecordSet(
+            self,
+            "ProxyApiARecord",
+            name=f"api.{self.domain_name}",
+            type="A",
+            alias_target=target,
+            hosted_zone_id=self.hosted_zone.hosted_zone_id,
+            region=self.region_name,
+            set_identifier=f"user-{cdk.Aws.STACK_NAME}",
+            health_check_id=health_check.attr_health_check_id,
+        )
+
+        return execution_alias, LambdaQueueTuple(proxy_lambda, logs_queue)
+
+    def create_proxy_rest_api(
+        self, proxy_lambda: lambda_.Function
+    ) -> route53.CfnRecordSet.AliasTargetProperty:
         # Lambda Rest API
         proxy_api = apigw.LambdaRestApi(
             self,
@@ -927,27 +1333,247 @@ class MainStack(Stack):
             certificate=self.main_cert,
             domain_name=f"api.{self.domain_name}",
         )
+        add_tags(proxy_api, {"route53": self.domain_name})
 
-        # DNS records
-        target = route53.CfnRecordSet.AliasTargetProperty(
+        return route53.CfnRecordSet.AliasTargetProperty(
             dns_name=domain_name.domain_name_alias_domain_name,
             hosted_zone_id=domain_name.domain_name_alias_hosted_zone_id,
             evaluate_target_health=False,
         )
 
-        self.api_record = route53.CfnRecordSet(
+    def create_proxy_http_api(
+        self, proxy_lambda: lambda_.Function
+    ) -> route53.CfnRecordSet.AliasTargetProperty:
+        # HTTP API (payload format 2.0): lower per-request latency and price
+        # than the REST API, and the proxy uses none of the REST-only features
+        proxy_api = apigwv2.CfnApi(
             self,
-            "ProxyApiARecord",
-            name=f"api.{self.domain_name}",
+            "proxy_http_api",
+            name="proxy_http_api",
+            protocol_type="HTTP",
+            disable_execute_api_endpoint=True,
+        )
+        add_tags(proxy_api, {"api": "proxy_http_api"})
+        integration = apigwv2.CfnIntegration(
+            self,
+            "proxy_http_api_integration",
+            api_id=proxy_api.ref,
+            integration_type="AWS_PROXY",
+            integration_uri=proxy_lambda.function_arn,
+            payload_format_version="2.0",
+            timeout_in_millis=30_000,
+        )
+        for method in ["GET", "POST"]:  # {method} /{username}/{model_name}
+            apigwv2.CfnRoute(
+                self,
+                f"proxy_http_api_{method}",
+                api_id=proxy_api.ref,
+                route_key=f"{method} /{{username}}/{{model_name}}",
+                target=f"integrations/{integration.ref}",
+            )
+        stage = apigwv2.CfnStage(
+            self,
+            "proxy_http_api_stage",
+            api_id=proxy_api.ref,
+            stage_name="$default",
+            auto_deploy=True,
+        )
+        proxy_lambda.add_permission(
+            "proxy_http_api_permission",
+            principal=iam.ServicePrincipal("apigateway.amazonaws.com"),
+            source_arn=self.format_arn(
+                service="execute-api",
+                resource=proxy_api.ref,
+                resource_name="*/*",
+            ),
+        )
+
+        # Domain name
+        domain_name = apigwv2.CfnDomainName(
+            self,
+            f"{self.domain_name}_http_api_domain_name",
+            domain_name=f"api.{self.domain_name}",
+            domain_name_configurations=[
+                apigwv2.CfnDomainName.DomainNameConfigurationProperty(
+                    certificate_arn=self.main_cert.certificate_arn,
+                    endpoint_type="REGIONAL",
+                )
+            ],
+        )
+        mapping = apigwv2.CfnApiMapping(
+            self,
+            "proxy_http_api_mapping",
+            api_id=proxy_api.ref,
+            domain_name=domain_name.ref,
+            stage=stage.ref,
+        )
+        mapping.add_dependency(stage)
+        add_tags(proxy_api, {"route53": self.domain_name})
+
+        return route53.CfnRecordSet.AliasTargetProperty(
+            dns_name=domain_name.attr_regional_domain_name,
+            hosted_zone_id=domain_name.attr_regional_hosted_zone_id,
+            evaluate_target_health=False,
+        )
+
+    def create_tenant_gateway(self) -> lambda_.Function:
+        # one HTTP API serves every user at <username>.<domain> with the
+        # wildcard certificate; the function resolves the user from the Host
+        # header, so signing up only writes the user's Apis record
+        tenant_gateway = lambda_.Function(
+            self,
+            "tenant_gateway",
+            function_name=f"{self.prefix}_tenant_gateway",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(bundle("tenant_gateway")),
+            handler="tenant_gateway.handler",
+            environment={
+                "prefix": self.prefix,
+                "region_name": self.region_name,
+                "domain_name": self.domain_name,
+            },
+            **self.resource_profile("tenant_gateway"),
+        )
+        add_tags(tenant_gateway, {"lambda": "tenant_gateway"})
+        self.apis.grant_read_data(tenant_gateway)
+
+        api = apigwv2.CfnApi(
+            self,
+            "tenant_http_api",
+            name="tenant_http_api",
+            protocol_type="HTTP",
+            disable_execute_api_endpoint=True,
+        )
+        add_tags(api, {"api": "tenant_http_api"})
+        integration = apigwv2.CfnIntegration(
+            self,
+            "tenant_http_api_integration",
+            api_id=api.ref,
+            integration_type="AWS_PROXY",
+            integration_uri=tenant_gateway.function_arn,
+            payload_format_version="2.0",
+        )
+        apigwv2.CfnRoute(
+            self,
+            "tenant_http_api_default",
+            api_id=api.ref,
+            route_key="$default",
+            target=f"integrations/{integration.ref}",
+        )
+        stage = apigwv2.CfnStage(
+            self,
+            "tenant_http_api_stage",
+            api_id=api.ref,
+            stage_name="$default",
+            auto_deploy=True,
+        )
+        tenant_gateway.add_permission(
+            "tenant_http_api_permission",
+            principal=iam.ServicePrincipal("apigateway.amazonaws.com"),
+            source_arn=self.format_arn(
+                service="execute-api",
+                resource=api.ref,
+                resource_name="*/*",
+            ),
+        )
+
+        # Domain name: *.<domain> (records of other sub domains take precedence)
+        domain_name = apigwv2.CfnDomainName(
+            self,
+            f"{self.domain_name}_tenant_domain_name",
+            domain_name=f"*.{self.domain_name}",
+            domain_name_configurations=[
+                apigwv2.CfnDomainName.DomainNameConfigurationProperty(
+                    certificate_arn=self.main_cert.certificate_arn,
+                    endpoint_type="REGIONAL",
+                )
+            ],
+        )
+        mapping = apigwv2.CfnApiMapping(
+            self,
+            "tenant_http_api_mapping",
+            api_id=api.ref,
+            domain_name=domain_name.ref,
+            stage=stage.ref,
+        )
+        mapping.add_dependency(stage)
+        add_tags(api, {"route53": self.domain_name})
+
+        route53.CfnRecordSet(
+            self,
+            "TenantApiARecord",
+            name=f"*.{self.domain_name}",
             type="A",
-            alias_target=target,
+            alias_target=route53.CfnRecordSet.AliasTargetProperty(
+                dns_name=domain_name.attr_regional_domain_name,
+                hosted_zone_id=domain_name.attr_regional_hosted_zone_id,
+                evaluate_target_health=False,
+            ),
             hosted_zone_id=self.hosted_zone.hosted_zone_id,
             region=self.region_name,
-            set_identifier=f"user-{cdk.Aws.STACK_NAME}",
+            set_identifier=f"tenant-{cdk.Aws.STACK_NAME}",
         )
-        add_tags(proxy_api, {"route53": self.domain_name})
 
-        return execution_alias, LambdaQueueTuple(proxy_lambda, logs_queue)
+        return tenant_gateway
+
+    def create_proxy_health_check(
+        self, target: route53.CfnRecordSet.AliasTargetProperty
+    ) -> route53.CfnHealthCheck:
+        # synthetic probe: calls the proxy through this region's api.<domain>
+        # endpoint every minute (see src/probe.py)
+        probe = lambda_.Function(
+            self,
+            "probe",
+            function_name=f"{self.prefix}_probe",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(bundle("probe")),
+            handler="probe.handler",
+            environment={
+                "domain_name": f"api.{self.domain_name}",
+                "regional_endpoint": target.dns_name,
+            },
+            **self.resource_profile("probe"),
+        )
+        add_tags(probe, {"lambda": "probe"})
+        events.Rule(
+            self,
+            "probe_schedule",
+            schedule=events.Schedule.rate(Duration.minutes(1)),
+            targets=[events_targets.LambdaFunction(probe, retry_attempts=0)],
+        )
+
+        # unhealthy after 2 failed (or missing) probes out of 3
+        alarm = probe.metric_errors(
+            period=Duration.minutes(1), statistic="Sum"
+        ).create_alarm(
+            self,
+            "probe_alarm",
+            alarm_name=f"{self.prefix}-proxy-probe-{self.region_name}",
+            threshold=1,
+            evaluation_periods=3,
+            datapoints_to_alarm=2,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.BREACHING,
+        )
+
+        health_check = route53.CfnHealthCheck(
+            self,
+            "proxy_health_check",
+            health_check_config=route53.CfnHealthCheck.HealthCheckConfigProperty(
+                type="CLOUDWATCH_METRIC",
+                alarm_identifier=route53.CfnHealthCheck.AlarmIdentifierProperty(
+                    name=alarm.alarm_name,
+                    region=self.region_name,
+                ),
+                insufficient_data_health_status="LastKnownStatus",
+            ),
+            health_check_tags=[
+                route53.CfnHealthCheck.HealthCheckTagProperty(
+                    key="Name", value=f"api.{self.domain_name} ({self.region_name})"
+                )
+            ],
+        )
+        return health_check
 
     def create_security_group(self) -> ec2.SecurityGroup:
         sg = ec2.SecurityGroup(
@@ -963,6 +1589,24 @@ class MainStack(Stack):
         )
         return sg
 
+    def allow_interface_endpoints(
+        self, endpoints: Dict[str, ec2.InterfaceVpcEndpoint]
+    ) -> None:
+        # The rules live in this stack: adding them through the endpoints'
+        # `connections` would make the regional stack depend on this one.
+        for name, endpoint in endpoints.items():
+            for k, sg in enumerate(endpoint.connections.security_groups):
+                ec2.CfnSecurityGroupIngress(
+                    self,
+                    f"{name}_endpoint_ingress_{k}",
+                    group_id=sg.security_group_id,
+                    source_security_group_id=self.sg.security_group_id,
+                    ip_protocol="tcp",
+                    from_port=443,
+                    to_port=443,
+                    description=f"HTTPS to the {name} endpoint from proxy_lambda_sg",
+                )
+
     def create_s3_staging_trigger(self) -> lambda_.Function:
         # create lambda and have it triggered by
         # s3 bucket: self.staging_bucket
@@ -973,12 +1617,17 @@ class MainStack(Stack):
             "staging_trigger",
             function_name=f"{self.prefix}-staging-trigger",
             runtime=lambda_.Runtime.PYTHON_3_10,
-            code=lambda_.Code.from_asset("src"),
+            code=lambda_.Code.from_asset(bundle("s3_staging_trigger")),
             handler="s3_staging_trigger.handler",
             environment={
                 "prefix": self.prefix,
+                "legacy_models_layout": str(self.legacy_models_layout).lower(),
             },
-            timeout=Duration.seconds(29),
+            # an upload that could not be copied to every region fails the
+            # invocation: it is retried, then kept in the dead-letter queue
+            retry_attempts=2,
+            dead_letter_queue_enabled=True,
+            **self.resource_profile("s3_staging_trigger"),
         )
         self.staging_bucket.grant_read_write(staging_trigger)
         self.models_bucket.grant_read_write(staging_trigger)
@@ -988,6 +1637,32 @@ class MainStack(Stack):
 
         return staging_trigger
 
+    def create_artifacts_gc_lambda(self) -> lambda_.Function:
+        # deletes the artifacts of the models bucket no model uses any more,
+        # once a day (see src/artifacts_gc.py)
+        artifacts_gc = lambda_.Function(
+            self,
+            "artifacts_gc",
+            function_name=f"{self.prefix}_artifacts_gc",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(bundle("artifacts_gc")),
+            handler="artifacts_gc.handler",
+            environment={"prefix": self.prefix, "region_name": self.region_name},
+            **self.resource_profile("artifacts_gc"),
+        )
+        add_tags(artifacts_gc, {"lambda": "artifacts_gc"})
+        self.models.grant_read_data(artifacts_gc)
+        self.models_bucket.grant_read(artifacts_gc, "artifacts/*")
+        self.models_bucket.grant_delete(artifacts_gc, "artifacts/*")
+        events.Rule(
+            self,
+            "artifacts_gc_schedule",
+            schedule=events.Schedule.rate(Duration.days(1)),
+            targets=[events_targets.LambdaFunction(artifacts_gc)],
+        )
+
+        return artifacts_gc
+
     def create_staging_bucket(self):
         self.staging_bucket = s3.Bucket(
             self,
@@ -998,6 +1673,20 @@ class MainStack(Stack):
             enforce_ssl=True,
             versioned=True,
             removal_policy=RemovalPolicy.RETAIN,
+            # browsers upload parts with PUT and need the ETag of each part
+            cors=[
+                s3.CorsRule(
+                    allowed_methods=[s3.HttpMethods.PUT, s3.HttpMethods.POST],
+                    allowed_origins=["*"],
+                    allowed_headers=["*"],
+                    exposed_headers=["ETag"],
+                )
+            ],
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    abort_incomplete_multipart_upload_after=Duration.days(1)
+                )
+            ],
         )
 
         self.staging_s3_trigger = event_sources.S3EventSource(
@@ -1015,7 +1704,11 @@ class MainStack(Stack):
         account_number: str,
         buckets: Dict[str, s3.Bucket],
         vpc: ec2.Vpc,
+        interface_endpoints: Dict[str, ec2.InterfaceVpcEndpoint],
         env_: str,
+        proxy_api: str = "rest",
+        tenant_api: str = "dedicated",
+        legacy_models_layout: bool = True,
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -1025,6 +1718,11 @@ class MainStack(Stack):
         self.prefix = prefix
         self.region_name = region_name
         self.domain_name = domain_name
+        self.proxy_api = proxy_api  # "rest" or "http"
+        self.tenant_api = tenant_api  # "dedicated" or "shared"
+        # model records may still be under their old key (see
+        # src/helpers/registry.py)
+        self.legacy_models_layout = legacy_models_layout
 
         self.models_bucket = buckets["models_bucket"]
         self.logs_bucket = buckets["logs_bucket"]
@@ -1039,6 +1737,7 @@ class MainStack(Stack):
         self.import_secrets()
         self.import_lambda_layers()
         self.import_databases()
+        self.aggregates = self.create_aggregates_table()
 
         # DNS
         self.hosted_zone = self.import_hosted_zone()
@@ -1059,6 +1758,10 @@ class MainStack(Stack):
         # security group for proxy lambda & execution lambda
         self.sg = self.create_security_group()
 
+        # allow the functions to reach Lambda and Secrets Manager through the
+        # VPC's interface endpoints (S3 and DynamoDB use its gateway endpoints)
+        self.allow_interface_endpoints(interface_endpoints)
+
         # proxy lambda + logs queue
         self.execution_alias, self.proxy = self.create_proxy_lambda()
 
@@ -1072,12 +1775,25 @@ class MainStack(Stack):
         self.GET_list_of_ml_models = rest["GET_list_of_ml_models"]
         self.DELETE_ml_models = rest["DELETE_ml_models"]
 
+        # <username>.<domain>: one API for every user, or one API per user
+        # created by new_user
+        if self.tenant_api == "shared":
+            self.tenant_gateway = self.create_tenant_gateway()
+
         # Additional lambdas
+        self.dns_changes_lambda, self.dns_queue = self.create_dns_changes_lambda(
+            [self.region_name, *other_regions]
+        )
         self.new_user_lambda = self.create_new_user_lambda()
         self.delete_user_lambda = self.create_delete_user_lambda()
+        self.delete_model_lambda = self.create_delete_model_lambda(
+            [self.region_name, *other_regions]
+        )
+        self.aggregates_lambda = self.create_aggregates_lambda()
 
         # Trigger lambda when new file is uploaded to staging bucket
         self.staging_trigger = self.create_s3_staging_trigger()
+        self.artifacts_gc_lambda = self.create_artifacts_gc_lambda()
 
         # SNS + SQS and add SQS queue as event source for lambda
         self.regional_topic = sns.Topic(
@@ -1106,3 +1822,28 @@ class MainStack(Stack):
         self.staging_trigger.add_environment("region_0", self.region_name)
         for k, region in enumerate(other_regions):
             self.staging_trigger.add_environment(f"region_{k+1}", region)
+
+        # the staging trigger copies uploads into the other regions' models
+        # buckets (unless they already have the file)
+        self.staging_trigger.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "s3:GetObject",
+                    "s3:PutObject",
+                    "s3:PutObjectTagging",
+                    "s3:AbortMultipartUpload",
+                ],
+                resources=[
+                    f"arn:aws:s3:::{prefix}-models-{region}/*"
+                    for region in other_regions
+                ],
+            )
+        )
+        self.staging_trigger.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["s3:ListBucket"],
+                resources=[
+                    f"arn:aws:s3:::{prefix}-models-{region}" for region in other_regions
+                ],
+            )
+        )
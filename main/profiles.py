@@ -0,0 +1,87 @@
+from typing import NamedTuple
+
+
+class FunctionProfile(NamedTuple):
+    memory_size: int = 128  # MB
+    architecture: str = "x86_64"  # "x86_64" or "arm64"
+    timeout: int = 29  # seconds
+
+
+# Functions that authenticate with helpers.validation import boto3, pyjwt and
+# fetch the JWT secret at cold start; that is CPU bound, so they get more than
+# the 128 MB minimum.
+_AUTHENTICATED = FunctionProfile(memory_size=256, architecture="arm64")
+_OPTIONS = FunctionProfile(memory_size=128, architecture="arm64")
+
+# Resource profiles per function, keyed by handler module (or construct id).
+# Refresh these from `python benchmarks/power_tuning.py` rather than by hand.
+PROFILES: dict[str, FunctionProfile] = {
+    # user-api
+    "users_POST": _AUTHENTICATED,
+    "users_OPTIONS": _OPTIONS,
+    "signin_POST": _AUTHENTICATED,
+    "signin_OPTIONS": _OPTIONS,
+    "sessions_POST": _AUTHENTICATED,
+    "sessions_OPTIONS": _OPTIONS,
+    "api_keys_list_GET": _AUTHENTICATED,
+    "api_keys_POST": _AUTHENTICATED,
+    "api_keys_DELETE": _AUTHENTICATED,
+    "api_keys_OPTIONS": _OPTIONS,
+    "api_keys_proxy_OPTIONS": _OPTIONS,
+    "credentials_GET": _AUTHENTICATED,
+    "credentials_POST": _AUTHENTICATED,
+    "credentials_DELETE": _AUTHENTICATED,
+    "credentials_OPTIONS": _OPTIONS,
+    "credentials_proxy_OPTIONS": _OPTIONS,
+    "ml_models_GET": _AUTHENTICATED,
+    "ml_models_list_GET": _AUTHENTICATED,
+    "ml_models_PUT": _AUTHENTICATED,
+    "ml_models_POST": _AUTHENTICATED,
+    "ml_models_DELETE": _AUTHENTICATED,
+    "ml_models_OPTIONS": _OPTIONS,
+    "ml_models_proxy_OPTIONS": _OPTIONS,
+    "ml_models_logs_GET": _AUTHENTICATED,
+    "ml_models_logs_list_GET": _AUTHENTICATED,
+    "ml_models_logs_OPTIONS": _OPTIONS,
+    "ml_models_logs_proxy_OPTIONS": _OPTIONS,
+    "ml_models_metrics_GET": _AUTHENTICATED,
+    "ml_models_metrics_OPTIONS": _OPTIONS,
+    "ml_models_uploads_POST": _AUTHENTICATED,
+    "ml_models_uploads_GET": _AUTHENTICATED,
+    "ml_models_uploads_PUT": _AUTHENTICATED,
+    "ml_models_uploads_DELETE": _AUTHENTICATED,
+    "ml_models_uploads_OPTIONS": _OPTIONS,
+    "ml_models_uploads_proxy_OPTIONS": _OPTIONS,
+    # inference path
+    "proxy": FunctionProfile(memory_size=512, architecture="arm64", timeout=30),
+    # the AWS SDK for pandas layer is built for x86_64
+    "preprocessing": FunctionProfile(memory_size=1024, timeout=10),
+    # the execution image is built for x86_64
+    "execution": FunctionProfile(memory_size=3008, timeout=28),
+    # background functions
+    # provisioning steps that wait are retried later instead of blocking
+    "new_user": FunctionProfile(memory_size=256, architecture="arm64", timeout=60),
+    "delete_user": FunctionProfile(memory_size=256, architecture="arm64", timeout=300),
+    # pages through a model's usages until it hands over to a new invocation
+    "delete_model": FunctionProfile(memory_size=512, architecture="arm64", timeout=900),
+    # hashes uploads sent without a checksum and copies them to the other
+    # regions' models buckets
+    "s3_staging_trigger": FunctionProfile(
+        memory_size=512, architecture="arm64", timeout=300
+    ),
+    # scans the Models table and lists the artifacts of the models bucket
+    "artifacts_gc": FunctionProfile(memory_size=512, architecture="arm64", timeout=900),
+    "probe": FunctionProfile(memory_size=128, architecture="arm64", timeout=30),
+    # applies up to 500 queued Route 53 changes in one ChangeBatch
+    "dns_changes": FunctionProfile(memory_size=256, architecture="arm64", timeout=30),
+    # coalesces batches of up to 100 stream records into one transaction
+    "aggregates": FunctionProfile(memory_size=256, architecture="arm64", timeout=30),
+    # <username>.<domain> (shared tenant gateway): one cached DynamoDB read
+    "tenant_gateway": FunctionProfile(memory_size=256, architecture="arm64"),
+}
+
+DEFAULT_PROFILE = FunctionProfile()
+
+
+def get_profile(name: str) -> FunctionProfile:
+    return PROFILES.get(name, DEFAULT_PROFILE)
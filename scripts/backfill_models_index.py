@@ -0,0 +1,70 @@
+"""Add model records created before the `models` index to the index.
+
+The `models` index of the Models table is sparse: it only holds rows that have
+a `model` attribute, which the API sets on model records (not on API-key rows)
+and removes when a model is deleted. Run this once per deployment after
+deploying the base stack and before deploying the main stack:
+
+    python scripts/backfill_models_index.py --prefix playingwithml --region us-east-1
+
+The table is a global table, so the writes replicate to the other regions.
+"""
+import argparse
+import os
+import sys
+
+import boto3
+
+
+def backfill(prefix: str, region: str, dry_run: bool) -> int:
+    dynamodb = boto3.resource("dynamodb", region_name=region)
+    client = dynamodb.meta.client
+    table = dynamodb.Table(f"{prefix}_Models")
+    not_deleted = "attribute_not_exists(is_deleted) OR is_deleted = :false"
+    scan = {
+        # model records of models that are not deleted and not indexed yet
+        "FilterExpression": "attribute_exists(library) AND attribute_not_exists(#m)"
+        f" AND attribute_not_exists(migrated) AND ({not_deleted})",
+        "ExpressionAttributeNames": {"#m": "model"},
+        "ExpressionAttributeValues": {":false": False},
+        "ProjectionExpression": "pk, sk",
+    }
+    updated = 0
+    while True:
+        response = table.scan(**scan)
+        for item in response["Items"]:
+            print(f"{item['pk']} {item['sk']}", file=sys.stderr)
+            if not dry_run:
+                try:
+                    # skip records deleted since the scan
+                    table.update_item(
+                        Key={"pk": item["pk"], "sk": item["sk"]},
+                        UpdateExpression="SET #m = :model",
+                        ConditionExpression=not_deleted,
+                        ExpressionAttributeNames={"#m": "model"},
+                        ExpressionAttributeValues={
+                            ":model": item["sk"].removeprefix("model|"),
+                            ":false": False,
+                        },
+                    )
+                except client.exceptions.ConditionalCheckFailedException:
+                    continue
+            updated += 1
+        if "LastEvaluatedKey" not in response:
+            return updated
+        scan["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prefix", default="playingwithml")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    updated = backfill(args.prefix, args.region, args.dry_run)
+    print(f"{'would update' if args.dry_run else 'updated'} {updated} records")
+
+
+if __name__ == "__main__":
+    main()
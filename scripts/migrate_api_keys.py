@@ -0,0 +1,112 @@
+"""Move API-key rows of the Models table to the `api_key|<hashed_key>` layout.
+
+API-key rows used to be stored under `sk=<hashed_key>|<model_name>`. They are
+now stored under `sk=api_key|<hashed_key>` with an `api_key_model` attribute
+for the `api_keys` index (see src/helpers/api_keys.py). Run this in two steps,
+so that keys keep working while the main stacks are deployed:
+
+    # after deploying the base stack: copy the keys to the new layout
+    python scripts/migrate_api_keys.py copy --prefix playingwithml --region us-east-1
+    # after deploying the main stacks: copy the keys created in between, drop
+    # the copies of keys deleted in between, then delete the old rows
+    python scripts/migrate_api_keys.py finish --prefix playingwithml --region us-east-1
+
+The table is a global table, so the writes replicate to the other regions.
+"""
+import argparse
+import os
+import sys
+
+import boto3
+
+SK_PREFIX = "api_key|"
+
+
+def scan(table, **params):
+    while True:
+        response = table.scan(**params)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def legacy_rows(table):
+    return scan(
+        table,
+        FilterExpression="attribute_exists(hashed_key) AND NOT begins_with(sk, :prefix)",
+        ExpressionAttributeValues={":prefix": SK_PREFIX},
+    )
+
+
+def copy_row(table, item: dict):
+    """Write the key in the new layout and mark both rows as migrated."""
+    table.put_item(
+        Item={
+            **{k: v for k, v in item.items() if k != "migrated"},
+            "sk": f"{SK_PREFIX}{item['hashed_key']}",
+            "api_key_model": f"{item['model_name']}|{item['hashed_key']}",
+            "migrated_from": item["sk"],
+        }
+    )
+    table.update_item(
+        Key={"pk": item["pk"], "sk": item["sk"]},
+        UpdateExpression="SET migrated = :true",
+        ExpressionAttributeValues={":true": True},
+    )
+
+
+def copy(table) -> int:
+    copied = 0
+    for item in legacy_rows(table):
+        if item.get("migrated"):
+            continue
+        print(f"copy {item['pk']} {item['sk']}", file=sys.stderr)
+        copy_row(table, item)
+        copied += 1
+    return copied
+
+
+def finish(table) -> int:
+    # keys deleted through the old API after their copy: delete the copy too
+    for item in scan(
+        table,
+        FilterExpression="attribute_exists(migrated_from)",
+        ProjectionExpression="pk, sk, migrated_from",
+    ):
+        legacy_key = {"pk": item["pk"], "sk": item["migrated_from"]}
+        if "Item" not in table.get_item(Key=legacy_key, ProjectionExpression="pk"):
+            print(f"delete {item['pk']} {item['sk']}", file=sys.stderr)
+            table.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
+
+    # keys created through the old API after the copy, then the old rows
+    migrated = copy(table)
+    for item in legacy_rows(table):
+        table.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
+        try:
+            table.update_item(
+                Key={"pk": item["pk"], "sk": f"{SK_PREFIX}{item['hashed_key']}"},
+                UpdateExpression="REMOVE migrated_from",
+                ConditionExpression="attribute_exists(pk)",
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass  # deleted through the new API
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("step", choices=["copy", "finish"])
+    parser.add_argument("--prefix", default="playingwithml")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    args = parser.parse_args()
+
+    table = boto3.resource("dynamodb", region_name=args.region).Table(
+        f"{args.prefix}_Models"
+    )
+    migrated = copy(table) if args.step == "copy" else finish(table)
+    print(f"copied {migrated} API keys")
+
+
+if __name__ == "__main__":
+    main()
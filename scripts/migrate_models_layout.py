@@ -0,0 +1,229 @@
+"""Move model records of the Models table to the `model|<model_name>` layout.
+
+Model records used to be stored under `sk=<model_name>`, next to the API-key
+rows of their owner with nothing telling the two apart but the shape of the
+sort key. They are now stored under `sk=model|<model_name>` (see
+src/helpers/registry.py). The API keeps working during the migration: while
+`registry.LEGACY_LAYOUT` is set, records are read from either key and moved
+before they are written. Deploy the main stacks first, then:
+
+    # copy every record to the new key and take the old one out of the
+    # `models` index
+    python scripts/migrate_models_layout.py copy --segments 8 --max-capacity 200
+    # delete the old records (once the copies have replicated)
+    python scripts/migrate_models_layout.py finish --segments 8 --max-capacity 200
+
+then set `_LEGACY_MODELS_LAYOUT = False` in app.py and deploy again. Each step scans the table in
+parallel segments, consuming at most `--max-capacity` capacity units per
+second, and checkpoints where each segment is in a JSON file
+(`--checkpoint`), so an interrupted step resumes where it stopped when run
+again. Run it in one region: the table is a global table, so the writes
+replicate to the other regions.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+import boto3
+
+SK_PREFIX = "model|"
+
+
+class RateLimiter:
+    """Token bucket of capacity units per second, shared by the segments."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, units: float):
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(
+                self.rate, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            self.tokens -= units
+            delay = max(0.0, -self.tokens / self.rate)
+        sleep(delay)
+
+
+class Checkpoint:
+    """Where each segment of a step is (last evaluated key, done, counts)."""
+
+    def __init__(self, path: str, step: str, segments: int):
+        self.path = path
+        self.lock = threading.Lock()
+        state = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+        if state.get("step") != step or state.get("segments") != segments:
+            state = {"step": step, "segments": segments, "progress": {}}
+        self.state = state
+
+    def get(self, segment: int) -> dict:
+        return self.state["progress"].get(str(segment), {})
+
+    def save(self, segment: int, progress: dict):
+        with self.lock:
+            self.state["progress"][str(segment)] = progress
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.state, f, default=str)
+            os.replace(tmp, self.path)
+
+
+def is_legacy_model(item: dict) -> bool:
+    # model names only have letters, digits, "-" and "_"; every other row of
+    # a user's partition has a "|" in its sort key
+    return item["pk"].startswith("username|") and "|" not in item["sk"]
+
+
+def copy_record(client, table_name: str, item: dict) -> tuple[bool, float]:
+    """Copy the record to the new key and mark the legacy record as migrated,
+    in one transaction; return whether it was copied and the capacity
+    consumed."""
+    if "version" in item:
+        condition = "#version = :version"
+        values = {":version": item["version"]}
+    else:
+        condition, values = "attribute_not_exists(#version)", {}
+    mark = {
+        "Update": {
+            "TableName": table_name,
+            "Key": {"pk": item["pk"], "sk": item["sk"]},
+            "UpdateExpression": "SET migrated = :true REMOVE #model",
+            "ConditionExpression": condition,
+            "ExpressionAttributeNames": {"#version": "version", "#model": "model"},
+            "ExpressionAttributeValues": {":true": True, **values},
+        }
+    }
+    copy = {
+        "Put": {
+            "TableName": table_name,
+            "Item": {**item, "sk": f"{SK_PREFIX}{item['sk']}"},
+            "ConditionExpression": "attribute_not_exists(pk)",
+        }
+    }
+    try:
+        response = client.transact_write_items(
+            TransactItems=[copy, mark], ReturnConsumedCapacity="TOTAL"
+        )
+    except client.exceptions.TransactionCanceledException as err:
+        reasons = [x.get("Code") for x in err.response["CancellationReasons"]]
+        if reasons[1] != "None":
+            # written since it was scanned: the next run copies it
+            print(f"changed {item['pk']} {item['sk']}", file=sys.stderr)
+            return False, 2
+        # copied by the API already: only mark the legacy record
+        response = client.transact_write_items(
+            TransactItems=[mark], ReturnConsumedCapacity="TOTAL"
+        )
+    return True, sum(x["CapacityUnits"] for x in response["ConsumedCapacity"])
+
+
+def delete_record(client, table_name: str, item: dict) -> float:
+    try:
+        response = client.delete_item(
+            TableName=table_name,
+            Key={"pk": item["pk"], "sk": item["sk"]},
+            ConditionExpression="migrated = :true",
+            ExpressionAttributeValues={":true": True},
+            ReturnConsumedCapacity="TOTAL",
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return 1
+    return response["ConsumedCapacity"]["CapacityUnits"]
+
+
+def migrate_segment(
+    table,
+    step: str,
+    segment: int,
+    segments: int,
+    limiter: RateLimiter,
+    checkpoint: Checkpoint,
+) -> dict:
+    progress = {"scanned": 0, "migrated": 0, "left": 0, **checkpoint.get(segment)}
+    if progress.get("done"):
+        return progress
+
+    client = table.meta.client
+    scan = {
+        "Segment": segment,
+        "TotalSegments": segments,
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    while True:
+        if progress.get("last_evaluated_key"):
+            scan["ExclusiveStartKey"] = progress["last_evaluated_key"]
+        response = table.scan(**scan)
+        limiter.consume(response["ConsumedCapacity"]["CapacityUnits"])
+        progress["scanned"] += response["ScannedCount"]
+
+        for item in filter(is_legacy_model, response["Items"]):
+            if step == "copy" and not item.get("migrated"):
+                copied, consumed = copy_record(client, table.name, item)
+                limiter.consume(consumed)
+                progress["migrated" if copied else "left"] += 1
+            elif step == "finish" and item.get("migrated"):
+                limiter.consume(delete_record(client, table.name, item))
+                progress["migrated"] += 1
+            elif step == "finish":
+                # not copied yet: run copy again, then finish
+                progress["left"] += 1
+
+        progress["last_evaluated_key"] = response.get("LastEvaluatedKey")
+        progress["done"] = "LastEvaluatedKey" not in response
+        checkpoint.save(segment, progress)
+        if progress["done"]:
+            return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("step", choices=["copy", "finish"])
+    parser.add_argument("--prefix", default="playingwithml")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--max-capacity", type=float, default=100)
+    parser.add_argument("--checkpoint")
+    args = parser.parse_args()
+    checkpoint_path = args.checkpoint or f"migrate_models_layout.{args.step}.json"
+
+    table = boto3.resource("dynamodb", region_name=args.region).Table(
+        f"{args.prefix}_Models"
+    )
+    limiter = RateLimiter(args.max_capacity)
+    checkpoint = Checkpoint(checkpoint_path, args.step, args.segments)
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        results = list(
+            executor.map(
+                lambda segment: migrate_segment(
+                    table, args.step, segment, args.segments, limiter, checkpoint
+                ),
+                range(args.segments),
+            )
+        )
+
+    scanned = sum(x["scanned"] for x in results)
+    migrated = sum(x["migrated"] for x in results)
+    left = sum(x["left"] for x in results)
+    verb = "copied" if args.step == "copy" else "deleted"
+    print(f"scanned {scanned} rows, {verb} {migrated} model records")
+    # a completed step starts over when run again
+    os.remove(checkpoint_path)
+    if left:
+        print(f"{left} model records were not copied: run copy again, then finish")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Seed the user and model counts of a region's Aggregates table.
+
+The aggregates (see src/helpers/aggregates.py) are maintained from the table
+streams from the time the main stack deploys their consumer; users, models and
+API keys created before that are not counted. Once per region, right after the
+first deploy of the main stack:
+
+    python scripts/seed_aggregates.py --prefix playingwithml --region us-east-1
+
+It counts the rows of the Users and Models tables and sets the counts (it can
+also be run again to repair counts). Writes made while it scans may be counted
+twice or not at all, so run it when few users sign up. Request counts per hour
+are not seeded: they start with the first request after the deploy.
+"""
+import argparse
+import os
+from collections import Counter
+
+import boto3
+
+SK_PREFIX = "api_key|"  # src/helpers/api_keys.py
+
+
+def scan(table, **kwargs):
+    while True:
+        response = table.scan(**kwargs)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def seed(prefix: str, region: str) -> tuple[int, dict]:
+    dynamodb = boto3.resource("dynamodb", region_name=region)
+    aggregates = dynamodb.Table(f"{prefix}_Aggregates")
+
+    users = sum(
+        1
+        for item in scan(dynamodb.Table(f"{prefix}_Users"), ProjectionExpression="sk")
+        if item["sk"] == "username"
+    )
+    aggregates.update_item(
+        Key={"pk": "users", "sk": "total"},
+        UpdateExpression="SET #count = :count",
+        ExpressionAttributeNames={"#count": "count"},
+        ExpressionAttributeValues={":count": users},
+    )
+
+    # models in the `models` index and API-key rows, per user
+    totals = {}
+    for item in scan(
+        dynamodb.Table(f"{prefix}_Models"),
+        ProjectionExpression="pk, sk, #model",
+        ExpressionAttributeNames={"#model": "model"},
+    ):
+        if not item["pk"].startswith("username|"):
+            continue
+        counts = totals.setdefault(item["pk"], Counter(models=0, api_keys=0))
+        if item["sk"].startswith(SK_PREFIX):
+            counts["api_keys"] += 1
+        elif "model" in item:
+            counts["models"] += 1
+    with aggregates.batch_writer() as batch:
+        for pk, counts in totals.items():
+            batch.put_item(Item={"pk": pk, "sk": "totals", **counts})
+    return users, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prefix", default="playingwithml")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    args = parser.parse_args()
+
+    users, totals = seed(args.prefix, args.region)
+    print(f"{users} users, totals of {len(totals)} users set in {args.region}")
+
+
+if __name__ == "__main__":
+    main()
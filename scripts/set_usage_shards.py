@@ -0,0 +1,64 @@
+"""Spread the usage rows of a busy model over more Usages partitions.
+
+Every inference writes a row to the Usages table; the rows of a model share
+one partition unless the model's `usage_shards` (see `src/helpers/usages.py`)
+is raised:
+
+    python scripts/set_usage_shards.py --username alice --model-name my-model --shards 8
+
+The shard count can only be raised: logs are read from every shard below it.
+The Models table is a global table, so the change applies in every region.
+"""
+import argparse
+import os
+import sys
+
+import boto3
+
+MAX_SHARDS = 32  # src/helpers/usages.py
+
+
+def set_usage_shards(
+    prefix: str, region: str, username: str, model_name: str, shards: int
+) -> bool:
+    """Return False if the model does not exist or has more shards already."""
+    table = boto3.resource("dynamodb", region_name=region).Table(f"{prefix}_Models")
+    # the model record, or its legacy record if it has not been migrated yet
+    # (scripts/migrate_models_layout.py)
+    for sk in [f"model|{model_name}", model_name]:
+        try:
+            table.update_item(
+                Key={"pk": f"username|{username}", "sk": sk},
+                UpdateExpression="SET usage_shards = :shards",
+                ConditionExpression="attribute_exists(pk)"
+                " AND attribute_not_exists(migrated)"
+                " AND (attribute_not_exists(usage_shards) OR usage_shards <= :shards)",
+                ExpressionAttributeValues={":shards": shards},
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            continue
+        return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prefix", default="playingwithml")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--model-name", required=True)
+    parser.add_argument("--shards", type=int, required=True)
+    args = parser.parse_args()
+    if not 1 <= args.shards <= MAX_SHARDS:
+        parser.error(f"--shards must be between 1 and {MAX_SHARDS}")
+
+    if not set_usage_shards(
+        args.prefix, args.region, args.username, args.model_name, args.shards
+    ):
+        print("the model does not exist or has more shards already", file=sys.stderr)
+        sys.exit(1)
+    print(f"{args.username}/{args.model_name}: {args.shards} usage shards")
+
+
+if __name__ == "__main__":
+    main()
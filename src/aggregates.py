@@ -0,0 +1,157 @@
+"""Keep the Aggregates table (see helpers/aggregates.py) up to date from the
+streams of the Users, Models and Usages tables.
+
+The deltas of a batch of stream records are added up per aggregate item and
+applied with `ADD` updates in one transaction, whose client request token is
+derived from the records of the batch: a batch retried after its transaction
+was applied is not counted twice. The stack sizes the batches so that they
+update at most 100 items (the limit of a transaction), and gives up on a batch
+(recording it in the failures queue) before the 10 minutes DynamoDB keeps
+tokens are over.
+"""
+import json
+import random
+import hashlib
+from collections import Counter, defaultdict
+from time import sleep
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from helpers import aggregates, api_keys, tables, usages
+from helpers.logging import logger
+import boto3
+
+_TRANSACTION_SIZE = 100  # max items per TransactWriteItems
+_MAX_ATTEMPTS = 5
+_BASE_DELAY = 0.05  # seconds
+
+dynamodb_client = boto3.client("dynamodb")
+deserializer = TypeDeserializer()
+serializer = TypeSerializer()
+
+
+def get_image(record: dict, image: str) -> dict | None:
+    data = record["dynamodb"].get(image)
+    if data is None:
+        return None
+    return {name: deserializer.deserialize(value) for name, value in data.items()}
+
+
+def count_user(record: dict, deltas: dict):
+    """users total: +1 per user created, -1 per user deleted."""
+    if record["dynamodb"]["Keys"]["sk"]["S"] != "username":
+        return
+    delta = {"INSERT": 1, "REMOVE": -1}.get(record["eventName"], 0)
+    deltas[json.dumps(aggregates.get_users_key())]["count"] += delta
+
+
+def count_model_or_key(record: dict, deltas: dict):
+    """models and API keys of the user: rows that enter or leave the `models`
+    index (see helpers/registry.py) and API-key rows created or deleted."""
+    old_image = get_image(record, "OldImage") or {}
+    new_image = get_image(record, "NewImage") or {}
+    keys = record["dynamodb"]["Keys"]
+    pk, sk = keys["pk"]["S"], keys["sk"]["S"]
+    if not pk.startswith("username|"):
+        return
+    totals = deltas[json.dumps(aggregates.get_user_key(pk[len("username|") :]))]
+    if sk.startswith(api_keys.SK_PREFIX):
+        totals["api_keys"] += bool(new_image) - bool(old_image)
+    else:
+        # a model moved to a new key (migrate_models_layout.py) leaves the
+        # index under its old key as it enters it under the new one
+        totals["models"] += ("model" in new_image) - ("model" in old_image)
+
+
+def count_usage(record: dict, deltas: dict):
+    """minute, hour and day rollups of the model's requests."""
+    if record["eventName"] != "INSERT":
+        return
+    usage = get_image(record, "NewImage")
+    username, model_name = usages.split_pk(usage["pk"])
+    timestamp = usages.get_timestamp(usage["sk"])
+    usage_deltas = aggregates.get_usage_deltas(
+        int(usage.get("status_code") or 0), int(usage.get("duration") or 0)
+    )
+    for key in aggregates.get_rollup_keys(username, model_name, timestamp):
+        deltas[json.dumps(key)].update(usage_deltas)
+
+
+COUNTERS = {
+    tables.USERS: count_user,
+    tables.MODELS: count_model_or_key,
+    tables.USAGES: count_usage,
+}
+
+
+def get_table_name(record: dict) -> str:
+    # arn:aws:dynamodb:<region>:<account>:table/<table_name>/stream/<label>
+    return record["eventSourceARN"].split("/")[1]
+
+
+def get_updates(deltas: dict) -> list[dict]:
+    updates = []
+    for key, counter in deltas.items():
+        counter = {name: value for name, value in counter.items() if value}
+        if not counter:
+            continue
+        names = sorted(counter)
+        update_expression = "ADD " + ", ".join(
+            f"#a{k} :a{k}" for k in range(len(names))
+        )
+        attribute_names = {f"#a{k}": name for k, name in enumerate(names)}
+        attribute_values = {
+            f":a{k}": {"N": str(counter[name])} for k, name in enumerate(names)
+        }
+        key = json.loads(key)
+        expiry = aggregates.get_expiry(key)
+        if expiry:
+            update_expression += " SET #ttl = :ttl"
+            attribute_names["#ttl"] = "ttl"
+            attribute_values[":ttl"] = {"N": str(expiry)}
+        updates.append(
+            {
+                "Update": {
+                    "TableName": tables.AGGREGATES,
+                    "Key": serializer.serialize(key)["M"],
+                    "UpdateExpression": update_expression,
+                    "ExpressionAttributeNames": attribute_names,
+                    "ExpressionAttributeValues": attribute_values,
+                }
+            }
+        )
+    return updates
+
+
+def apply(updates: list[dict], token: str):
+    """Apply the updates in one idempotent transaction, retrying conflicts
+    with other batches that update the same items."""
+    for attempt in range(_MAX_ATTEMPTS):
+        try:
+            dynamodb_client.transact_write_items(
+                TransactItems=updates, ClientRequestToken=token
+            )
+            return
+        except dynamodb_client.exceptions.TransactionCanceledException as err:
+            reasons = [x.get("Code") for x in err.response["CancellationReasons"]]
+            if "TransactionConflict" not in reasons or attempt == _MAX_ATTEMPTS - 1:
+                raise
+        except dynamodb_client.exceptions.TransactionInProgressException:
+            # the same transaction, still being applied by the last attempt
+            if attempt == _MAX_ATTEMPTS - 1:
+                raise
+        # full jitter
+        sleep(random.uniform(0, _BASE_DELAY * 2**attempt))
+
+
+def handler(event: dict, context):
+    records = event["Records"]
+    deltas = defaultdict(Counter)
+    for record in records:
+        COUNTERS[get_table_name(record)](record, deltas)
+    updates = get_updates(deltas)
+    logger.info("%d records, %d aggregates", len(records), len(updates))
+
+    # the same batch (after a failed invocation) gets the same tokens
+    batch_id = "".join(record["eventID"] for record in records)
+    for k in range(0, len(updates), _TRANSACTION_SIZE):
+        token = hashlib.sha256(f"{batch_id}:{k}".encode()).hexdigest()[:36]
+        apply(updates[k : k + _TRANSACTION_SIZE], token)
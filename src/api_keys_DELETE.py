@@ -1,57 +1,37 @@
-import os
 import json
 from uuid import UUID
 from hashlib import sha256
-from helpers import cors, dynamodb as ddb, validation
+from helpers import api_keys, cors, tables, validation
 from helpers.logging import logger
-import boto3
-
-_PREFIX = os.environ["prefix"]
-MODELS_TABLE_NAME = f"{_PREFIX}_Models"
-
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
-
-
-def get_sk(username: str, hashed_value: str) -> str:
-    statement = f"SELECT sk FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND BEGINS_WITH(sk, '{hashed_value}');"
-    response = dynamodb_client.execute_statement(Statement=statement)
-    results = [ddb.from_(x) for x in response.get("Items", [])]
-    logger.debug("get_sk results: %s", json.dumps(results, default=str))
-
-    return next(result["sk"] for result in results)
 
 
 def delete_api_key(username: str, api_key: str, is_hashed: bool) -> dict:
     hashed_value = api_key if is_hashed else sha256(api_key.encode()).hexdigest()
     logger.debug("hashed_value: %s", hashed_value)
 
-    # get the sort key (sk = f'{hashed_value}|{model_name}')
     try:
-        sk = get_sk(username=username, hashed_value=hashed_value)
-    except:
+        response = tables.table(tables.MODELS).delete_item(
+            Key=api_keys.get_key(username, hashed_value),
+            ConditionExpression="attribute_exists(pk)",
+        )
+        logger.info("deletion response: %s", json.dumps(response, default=str))
+    except tables.dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
         return cors.get_response(
             status_code=400,
             body={"error": "The API key with you provided does not exist."},
             methods="DELETE",
         )
-
-    statement = (
-        f"DELETE FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND sk='{sk}';"
-    )
-    response = dynamodb_client.execute_statement(Statement=statement)
-    logger.info("deletion response: %s", json.dumps(response, default=str))
-
-    if response.get("ResponseMetadata", {}).get("HTTPStatusCode", -1) == 200:
+    except Exception as err:
+        logger.exception(err)
         return cors.get_response(
-            status_code=200,
-            body={"message": f"Successfully deleted API key '{api_key}'."},
+            status_code=500,
+            body={"error": f"Unable to delete API key '{api_key}'."},
             methods="DELETE",
         )
 
     return cors.get_response(
-        status_code=500,
-        body={"error": f"Unable to delete API key '{api_key}'."},
+        status_code=200,
+        body={"message": f"Successfully deleted API key '{api_key}'."},
         methods="DELETE",
     )
 
@@ -3,7 +3,7 @@ from uuid import uuid4 as uuid
 from datetime import datetime, timedelta
 import time
 from hashlib import sha256
-from helpers import cors
+from helpers import api_keys, cors
 from helpers.validation import check_authorization
 import boto3
 
@@ -28,8 +28,8 @@ def insert_api_key_record(
     hashed_value = sha256(api_key.encode()).hexdigest()
 
     record = {
-        "pk": f"username|{username}",
-        "sk": f"{hashed_value}|{model_name}",
+        **api_keys.get_key(username, hashed_value),
+        "api_key_model": api_keys.get_index_value(model_name, hashed_value),
         "description": description,
         "hashed_key": hashed_value,
         "model_name": model_name,
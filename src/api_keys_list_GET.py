@@ -1,20 +1,27 @@
-import os
 import json
-from helpers import cors, validation, dynamodb as ddb
+from helpers import api_keys, cors, tables, validation
 from helpers.logging import logger
-import boto3
 
-_PREFIX = os.environ["prefix"]
-MODELS_TABLE_NAME = f"{_PREFIX}_Models"
+_DEFAULT_LIMIT = 10  # page size when only next-token is given
 
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
 
-
-def get_api_keys_info(username: str, model_name: str) -> dict:
-    statement = f"""SELECT * FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND hashed_key IS NOT MISSING;"""
-    response = dynamodb_client.execute_statement(Statement=statement)
-    results = [ddb.from_(x) for x in response.get("Items", [])]
+def get_api_keys_info(
+    username: str,
+    model_name: str | None,
+    limit: int | None = None,
+    next_token: str | None = None,
+) -> dict:
+    """Return a page of the user's API keys, or all of them without `limit`."""
+    if limit is None:
+        results = list(api_keys.query_all(username=username, model_name=model_name))
+        last_evaluated_key = None
+    else:
+        results, last_evaluated_key = api_keys.query(
+            username=username,
+            model_name=model_name,
+            limit=limit,
+            exclusive_start_key=tables.decode_token(next_token) if next_token else None,
+        )
 
     keys = [
         {
@@ -26,20 +33,50 @@ def get_api_keys_info(username: str, model_name: str) -> dict:
             "expires_at": result.get("expires_at") or "",
         }
         for result in results
-        if (result["model_name"] == model_name if model_name else True)
     ]
 
-    return {"api-keys": keys}
+    return {"api-keys": keys, "next_token": tables.encode_token(last_evaluated_key)}
 
 
 @validation.check_authorization
 def handler(event: dict, context):
     username = event["username"]
+    params = event["params"]
     model_name = event["query_params"].get("model_name")
     if model_name == "*":
         model_name = None
 
-    api_keys = get_api_keys_info(username=username, model_name=model_name)
+    # get next token
+    next_token = params.get("next-token")
+
+    # get limit (without limit nor next-token, every key is returned)
+    if params.get("limit") is None and not next_token:
+        limit = None
+    else:
+        try:
+            val = int(params.get("limit"))
+            limit = val if val < 100 and val > 0 else _DEFAULT_LIMIT
+        except:
+            limit = _DEFAULT_LIMIT
+
+    try:
+        api_keys = get_api_keys_info(
+            username=username,
+            model_name=model_name,
+            limit=limit,
+            next_token=next_token,
+        )
+    except Exception as err:
+        logger.exception(err)
+        return cors.get_response(
+            status_code=400 if next_token else 500,
+            body={
+                "error": "Invalid next-token."
+                if next_token
+                else "Unable to list API keys."
+            },
+            methods="GET",
+        )
     logger.debug("api_keys: %s", json.dumps(api_keys, default=str))
 
     return cors.get_response(
@@ -0,0 +1,83 @@
+"""Delete the files of this region's models bucket that no model uses any more.
+
+Files are stored once per content, as `artifacts/<sha256>` (see
+s3_staging_trigger.py), and can be shared by several models, so deleting a
+model (delete_model.py) keeps them. Once a day, this deletes the artifacts that
+no model of the `models` index (live models) points at, unless they were stored
+or reused (`last_used` tag) during the last `GRACE_PERIOD`: an upload records
+its file on the model after storing it.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from helpers import tables
+from helpers.logging import logger
+import boto3
+
+_PREFIX = os.environ["prefix"]
+_REGION_NAME = os.environ["region_name"]
+MODELS_S3_BUCKET = f"{_PREFIX}-models-{_REGION_NAME}"
+ARTIFACTS_PREFIX = "artifacts/"  # s3_staging_trigger.ARTIFACTS_PREFIX
+LAST_USED_TAG = "last_used"  # s3_staging_trigger.LAST_USED_TAG
+GRACE_PERIOD = timedelta(days=1)
+_SEGMENTS = 8  # parallel scan of the Models table
+
+s3 = boto3.client("s3")
+
+
+def scan_segment(segment: int) -> set[str]:
+    table = tables.table(tables.MODELS)
+    kwargs = {
+        "Segment": segment,
+        "TotalSegments": _SEGMENTS,
+        # rows of the `models` index only
+        "FilterExpression": "attribute_exists(#model)",
+        "ProjectionExpression": "#key, preprocessing_key",
+        "ExpressionAttributeNames": {"#model": "model", "#key": "key"},
+    }
+    keys = set()
+    while True:
+        response = table.scan(**kwargs)
+        for item in response["Items"]:
+            keys.update(item.get(name) for name in ["key", "preprocessing_key"])
+        if "LastEvaluatedKey" not in response:
+            return keys
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def get_used_keys() -> set[str]:
+    with ThreadPoolExecutor(max_workers=_SEGMENTS) as executor:
+        return set().union(*executor.map(scan_segment, range(_SEGMENTS)))
+
+
+def get_last_used(key: str) -> datetime | None:
+    tags = s3.get_object_tagging(Bucket=MODELS_S3_BUCKET, Key=key)["TagSet"]
+    for tag in tags:
+        if tag["Key"] == LAST_USED_TAG:
+            return datetime.fromisoformat(tag["Value"])
+    return None
+
+
+def handler(event: dict, context):
+    # anything stored or reused from here on is recent enough to be kept
+    cutoff = datetime.utcnow() - GRACE_PERIOD
+    used = get_used_keys()
+
+    deleted = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=MODELS_S3_BUCKET, Prefix=ARTIFACTS_PREFIX):
+        for item in page.get("Contents", []):
+            key = item["Key"]
+            if key in used or item["LastModified"].replace(tzinfo=None) > cutoff:
+                continue
+            last_used = get_last_used(key)
+            if last_used and last_used > cutoff:
+                continue
+            s3.delete_object(Bucket=MODELS_S3_BUCKET, Key=key)
+            deleted.append(key)
+
+    logger.info(
+        "Deleted %d artifacts: %s", len(deleted), json.dumps(deleted[:100], default=str)
+    )
+    return {"deleted": len(deleted)}
@@ -1,33 +1,21 @@
-import os
-import json
-from helpers import cors, dynamodb as ddb, validation
+from helpers import cors, tables, validation
 from helpers.logging import logger
-import boto3
 
-PREFIX = os.environ["prefix"]
 ADDITIONAL_HEADERS = "credentials_name, description"
 
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
-dynamodb = boto3.resource("dynamodb")
-_CREDS_TABLE_NAME = f"{PREFIX}_Creds"
 
-
-def delete_credential(username: str, credential_name) -> list[dict]:
+def delete_credential(username: str, credential_name):
     # Get access_key using username & credential_name
-    statement = f"SELECT access_key FROM {_CREDS_TABLE_NAME} WHERE pk='username|{username}' and sk='{credential_name}';"
-    response = dynamodb_client.execute_statement(Statement=statement)
-    result = [ddb.from_(x) for x in response.get("Items", [])]
-    access_key = result[0]["access_key"]
+    key = {"pk": f"username|{username}", "sk": credential_name}
+    item = tables.get_item(tables.CREDS, key, fields=["access_key"])
+    if not item:
+        raise Exception(f"Credential '{credential_name}' does not exist.")
 
     # Delete relevant records from dynamodb
-    _statements = [
-        f"DELETE FROM {_CREDS_TABLE_NAME} WHERE pk='username|{username}' and sk='{credential_name}';",
-        f"DELETE FROM {_CREDS_TABLE_NAME} WHERE pk='creds|{access_key}' and sk='creds';",
-    ]
-    statements = [{"Statement": statement} for statement in _statements]
-    response = dynamodb_client.batch_execute_statement(Statements=statements)
-    return [ddb.from_(x) for x in response.get("Items", [])]
+    tables.batch_write(
+        tables.CREDS,
+        deletes=[key, {"pk": f"creds|{item['access_key']}", "sk": "creds"}],
+    )
 
 
 @validation.check_authorization
@@ -36,7 +24,7 @@ def handler(event: dict, context):
     credential_name = event["path_params"]["credential_name"]
 
     try:
-        response = delete_credential(username, credential_name)
+        delete_credential(username, credential_name)
     except:
         return cors.get_response(
             status_code=400,
@@ -46,7 +34,7 @@ def handler(event: dict, context):
             additional_headers=ADDITIONAL_HEADERS,
         )
 
-    logger.info("response: %s", json.dumps(response, default=str))
+    logger.info("Deleted credential '%s' of %s", credential_name, username)
 
     return cors.get_response(
         status_code=200,
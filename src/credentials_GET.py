@@ -1,21 +1,19 @@
-import os
 import json
-from helpers import cors, dynamodb as ddb, validation
+from helpers import cors, tables, validation
 from helpers.logging import logger
-import boto3
 
-PREFIX = os.environ["prefix"]
-
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
-dynamodb = boto3.resource("dynamodb")
-_CREDS_TABLE_NAME = f"{PREFIX}_Creds"
+_FIELDS = ["sk", "access_key", "description", "expiration"]
 
 
 def get_creds(username: str) -> list[dict]:
-    statement = f"SELECT sk, access_key, description, expiration FROM {_CREDS_TABLE_NAME} WHERE pk='username|{username}';"
-    response = dynamodb_client.execute_statement(Statement=statement)
-    return [ddb.from_(x) for x in response.get("Items", [])]
+    return list(
+        tables.query(
+            tables.CREDS,
+            "pk = :pk",
+            {":pk": f"username|{username}"},
+            fields=_FIELDS,
+        )
+    )
 
 
 @validation.check_authorization
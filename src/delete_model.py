@@ -0,0 +1,288 @@
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from uuid import uuid4 as uuid
+from helpers import registry, tables, usages
+from helpers.logging import logger
+import boto3
+
+_PREFIX = os.environ["prefix"]
+_QUEUE = os.environ["queue"]
+
+# region_0 is this function's region, region_1... are the other regions
+REGIONS = [
+    value for name, value in os.environ.items() if re.fullmatch(r"region_\d+", name)
+]
+
+sqs = boto3.client("sqs")
+
+_BATCH_WRITE_SIZE = 25  # max items per BatchWriteItem
+_DELETE_OBJECTS_SIZE = 1000  # max keys per DeleteObjects
+_WORKERS = 8
+_TIME_BUFFER = 60_000  # ms left when the job is handed over to a new invocation
+
+
+def chunks(items: list, size: int) -> list[list]:
+    return [items[k : k + size] for k in range(0, len(items), size)]
+
+
+def set_progress(username: str, model_name: str, cleanup: dict) -> bool:
+    """Record the cleanup progress on the model record and return False if the
+    model has been created again since it was deleted."""
+    try:
+        registry.update_model(
+            username=username,
+            model_name=model_name,
+            values={
+                "cleanup": {**cleanup, "updated_at": datetime.utcnow().isoformat()}
+            },
+            condition="is_deleted = :is_deleted",
+            condition_values={":is_deleted": True},
+        )
+    except registry.ConditionFailed:
+        return False
+    return True
+
+
+def batch_delete_usages(keys: list[dict]):
+    tables.batch_write(tables.USAGES, deletes=keys)
+
+
+def delete_usages(
+    username: str,
+    model_name: str,
+    deleted_at: str,
+    exclusive_start_key: dict | None,
+    context,
+) -> tuple[int, dict | None]:
+    """Delete the Usages rows of the model up to `deleted_at`, shard after
+    shard and one page at a time, and return the number of rows deleted and
+    where to resume (None when done; a key without `sk` resumes at the start
+    of the shard)."""
+    model_info = registry.get_model(username, model_name, fields=["usage_shards"])
+    pks = [
+        usages.get_pk(username, model_name, shard)
+        for shard in range(usages.get_shard_count(model_info))
+    ]
+    operator, bound = usages.get_bound(deleted_at, ascending=False, inclusive=True)
+    start = pks.index(exclusive_start_key["pk"]) if exclusive_start_key else 0
+    if exclusive_start_key and "sk" not in exclusive_start_key:
+        exclusive_start_key = None
+
+    deleted = 0
+    with ThreadPoolExecutor(max_workers=_WORKERS) as executor:
+        for k, pk in enumerate(pks[start:], start):
+            while True:
+                items, exclusive_start_key = tables.query_page(
+                    tables.USAGES,
+                    f"pk = :pk AND sk {operator} :deleted_at",
+                    {":pk": pk, ":deleted_at": bound},
+                    fields=["pk", "sk"],
+                    exclusive_start_key=exclusive_start_key,
+                )
+                list(
+                    executor.map(batch_delete_usages, chunks(items, _BATCH_WRITE_SIZE))
+                )
+                deleted += len(items)
+
+                if not exclusive_start_key:
+                    break
+                if context.get_remaining_time_in_millis() < _TIME_BUFFER:
+                    return deleted, exclusive_start_key
+
+            if k + 1 < len(pks) and (
+                context.get_remaining_time_in_millis() < _TIME_BUFFER
+            ):
+                return deleted, {"pk": pks[k + 1]}
+    return deleted, None
+
+
+def delete_objects(
+    s3, bucket: str, prefix: str, deleted_at: datetime, token: str | None
+) -> tuple[int, str | None]:
+    """Delete one page of the objects under `prefix` last modified before
+    `deleted_at` and return the number of objects deleted and the continuation
+    token of the next page (None when done)."""
+    page = s3.list_objects_v2(
+        Bucket=bucket,
+        Prefix=prefix,
+        **({"ContinuationToken": token} if token else {}),
+    )
+    keys = [
+        {"Key": item["Key"]}
+        for item in page.get("Contents", [])
+        if item["LastModified"].replace(tzinfo=None) <= deleted_at
+    ]
+    deleted = 0
+    for chunk in chunks(keys, _DELETE_OBJECTS_SIZE):
+        response = s3.delete_objects(
+            Bucket=bucket, Delete={"Objects": chunk, "Quiet": True}
+        )
+        errors = response.get("Errors", [])
+        if errors:
+            logger.error("DeleteObjects errors: %s", json.dumps(errors))
+        deleted += len(chunk) - len(errors)
+    return deleted, page.get("NextContinuationToken")
+
+
+def delete_model_file(s3, bucket: str, key: str, deleted_at: datetime) -> int:
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key)
+    except s3.exceptions.ClientError:
+        return 0
+    # a file uploaded after the deletion belongs to a new model of the same name
+    if head["LastModified"].replace(tzinfo=None) > deleted_at:
+        return 0
+    s3.delete_object(Bucket=bucket, Key=key)
+    return 1
+
+
+def delete_files(
+    username: str,
+    model_name: str,
+    deleted_at: str,
+    start_key: dict | None,
+    context,
+) -> tuple[int, dict | None]:
+    """Delete the files and the logs of the model, region after region and
+    one page of logs at a time, and return the number of objects deleted and
+    where to resume (None when done; a key without `token` resumes at the
+    start of the region)."""
+    timestamp = datetime.fromisoformat(deleted_at)
+    start = REGIONS.index(start_key["region"]) if start_key else 0
+    token = start_key.get("token") if start_key else None
+
+    deleted = 0
+    for k, region in enumerate(REGIONS[start:], start):
+        s3 = boto3.client("s3", region_name=region)
+        if not token:
+            # files stored before content-addressed storage:
+            # <username>/<model_name>[_preprocessing]; artifacts/<sha256>
+            # files can be shared with other models and are kept
+            for key in [
+                f"{username}/{model_name}",
+                f"{username}/{model_name}_preprocessing",
+            ]:
+                deleted += delete_model_file(
+                    s3, f"{_PREFIX}-models-{region}", key, timestamp
+                )
+
+        # logs: <username>/<model_name>/<timestamp>.json
+        while True:
+            count, token = delete_objects(
+                s3,
+                f"{_PREFIX}-logs-{region}",
+                f"{username}/{model_name}/",
+                timestamp,
+                token,
+            )
+            deleted += count
+
+            if not token:
+                break
+            if context.get_remaining_time_in_millis() < _TIME_BUFFER:
+                return deleted, {"region": region, "token": token}
+
+        if k + 1 < len(REGIONS) and (
+            context.get_remaining_time_in_millis() < _TIME_BUFFER
+        ):
+            return deleted, {"region": REGIONS[k + 1]}
+    return deleted, None
+
+
+def hand_over(username: str, model_name: str, deleted_at: str, state: dict):
+    """Continue the cleanup in a new invocation, from `state`."""
+    _ = sqs.send_message(
+        QueueUrl=_QUEUE,
+        MessageGroupId=f"{username}|{model_name}",
+        MessageDeduplicationId=str(uuid()),
+        MessageBody=json.dumps(
+            {
+                "username": username,
+                "model_name": model_name,
+                "deleted_at": deleted_at,
+                **state,
+            }
+        ),
+    )
+
+
+def main(
+    username: str,
+    model_name: str,
+    deleted_at: str,
+    context,
+    exclusive_start_key: dict | None = None,
+    usages_deleted: int = 0,
+    files_deleted: int | None = None,
+    files_start_key: dict | None = None,
+):
+    progress = {
+        "status": "in_progress",
+        "usages_deleted": usages_deleted,
+        "files_deleted": files_deleted,
+    }
+    if not set_progress(username, model_name, progress):
+        logger.info("Model %s/%s exists again, stopping cleanup", username, model_name)
+        return
+
+    # files and logs first (files_deleted is None until the pass has started)
+    if files_deleted is None or files_start_key:
+        deleted, files_start_key = delete_files(
+            username=username,
+            model_name=model_name,
+            deleted_at=deleted_at,
+            start_key=files_start_key,
+            context=context,
+        )
+        files_deleted = (files_deleted or 0) + deleted
+        progress["files_deleted"] = files_deleted
+        set_progress(username, model_name, progress)
+
+        if files_start_key:
+            # out of time: continue in a new invocation
+            hand_over(
+                username,
+                model_name,
+                deleted_at,
+                {
+                    "files_deleted": files_deleted,
+                    "files_start_key": files_start_key,
+                },
+            )
+            return
+
+    deleted, exclusive_start_key = delete_usages(
+        username=username,
+        model_name=model_name,
+        deleted_at=deleted_at,
+        exclusive_start_key=exclusive_start_key,
+        context=context,
+    )
+    progress["usages_deleted"] = usages_deleted + deleted
+
+    if exclusive_start_key:
+        # out of time: continue in a new invocation
+        set_progress(username, model_name, progress)
+        hand_over(
+            username,
+            model_name,
+            deleted_at,
+            {
+                "exclusive_start_key": exclusive_start_key,
+                "usages_deleted": progress["usages_deleted"],
+                "files_deleted": files_deleted,
+            },
+        )
+        return
+
+    set_progress(username, model_name, {**progress, "status": "done"})
+
+
+def handler(event: dict, context):
+    logger.debug("Event: %s", json.dumps(event))
+    for record in event["Records"]:
+        body = json.loads(record["body"])
+        main(**body, context=context)
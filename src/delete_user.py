@@ -1,21 +1,24 @@
 import os
 import json
+import random
+from uuid import uuid4 as uuid
+from concurrent.futures import ThreadPoolExecutor
 from flows import delete_user_api_resources as delete
+from helpers import throttling
 from helpers.logging import logger
+import boto3
 
 _REGION_NAME = os.environ["region_name"]
-_empty = {
-    "region_name": "Not provided",
-    "domain_name": None,
-    "rest_api_id": None,
-    "hosted_zone_id": None,
-    "cert_arn": None,
-    "dns_validation_record": None,
-    "custom_domain_a_record": None,
-}
-
-
-def delete_resources(username: str, region_name: str, **kwargs):
+_QUEUE = os.environ["queue"]
+sqs = boto3.client("sqs")
+
+# a teardown that failed is retried with exponential backoff (seconds)
+_MAX_RETRY_DELAY = 900
+
+
+def delete_resources(username: str, region_name: str, **kwargs) -> int | None:
+    """Return None when the resources are deleted (or meant for another
+    region), or the number of seconds to wait before retrying."""
     # confirm that the api gateway resources were deployed in this region
     if region_name != _REGION_NAME:
         result = {
@@ -25,22 +28,52 @@ def delete_resources(username: str, region_name: str, **kwargs):
             "Expected region": _REGION_NAME,
         }
         logger.debug("result: %s", json.dumps(result, default=str))
-        return
+        return None
 
     record = delete.get_record(username, region_name)
-    resources = {**_empty, **record.get("resources", {})}
+    resources = record.get("resources", {})
 
     logger.debug("resources: %s", json.dumps(resources, default=str))
-    delete.delete_resources(username, **resources)
+    return delete.delete_resources(username, region_name, resources)
+
+
+def get_retry_delay(delay: int, attempt: int) -> int:
+    backoff = random.uniform(0.5, 1) * delay * 2 ** (attempt - 1)
+    return min(_MAX_RETRY_DELAY, max(delay, round(backoff)))
 
 
 def handler(event: dict, context):
     logger.debug("Event: %s", json.dumps(event))
+    throttling.set_deadline(context)
     if "Records" not in event:
-        delete_resources(**event)
+        if delete_resources(**event):
+            # retried from the queue
+            _ = sqs.send_message(
+                QueueUrl=_QUEUE,
+                MessageGroupId=event["username"],
+                MessageDeduplicationId=str(uuid()),
+                MessageBody=json.dumps(event),
+            )
         return
 
-    for k, record in enumerate(event.get("Records", [])):
-        body = json.loads(record["body"])
-        logger.debug(f"{k}: {record['body']}")
-        delete_resources(**body)
+    # the teardowns of the users of the batch run concurrently; one that
+    # failed is hidden for the backoff delay and reported as failed, so that
+    # SQS delivers it again (FIFO queues do not support per-message delays)
+    def process(record: dict) -> dict | None:
+        logger.debug("Record: %s", record["body"])
+        delay = delete_resources(**json.loads(record["body"]))
+        if not delay:
+            return None
+
+        attempt = int(record["attributes"]["ApproximateReceiveCount"])
+        sqs.change_message_visibility(
+            QueueUrl=_QUEUE,
+            ReceiptHandle=record["receiptHandle"],
+            VisibilityTimeout=get_retry_delay(delay, attempt),
+        )
+        return {"itemIdentifier": record["messageId"]}
+
+    records = event["Records"]
+    with ThreadPoolExecutor(max_workers=max(1, len(records))) as executor:
+        failures = [f for f in executor.map(process, records) if f]
+    return {"batchItemFailures": failures}
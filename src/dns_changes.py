@@ -0,0 +1,174 @@
+"""Apply the Route 53 changes of many users in as few ChangeBatch calls as possible.
+
+The user API flows do not call Route 53 themselves: `request_change` queues a
+change, and this function receives the changes queued over a short window
+and submits them per hosted zone as one ChangeBatch. Route 53 rejects a whole
+batch when one change conflicts ("already exists" on CREATE, "not found" on
+DELETE); those changes are already in the desired state, so they are taken
+out and the rest of the batch is submitted again. The result of each change
+is written to the user's Apis record:
+
+- `<resource>_status`: "pending" (or "deleting", set by the caller), "done",
+  "deleted" or "error: <message>"
+- `resources.<resource>`: the change that deletes the record again (CREATE)
+"""
+import os
+import re
+import json
+from helpers import throttling
+from helpers.logging import logger
+import boto3
+
+_PREFIX = os.environ["prefix"]
+_QUEUE = os.environ["dns_queue"]
+APIS_TABLE_NAME = f"{_PREFIX}_Apis"
+
+# max changes per ChangeBatch is 1000 (and 32,000 characters of values)
+_MAX_BATCH_SIZE = 500
+
+# "Tried to create resource record set [name='a.example.com.', type='A'] but
+# it already exists", "Tried to delete ... but it was not found"
+_CONFLICT = re.compile(
+    r"Tried to (create|delete) resource record set "
+    r"\[name='([^']*)', type='([^']*)'[^\]]*\] but it (already exists|was not found)"
+)
+
+# dynamodb boto3
+dynamodb = boto3.resource("dynamodb")
+APIS_TABLE = dynamodb.Table(APIS_TABLE_NAME)
+
+# other boto3 clients
+sqs = boto3.client("sqs")
+route53 = throttling.client("route53")
+
+
+def request_change(
+    username: str, region_name: str, hosted_zone_id: str, resource: str, change: dict
+):
+    """Queue a change of the record `resource` (e.g. "custom_domain_a_record")
+    of the user; the caller marks `<resource>_status` as pending first."""
+    _ = sqs.send_message(
+        QueueUrl=_QUEUE,
+        MessageBody=json.dumps(
+            {
+                "username": username,
+                "region_name": region_name,
+                "hosted_zone_id": hosted_zone_id,
+                "resource": resource,
+                "change": change,
+            }
+        ),
+    )
+
+
+def normalize(name: str) -> str:
+    return name.rstrip(".").lower()
+
+
+def get_conflicts(message: str) -> dict[tuple[str, str, str], str]:
+    """Map (action, name, type) of the conflicting changes to their result."""
+    return {
+        (action.upper(), normalize(name), type_): (
+            "already_exists" if reason == "already exists" else "not_found"
+        )
+        for action, name, type_, reason in _CONFLICT.findall(message)
+    }
+
+
+def get_conflict(change: dict, conflicts: dict) -> str | None:
+    record_set = change["ResourceRecordSet"]
+    action = "CREATE" if change["Action"] == "CREATE" else "DELETE"
+    return conflicts.get((action, normalize(record_set["Name"]), record_set["Type"]))
+
+
+def apply_changes(hosted_zone_id: str, changes: list[dict]) -> list[str]:
+    """Submit the changes as one batch and return the result of each:
+    "applied", "already_exists", "not_found" or "error: <message>"."""
+    results = ["applied"] * len(changes)
+    pending = list(range(len(changes)))
+    while pending:
+        try:
+            _ = route53.change_resource_record_sets(
+                HostedZoneId=hosted_zone_id,
+                ChangeBatch={"Changes": [changes[k] for k in pending]},
+            )
+            return results
+        except (
+            route53.exceptions.InvalidChangeBatch,
+            route53.exceptions.InvalidInput,
+        ) as err:
+            conflicts = get_conflicts(str(err))
+            logger.info("Conflicts: %s", conflicts)
+            conflicting = [k for k in pending if get_conflict(changes[k], conflicts)]
+            if conflicting:
+                for k in conflicting:
+                    results[k] = get_conflict(changes[k], conflicts)
+                pending = [k for k in pending if k not in conflicting]
+            elif len(pending) == 1:
+                results[pending[0]] = f"error: {err}"
+                return results
+            else:
+                # an error that names no change: find the culprit(s) one by one
+                for k in pending:
+                    results[k] = apply_changes(hosted_zone_id, [changes[k]])[0]
+                return results
+    return results
+
+
+def report(request: dict, result: str):
+    """Write the result of the change to the user's Apis record."""
+    resource, change = request["resource"], request["change"]
+    names = {"#status": f"{resource}_status"}
+    if result.startswith("error"):
+        expression, values = "SET #status = :status", {":status": result}
+    elif change["Action"] == "DELETE":
+        expression, values = "SET #status = :status", {":status": "deleted"}
+    else:
+        expression = "SET #status = :status, resources.#resource = :undo"
+        names["#resource"] = resource
+        values = {
+            ":status": "done",
+            ":undo": json.dumps([{**change, "Action": "DELETE"}]),
+        }
+    try:
+        APIS_TABLE.update_item(
+            Key={"pk": request["username"], "sk": request["region_name"]},
+            UpdateExpression=expression,
+            ConditionExpression="attribute_exists(pk)",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        # the user (and its record) was deleted in the meantime
+        logger.info("No Apis record for %s", request["username"])
+
+
+def handler(event: dict, context):
+    logger.debug("Event: %s", json.dumps(event))
+    throttling.set_deadline(context)
+    requests: dict[str, list[tuple[str, dict]]] = {}  # per hosted zone
+    for record in event["Records"]:
+        request = json.loads(record["body"])
+        requests.setdefault(request["hosted_zone_id"], []).append(
+            (record["messageId"], request)
+        )
+
+    failures = []
+    for hosted_zone_id, items in requests.items():
+        for k in range(0, len(items), _MAX_BATCH_SIZE):
+            chunk = items[k : k + _MAX_BATCH_SIZE]
+            try:
+                results = apply_changes(
+                    hosted_zone_id, [request["change"] for _, request in chunk]
+                )
+            except throttling.Throttled as err:
+                # still throttled after retrying: SQS delivers them again
+                logger.warning("Throttled: %s", err)
+                failures += [{"itemIdentifier": id} for id, _ in chunk]
+                continue
+
+            logger.info("Applied %s changes to %s", len(chunk), hosted_zone_id)
+            for (_, request), result in zip(chunk, results):
+                report(request, result)
+
+    return {"batchItemFailures": failures}
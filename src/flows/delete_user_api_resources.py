@@ -1,141 +1,217 @@
+"""Delete the API resources of a user.
+
+The deletions form a dependency graph (`TEARDOWN`): deletions that do not
+depend on each other run concurrently, and a deletion starts once the
+deletions it depends on are done (the certificate and the REST API are in use
+until the custom domain is deleted). Each deletion is idempotent and
+checkpointed by removing its resource from the Apis record, so a teardown that
+fails part-way can be retried and only deletes what is left; the record is
+deleted once every resource is.
+
+Route 53 records are deleted by dns_changes, like they are created: the
+deletion marks `<resource>_status` as "deleting", queues the change and waits
+until dns_changes reports it "deleted" (a change that failed is queued again).
+"""
 import os
 import json
-from helpers import dynamodb as ddb
-import boto3
+import math
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Tuple
+from helpers import tables, throttling
+from dns_changes import request_change
 
 PREFIX = os.environ["prefix"]
 
-# dynamodb boto3
-_APIS_TABLE_NAME = f"{PREFIX}_Apis"
-dynamodb_client = boto3.client("dynamodb")
+# boto3 clients
+acm = throttling.client("acm")
+apigw = throttling.client("apigateway")
 
-# other boto3 clients
-acm = boto3.client("acm")
-apigw = boto3.client("apigateway")
-route53 = boto3.client("route53")
+# seconds to wait before retrying a failed deletion that gave no hint
+_RETRY_DELAY = 30
+# seconds to wait before checking a queued Route 53 change again
+_DNS_CHANGE_DELAY = 15
+
+
+class Waiting(Exception):
+    """The deletion has been requested and is not done yet."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 def get_record(username: str, region_name: str) -> dict:
-    response = dynamodb_client.get_item(
-        TableName=_APIS_TABLE_NAME,
-        Key=ddb.to_({"pk": username, "sk": region_name}),
-    )
-    item = ddb.from_(response.get("Item", {}))
-    return item
+    return tables.get_item(tables.APIS, {"pk": username, "sk": region_name})
 
 
 def delete_record(username: str, region_name: str):
-    key = ddb.to_({"pk": username, "sk": region_name})
+    key = {"pk": username, "sk": region_name}
+    apis = tables.table(tables.APIS)
     try:
-        dynamodb_client.delete_item(TableName=_APIS_TABLE_NAME, Key=key)
-    except dynamodb_client.exceptions.ResourceNotFoundException:
+        apis.delete_item(Key=key)
+    except apis.meta.client.exceptions.ResourceNotFoundException:
         print(f"Item {key} was already deleted.")
 
 
-def delete_resources(
-    username: str,
-    domain_name: str,
-    rest_api_id: str,
-    hosted_zone_id: str,
-    cert_arn: str,
-    dns_validation_record: str,
-    custom_domain_a_record: str,
-    **kwargs,
-):
-    record = {
-        "custom_domain": True,
-        "dns_validation": True,
-        "a_record_for_sub_domain": True,
-        "cert_for_sub_domain": True,
-        "api_gateway": True,
-    }
+def set_status(username: str, region_name: str, resource: str, status: str):
+    apis = tables.table(tables.APIS)
+    apis.update_item(
+        Key={"pk": username, "sk": region_name},
+        UpdateExpression="SET #status = :status",
+        ConditionExpression="attribute_exists(pk)",
+        ExpressionAttributeNames={"#status": f"{resource}_status"},
+        ExpressionAttributeValues={":status": status},
+    )
+
 
-    # delete custom domain
-    # can get a "too many requests" error
+def remove_resource(username: str, region_name: str, attribute: str):
+    """Checkpoint a deletion: remove the resource from the Apis record."""
+    apis = tables.table(tables.APIS)
     try:
-        if domain_name:
-            apigw.delete_domain_name(domainName=domain_name)
+        apis.update_item(
+            Key={"pk": username, "sk": region_name},
+            UpdateExpression="REMOVE resources.#attribute",
+            ConditionExpression="attribute_exists(pk)",
+            ExpressionAttributeNames={"#attribute": attribute},
+        )
+    except apis.meta.client.exceptions.ConditionalCheckFailedException:
+        print(f"No Apis record for {username} in {region_name}")
+
+
+def delete_custom_domain(username: str, region_name: str, resources: dict):
+    domain_name = resources["domain_name"]
+    try:
+        apigw.delete_domain_name(domainName=domain_name)
     except apigw.exceptions.NotFoundException as err:
         print(f"Custom domain {domain_name} was already deleted: {err}")
-    except Exception as err:
-        print(f"Custom domain {domain_name} deletion error: ", err)
-        record["custom_domain"] = False
     else:
         print(f"Deleted API Gateway custom domain '{domain_name}'")
 
-    # delete validation record in route 53
-    try:
-        if dns_validation_record:
-            response = route53.change_resource_record_sets(
-                HostedZoneId=hosted_zone_id,
-                ChangeBatch={"Changes": json.loads(dns_validation_record)},
-            )
-    except route53.exceptions.NoSuchHostedZone as err:
-        print(f"The route 53 hosted zone '{hosted_zone_id}' does not exist")
-    except route53.exceptions.InvalidChangeBatch as err:
-        if "it was not found" not in str(err):
-            raise err
-        print(f"The Route 53 validation record was already deleted")
-    except Exception as err:
-        print("DNS validation record deletion error: ", err)
-        record["dns_validation"] = False
-    else:
-        print("Deleted validation record in route 53")
-
-    # delete custom domain in route 53
-    try:
-        if custom_domain_a_record:
-            response = route53.change_resource_record_sets(
-                HostedZoneId=hosted_zone_id,
-                ChangeBatch={"Changes": json.loads(custom_domain_a_record)},
-            )
-    except route53.exceptions.NoSuchHostedZone as err:
-        print(f"The route 53 hosted zone '{hosted_zone_id}' does not exist")
-    except route53.exceptions.InvalidChangeBatch as err:
-        if "it was not found" not in str(err):
-            raise err
-        print(f"The Route 53 custom domain record was already deleted")
-    except Exception as err:
-        print("Route 53 A record for sub domain deletion error: ", err)
-        record["a_record_for_sub_domain"] = False
-    else:
-        print("Deleted A record for custom domain in route 53")
 
-    # delete cert
+def delete_dns_record(username: str, region_name: str, resources: dict, resource: str):
+    # the changes are queued and applied in batches by dns_changes, which
+    # reports their result in <resource>_status
+    record = tables.get_item(
+        tables.APIS, {"pk": username, "sk": region_name}, consistent=True
+    )
+    status = record.get(f"{resource}_status")
+    if status == "deleted":
+        print(f"Deleted {resource} in route 53")
+        return
+    if status == "deleting":
+        raise Waiting(f"Deletion of {resource} is pending", _DNS_CHANGE_DELAY)
+    if status and status.startswith("error"):
+        print(f"Deletion of {resource} failed, requesting it again: {status}")
+
+    # marked before the change is queued, so that the result is not overwritten
+    set_status(username, region_name, resource, "deleting")
+    for change in json.loads(resources[resource]):
+        request_change(
+            username=username,
+            region_name=region_name,
+            hosted_zone_id=resources["hosted_zone_id"],
+            resource=resource,
+            change=change,
+        )
+    raise Waiting(f"Queued deletion of {resource} in route 53", _DNS_CHANGE_DELAY)
+
+
+def delete_dns_validation_record(username: str, region_name: str, resources: dict):
+    delete_dns_record(username, region_name, resources, "dns_validation_record")
+
+
+def delete_custom_domain_a_record(username: str, region_name: str, resources: dict):
+    delete_dns_record(username, region_name, resources, "custom_domain_a_record")
+
+
+def delete_cert(username: str, region_name: str, resources: dict):
+    cert_arn = resources["cert_arn"]
     try:
-        if cert_arn:
-            response = acm.delete_certificate(CertificateArn=cert_arn)
-    except acm.exceptions.ResourceNotFoundException as err:
+        acm.delete_certificate(CertificateArn=cert_arn)
+    except acm.exceptions.ResourceNotFoundException:
         print(f"Certificate '{cert_arn}' has already been deleted.")
-    except acm.exceptions.ResourceInUseException as err:
-        print(f"Certificate '{cert_arn}' is currently still in use: {err}")
-        record["cert_for_sub_domain"] = False
-    except Exception as err:
-        print(f"Certificate '{cert_arn}' for sub domain deletion error: ", err)
-        record["cert_for_sub_domain"] = False
     else:
         print(f"Deleted cert '{cert_arn}'")
 
-    # delete apigw
+
+def delete_rest_api(username: str, region_name: str, resources: dict):
+    rest_api_id = resources["rest_api_id"]
     try:
-        if rest_api_id:
-            response = apigw.delete_rest_api(restApiId=rest_api_id)
+        apigw.delete_rest_api(restApiId=rest_api_id)
     except apigw.exceptions.NotFoundException as err:
         print(f"API Gateway '{rest_api_id}' was already deleted: {err}")
-    except Exception as err:
-        print(f"API Gateway '{rest_api_id}' deletion error: ", err)
-        record["api_gateway"] = False
     else:
         print(f"Deleted rest api '{rest_api_id}'")
 
-    # delete record
-    if all(val for val in record.values()):
-        try:
-            delete_record(username)
-        except:
-            print("Potentially failed to delete record")
-        else:
-            print("Record deleted")
-
-    # Log sumamry
-    print("Deletion summary: ", json.dumps(record, default=str))
+
+# deletion: (function, attribute of the resources it deletes, deletions it waits for)
+TEARDOWN: Dict[str, Tuple[Callable[[str, str, dict], None], str, List[str]]] = {
+    "custom_domain": (delete_custom_domain, "domain_name", []),
+    "dns_validation": (delete_dns_validation_record, "dns_validation_record", []),
+    "a_record_for_sub_domain": (
+        delete_custom_domain_a_record,
+        "custom_domain_a_record",
+        [],
+    ),
+    "cert_for_sub_domain": (delete_cert, "cert_arn", ["custom_domain"]),
+    "api_gateway": (delete_rest_api, "rest_api_id", ["custom_domain"]),
+}
+
+
+def delete(username: str, region_name: str, resources: dict, name: str):
+    deletion, attribute, _ = TEARDOWN[name]
+    deletion(username, region_name, resources)
+    remove_resource(username, region_name, attribute)
+
+
+def delete_resources(username: str, region_name: str, resources: dict) -> int | None:
+    """Delete the resources left and the Apis record, and return None when
+    done, or the number of seconds to wait before retrying the deletions that
+    failed."""
+    # deletion: True (done), an exception (failed) or None (blocked)
+    results: Dict[str, bool | Exception | None] = {
+        name: True
+        for name, (_, attribute, _) in TEARDOWN.items()
+        if not resources.get(attribute)
+    }
+    running = {}
+    with ThreadPoolExecutor(max_workers=len(TEARDOWN)) as executor:
+        while True:
+            for name, (_, _, prerequisites) in TEARDOWN.items():
+                if name in results or name in running.values():
+                    continue
+                if any(results.get(p, True) is not True for p in prerequisites):
+                    results[name] = None
+                elif all(p in results for p in prerequisites):
+                    future = executor.submit(
+                        delete, username, region_name, resources, name
+                    )
+                    running[future] = name
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                err = future.exception()
+                results[name] = err or True
+                if isinstance(err, Waiting):
+                    print(f"Waiting for the deletion of {name}: {err}")
+                elif err:
+                    print(f"Deletion of {name} failed: {err}")
+
+    print("Deletion summary: ", json.dumps(results, default=str))
+    # the record is kept until every deletion is done (including the Route 53
+    # changes), so that what is left can be retried
+    failed = [err for err in results.values() if err is not True]
+    if failed:
+        return max(
+            math.ceil(err.retry_after)
+            if isinstance(err, (throttling.Throttled, Waiting))
+            else _RETRY_DELAY
+            for err in failed
+        )
+
+    delete_record(username, region_name)
+    print("Record deleted")
+    return None
@@ -1,30 +1,39 @@
+"""Provision the API of a new user.
+
+With the shared tenant gateway (`tenant_api=shared`), provisioning is a single
+write of the user's Apis record. Otherwise each user gets a dedicated REST API,
+certificate and custom domain, created one short step at a time: each step is
+idempotent and checkpointed in the Apis record, so the flow can stop after any
+step and resume from the record. Steps that depend on AWS (the certificate's
+validation values, the certificate being issued, throttling of the AWS APIs,
+the Route 53 changes queued for dns_changes) return the number of seconds to wait
+instead of blocking; the caller retries the flow after that delay.
+"""
 import os
-from typing import Tuple
+import math
+from typing import Callable, List, Tuple
 import json
-from time import sleep
-from helpers import dynamodb as ddb
+from hashlib import sha256
+from helpers import tables, throttling
+from dns_changes import request_change
 import boto3
 
-_ERROR_429 = (
-    "429 error when attempting to create API Gateway domain name. Sleep 10 seconds."
-)
 PREFIX = os.environ["prefix"]
 
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
-dynamodb = boto3.resource("dynamodb")
-_APIS_TABLE_NAME = f"{PREFIX}_Apis"
-_API_TABLE = dynamodb.Table(_APIS_TABLE_NAME)
-
 # other boto3 clients
-acm = boto3.client("acm")
-apigw = boto3.client("apigateway")
-route53 = boto3.client("route53")
+acm = throttling.client("acm")
+apigw = throttling.client("apigateway")
 lambda_ = boto3.client("lambda")
 
-# acm waiter
 hosted_zone_id = os.environ["hosted_zone_id"]
-waiter = acm.get_waiter("certificate_validated")
+# "dedicated": a REST API, certificate and custom domain per user
+# "shared": users are served by the shared tenant gateway (*.<domain>)
+_TENANT_API = os.environ.get("tenant_api", "dedicated")
+
+# seconds to wait before checking again
+_VALIDATION_VALUES_DELAY = 5
+_CERT_ISSUED_DELAY = 30
+_DNS_CHANGE_DELAY = 15
 
 # Apis table sort keys
 _RESOURCES = "resources"
@@ -34,7 +43,7 @@ _PROXY = "proxy"
 
 def write_object(username: str, payload: dict):
     record = {"pk": username, "sk": _REGION_NAME, **payload}
-    _API_TABLE.put_item(Item=record)
+    tables.table(tables.APIS).put_item(Item=record)
 
 
 def write_api_resources(record: dict, username: str, api_id: str, root_id: str):
@@ -47,56 +56,81 @@ def write_api_resources(record: dict, username: str, api_id: str, root_id: str):
 
     write_object(username, record)
     item = {"pk": username, "sk": _RESOURCES, **payload}
-    _API_TABLE.put_item(Item=item)
+    tables.table(tables.APIS).put_item(Item=item)
 
 
 def get_record(username: str) -> dict:
-    key = ddb.to_({"pk": username, "sk": _REGION_NAME})
-    response = dynamodb_client.get_item(TableName=_APIS_TABLE_NAME, Key=key)
-    return ddb.from_(response.get("Item", {}))
+    return tables.get_item(tables.APIS, {"pk": username, "sk": _REGION_NAME})
 
 
-def request_cert(record: dict) -> str:
+def request_cert(record: dict) -> int | None:
+    if "cert_arn" in record["resources"]:
+        return None
+
     username = record["username"]
     sub = username
     domain_name = record["domain_name"]
 
     print(f"1. Requesting certicate for {sub}.{domain_name}")
+    # the token makes a retried request return the same certificate
     cert_request = acm.request_certificate(
         DomainName=f"{sub}.{domain_name}",
         ValidationMethod="DNS",
+        IdempotencyToken=sha256(f"{sub}.{domain_name}".encode()).hexdigest()[:32],
     )
 
-    cert_arn = cert_request["CertificateArn"]
-
-    record["step"] = 1
-    record["resources"]["cert_arn"] = cert_arn
+    record["resources"]["cert_arn"] = cert_request["CertificateArn"]
     print("record 1: ", json.dumps(record, default=str))
-    write_object(username, record)
-    return cert_request["CertificateArn"]
-
+    return None
 
-def wait_for_validation_values(cert_arn: str) -> dict:
-    iter, cert = 1, {"Certificate": {}}
-    while "Value" not in (
-        cert["Certificate"]
-        .get("DomainValidationOptions", [{}])[0]
-        .get("ResourceRecord", {})
-    ):
-        print("iter: ", iter)
-        iter += 1
-        cert = acm.describe_certificate(CertificateArn=cert_arn)
-        sleep(0.2)
 
+def get_validation_values(cert_arn: str) -> dict | None:
+    cert = acm.describe_certificate(CertificateArn=cert_arn)
     print("cert: ", json.dumps(cert, default=str))
+    options = cert["Certificate"].get("DomainValidationOptions") or [{}]
+    resource_record = options[0].get("ResourceRecord", {})
+    return resource_record if "Value" in resource_record else None
+
+
+def request_dns_change(record: dict, resource: str, change: dict) -> int:
+    # marked as pending before the change is queued, so that writing the record
+    # does not overwrite the result reported by dns_changes
+    record[f"{resource}_status"] = "pending"
+    write_object(record["username"], record)
+    request_change(
+        username=record["username"],
+        region_name=_REGION_NAME,
+        hosted_zone_id=hosted_zone_id,
+        resource=resource,
+        change=change,
+    )
+    return _DNS_CHANGE_DELAY
 
-    # return values
-    return cert["Certificate"]["DomainValidationOptions"][0]["ResourceRecord"]
 
+def wait_for_dns_change(record: dict, resource: str) -> int | None:
+    # dns_changes sets resources.<resource> once the change is applied
+    status = record.get(f"{resource}_status")
+    if resource in record["resources"]:
+        return None
+    if status == "pending":
+        return _DNS_CHANGE_DELAY
+    raise Exception(f"Route 53 change of {resource} failed: {status}")
 
-def create_vaidation_record(record: dict, resource_record: dict):
-    username = record["username"]
-    dns_validation_records = [
+
+def create_vaidation_record(record: dict) -> int | None:
+    if record.get("dns_validation_record_status") or (
+        "dns_validation_record" in record["resources"]
+    ):
+        return wait_for_dns_change(record, "dns_validation_record")
+
+    # ACM adds the validation values to the certificate shortly after the request
+    resource_record = get_validation_values(record["resources"]["cert_arn"])
+    if not resource_record:
+        return _VALIDATION_VALUES_DELAY
+
+    return request_dns_change(
+        record,
+        "dns_validation_record",
         {
             "Action": "CREATE",
             "ResourceRecordSet": {
@@ -108,34 +142,43 @@ def create_vaidation_record(record: dict, resource_record: dict):
                 ],
             },
         },
-    ]
-    try:
-        _ = route53.change_resource_record_sets(
-            HostedZoneId=hosted_zone_id,
-            ChangeBatch={"Changes": dns_validation_records},
+    )
+
+
+def find_rest_api(name: str) -> dict | None:
+    position = None
+    while True:
+        response = apigw.get_rest_apis(
+            limit=500, **({"position": position} if position else {})
         )
-    except route53.exceptions.InvalidChangeBatch as err:
-        if "it already exists" in str(err):
-            print("Validation record already exists")
-        else:
-            raise err
+        api = next((x for x in response["items"] if x["name"] == name), None)
+        position = response.get("position")
+        if api or not position:
+            return api
 
-    dns_validation_records[0]["Action"] = "DELETE"
-    record["step"] = 2
-    record["resources"]["dns_validation_record"] = json.dumps(dns_validation_records)
-    write_object(username, record)
 
+def create_api(record: dict) -> int | None:
+    if "rest_api_id" in record["resources"]:
+        return None
 
-def create_api(record: dict) -> Tuple[str, str]:
     domain_name = record["domain_name"]
     username = record["username"]
     sub = username
 
-    # create api
-    api = apigw.create_rest_api(
-        name=f"{domain_name}-{sub}-api",
-        endpointConfiguration={"types": ["REGIONAL"]},
-    )
+    # create api, unless a previous run created it before the flow stopped:
+    # the record is checkpointed before each request, and the API is then
+    # looked up by its name (unique per user and region)
+    name = f"{domain_name}-{sub}-api"
+    api = None
+    if record["resources"].get("rest_api_requested"):
+        api = find_rest_api(name)
+    if not api:
+        record["resources"]["rest_api_requested"] = True
+        write_object(username, record)
+        api = apigw.create_rest_api(
+            name=name,
+            endpointConfiguration={"types": ["REGIONAL"]},
+        )
 
     api_id = api["id"]
 
@@ -144,17 +187,25 @@ def create_api(record: dict) -> Tuple[str, str]:
     resources = response["items"]
     root_id = next(x for x in resources if x["path"] == "/")["id"]
 
-    record["step"] = 3
     record["resources"]["rest_api_id"] = api_id
     record["resources"]["root_id"] = root_id
-    write_object(username, record)
+    return None
 
-    ping = apigw.create_resource(
-        restApiId=api_id,
-        parentId=root_id,
-        pathPart="ping",
-    )
-    ping_id = ping["id"]
+
+def create_ping(record: dict) -> int | None:
+    api_id = record["resources"]["rest_api_id"]
+    root_id = record["resources"]["root_id"]
+
+    # the resource may have been created before the flow stopped
+    response = apigw.get_resources(restApiId=api_id)
+    ping_id = next((x["id"] for x in response["items"] if x["path"] == "/ping"), None)
+    if not ping_id:
+        ping = apigw.create_resource(
+            restApiId=api_id,
+            parentId=root_id,
+            pathPart="ping",
+        )
+        ping_id = ping["id"]
 
     # 6. create method (requires resource)
     GET_ping = apigw.put_method(
@@ -197,65 +248,91 @@ def create_api(record: dict) -> Tuple[str, str]:
         stageName="prod",
         tracingEnabled=False,
     )
+    return None
+
+
+def save_api_resources(record: dict) -> int | None:
+    if "tree" not in record["resources"]:
+        write_api_resources(
+            record=record,
+            username=record["username"],
+            api_id=record["resources"]["rest_api_id"],
+            root_id=record["resources"]["root_id"],
+        )
+    return None
+
 
-    return api_id, root_id
+def wait_for_cert_to_be_issued(record: dict) -> int | None:
+    cert_arn = record["resources"]["cert_arn"]
+    cert = acm.describe_certificate(CertificateArn=cert_arn)
+    status = cert["Certificate"]["Status"]
+    print("certificate status: ", status)
+    if status == "ISSUED":
+        return None
+    if status == "PENDING_VALIDATION":
+        return _CERT_ISSUED_DELAY
+    raise Exception(f"Certificate {cert_arn} was not issued: {status}")
 
 
-def create_custom_domain(record: dict, cert_arn: str, api_id: str) -> dict:
+def create_custom_domain(record: dict) -> int | None:
     domain_name = record["domain_name"]
     username = record["username"]
     sub = username
 
-    while True:
-        try:
-            custom_domain = apigw.create_domain_name(
-                domainName=f"{sub}.{domain_name}",
-                regionalCertificateName=f"{sub}.{domain_name}",
-                regionalCertificateArn=cert_arn,
-                endpointConfiguration={"types": ["REGIONAL"]},
-                tags={"username": username},
-                securityPolicy="TLS_1_2",
-            )
-            break
-        except apigw.exceptions.BadRequestException as err:
-            _already_exists = "The domain name you provided already exists."
-            if _already_exists not in str(err):
-                raise err
-            custom_domain = apigw.get_domain_name(domainName=f"{sub}.{domain_name}")
-            break
-        except apigw.exceptions.TooManyRequestsException as err:
-            print(_ERROR_429)
-            sleep(10)
-
-    record["step"] = 5
+    try:
+        custom_domain = apigw.create_domain_name(
+            domainName=f"{sub}.{domain_name}",
+            regionalCertificateName=f"{sub}.{domain_name}",
+            regionalCertificateArn=record["resources"]["cert_arn"],
+            endpointConfiguration={"types": ["REGIONAL"]},
+            tags={"username": username},
+            securityPolicy="TLS_1_2",
+        )
+    except apigw.exceptions.BadRequestException as err:
+        _already_exists = "The domain name you provided already exists."
+        if _already_exists not in str(err):
+            raise err
+        custom_domain = apigw.get_domain_name(domainName=f"{sub}.{domain_name}")
+
     record["resources"]["domain_name"] = f"{sub}.{domain_name}"
+    record["resources"]["custom_domain"] = {
+        "regionalDomainName": custom_domain["regionalDomainName"],
+        "regionalHostedZoneId": custom_domain["regionalHostedZoneId"],
+    }
     print("record 5: ", json.dumps(record, default=str))
-    write_object(username, record)
+    return None
 
+
+def create_base_path_mapping(record: dict) -> int | None:
     # associate custom domain w/ apigw
     try:
         _ = apigw.create_base_path_mapping(
-            domainName=f"{sub}.{domain_name}",
-            restApiId=api_id,
+            domainName=record["resources"]["domain_name"],
+            restApiId=record["resources"]["rest_api_id"],
             stage="prod",
         )
-    except apigw.exceptions.BadRequestException as err:
-        _already_exists = "The domain name you provided already exists."
-        if _already_exists not in str(err):
-            raise err
+    except apigw.exceptions.ConflictException:
+        print("Base path mapping already exists")
+    return None
 
-    return custom_domain
 
+def create_a_record(record: dict) -> int | None:
+    if record.get("custom_domain_a_record_status") or (
+        "custom_domain_a_record" in record["resources"]
+    ):
+        return wait_for_dns_change(record, "custom_domain_a_record")
 
-def create_a_record(record: dict, custom_domain: dict):
     domain_name = record["domain_name"]
     username = record["username"]
     sub = username
 
+    custom_domain = record["resources"]["custom_domain"]
     apigw_domain_name = custom_domain["regionalDomainName"]
     apigw_zone_id = custom_domain["regionalHostedZoneId"]
 
-    subdomain_records = [
+    return request_dns_change(
+        record,
+        "custom_domain_a_record",
         {
             "Action": "CREATE",
             "ResourceRecordSet": {
@@ -268,34 +345,40 @@ def create_a_record(record: dict, custom_domain: dict):
                 },
             },
         },
-    ]
-    try:
-        _ = route53.change_resource_record_sets(
-            HostedZoneId=hosted_zone_id,
-            ChangeBatch={"Changes": subdomain_records},
-        )
-    except route53.exceptions.InvalidChangeBatch as err:
-        if "it already exists" in str(err):
-            print("Route 53 A record already exists")
-        else:
-            raise err
-
-    subdomain_records[0]["Action"] = "DELETE"
-    record["step"] = 7
-    record["resources"]["custom_domain_a_record"] = json.dumps(subdomain_records)
-    print("record 7: ", json.dumps(record, default=str))
-    write_object(username, record)
-
-
-def wait_for_cert_to_be_issued(cert_arn: str):
-    print("Waiting for ceritifcate to be validated", end=". . .")
-    waiter.wait(CertificateArn=cert_arn, WaiterConfig={"Delay": 30, "MaxAttempts": 6})
-    print("done")
-    sleep(30)
+    )
 
 
-def create_api_for_sub_domain(domain_name: str, username: str) -> dict:
-    sub = username
+# record["step"] is the number of steps completed
+STEPS: List[Callable[[dict], int | None]] = [
+    request_cert,
+    create_vaidation_record,
+    create_api,
+    create_ping,
+    save_api_resources,
+    wait_for_cert_to_be_issued,
+    create_custom_domain,
+    create_base_path_mapping,
+    create_a_record,
+]
+
+
+def create_api_for_sub_domain(domain_name: str, username: str) -> int | None:
+    """Run the steps left and return None when the API is ready, or the number
+    of seconds to wait before calling again."""
+    if _TENANT_API == "shared":
+        # the tenant gateway resolves the user from the Apis record
+        write_object(
+            username,
+            {
+                "domain_name": domain_name,
+                "username": username,
+                "success": True,
+                "tenant_api": "shared",
+                "resources": {"hosted_zone_id": hosted_zone_id},
+            },
+        )
+        print("Created api: ", f"https://{username}.{domain_name}")
+        return None
 
     # 0. get record
     record = get_record(username)
@@ -309,49 +392,20 @@ def create_api_for_sub_domain(domain_name: str, username: str) -> dict:
         }
     print("Record: ", json.dumps(record, default=str))
 
-    # 1. request cert
-    if "cert_arn" in record["resources"]:
-        cert_arn = record["resources"]["cert_arn"]
-    else:
-        cert_arn = request_cert(record)
-
-    # 2. create dns CNAME record for validation
-    if "dns_validation_record" not in record["resources"]:
-        resource_record = wait_for_validation_values(cert_arn)
-        create_vaidation_record(record, resource_record)
-
-    # 3. create apigw and GET /ping
-    if "rest_api_id" in record["resources"] and "root_id" in record["resources"]:
-        api_id = record["resources"]["rest_api_id"]
-        root_id = record["resources"]["root_id"]
-    else:
-        api_id, root_id = create_api(record)
-
-    # 3b. save in Apis table
-    if "tree" not in record["resources"]:
-        write_api_resources(
-            record=record,
-            username=username,
-            api_id=api_id,
-            root_id=root_id,
-        )
-
-    # 4. Wait until cert is issued
-    wait_for_cert_to_be_issued(cert_arn)
-
-    # 5. create custom domain for apigw and point to api
-    if "custom_domain" in record["resources"]:
-        custom_domain = record["resources"]["custom_domain"]
-    else:
-        custom_domain = create_custom_domain(record, cert_arn, api_id)
-
-    # 6. update route 53 to point {sub}.{domain_name}
-    if "a_record_for_sub_domain" not in record["resources"]:
-        create_a_record(record, custom_domain)
-
-    return {
-        "endpoint": f"https://{sub}.{domain_name}",
-    }
+    for step in range(int(record["step"]), len(STEPS)):
+        try:
+            delay = STEPS[step](record)
+        except throttling.Throttled as err:
+            delay = math.ceil(err.retry_after)
+        if delay:
+            print(f"Step {step} ({STEPS[step].__name__}): retry in {delay} s")
+            return delay
+        record["step"] = step + 1
+        record["success"] = record["step"] == len(STEPS)
+        write_object(username, record)
+
+    print("Created api: ", f"https://{username}.{domain_name}")
+    return None
 
 
 # IAM Policies
@@ -0,0 +1,175 @@
+"""Counts and rollups kept in the Aggregates table, read with key reads.
+
+`src/aggregates.py` maintains them from the streams of the Users, Models and
+Usages tables, so nothing that needs a count scans a table. Each region has its
+own Aggregates table, updated from its own replica of each global table (which
+receives every write, local or replicated), so the aggregates of each region
+cover every region. Items:
+
+- `pk=users`, `sk=total`: `count` of users
+- `pk=username|<username>`, `sk=totals`: `models` (models that are not
+  deleted) and `api_keys` of the user
+- `pk=usage|<username>|<model_name>`, `sk=<granularity>|<period>`: rollup of
+  the model's requests started in the minute (`minute|%Y-%m-%dT%H:%M`), hour
+  (`hour|%Y-%m-%dT%H`) or day (`day|%Y-%m-%d`), in UTC: `requests`, `errors`
+  (status code >= 400), `duration_sum` (ms), `status_<code>` (requests per
+  status code) and `bucket_<k>` (duration histogram, see `get_bucket`). Minute
+  rollups are kept 7 days and hour rollups 90 days (`ttl`).
+
+Counts are eventually consistent: they trail the tables by the stream delay,
+usually under a second.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from helpers import tables
+
+
+class Granularity(NamedTuple):
+    length: int  # of the ISO timestamp prefix that names the period
+    step: timedelta
+    retention: timedelta | None
+
+
+GRANULARITIES: dict[str, Granularity] = {
+    "minute": Granularity(
+        len("YYYY-MM-DDTHH:MM"), timedelta(minutes=1), timedelta(days=7)
+    ),
+    "hour": Granularity(len("YYYY-MM-DDTHH"), timedelta(hours=1), timedelta(days=90)),
+    "day": Granularity(len("YYYY-MM-DD"), timedelta(days=1), None),
+}
+
+# durations d > 1 ms fall in bucket ceil(log(d) / log(_GAMMA)), whose value is
+# within (_GAMMA - 1) / (_GAMMA + 1) = 9% of every duration in it (the
+# percentiles have the same relative error)
+_GAMMA = 1.2
+
+
+def get_users_key() -> dict:
+    return {"pk": "users", "sk": "total"}
+
+
+def get_user_key(username: str) -> dict:
+    return {"pk": f"username|{username}", "sk": "totals"}
+
+
+def get_rollup_key(
+    username: str, model_name: str, granularity: str, timestamp: str
+) -> dict:
+    """Key of the rollup of the period of the ISO timestamp."""
+    period = timestamp[: GRANULARITIES[granularity].length]
+    return {"pk": f"usage|{username}|{model_name}", "sk": f"{granularity}|{period}"}
+
+
+def get_rollup_keys(username: str, model_name: str, timestamp: str) -> list[dict]:
+    """Keys of the minute, hour and day rollups of the ISO timestamp."""
+    return [
+        get_rollup_key(username, model_name, granularity, timestamp)
+        for granularity in GRANULARITIES
+    ]
+
+
+def get_expiry(key: dict) -> int | None:
+    """Epoch time after which the item can be deleted (None: kept)."""
+    if not key["pk"].startswith("usage|"):
+        return None
+    granularity, period = key["sk"].split("|")
+    _, step, retention = GRANULARITIES[granularity]
+    if not retention:
+        return None
+    start = datetime.fromisoformat(period).replace(tzinfo=timezone.utc)
+    return int((start + step + retention).timestamp())
+
+
+def get_bucket(duration: float) -> int:
+    return max(0, math.ceil(math.log(max(duration, 1)) / math.log(_GAMMA)))
+
+
+def get_bucket_value(bucket: int) -> float:
+    return 2 * _GAMMA**bucket / (_GAMMA + 1)
+
+
+def get_usage_deltas(status_code: int, duration: int) -> dict:
+    """What one request adds to each of its rollups."""
+    return {
+        "requests": 1,
+        "errors": int(status_code >= 400),
+        "duration_sum": duration,
+        f"status_{status_code}": 1,
+        f"bucket_{get_bucket(duration)}": 1,
+    }
+
+
+def get_number_of_users() -> int:
+    item = tables.get_item(tables.AGGREGATES, get_users_key(), fields=["count"])
+    return int(item.get("count", 0))
+
+
+def get_user_totals(username: str) -> dict:
+    """Return {"models": ..., "api_keys": ...} of the user."""
+    item = tables.get_item(
+        tables.AGGREGATES, get_user_key(username), fields=["models", "api_keys"]
+    )
+    return {
+        "models": int(item.get("models", 0)),
+        "api_keys": int(item.get("api_keys", 0)),
+    }
+
+
+def parse_rollup(item: dict) -> dict:
+    rollup = {
+        "requests": int(item.get("requests", 0)),
+        "errors": int(item.get("errors", 0)),
+        "duration_sum": int(item.get("duration_sum", 0)),
+        "status_codes": {},
+        "histogram": {},
+    }
+    for name, value in item.items():
+        if name.startswith("status_"):
+            rollup["status_codes"][name[len("status_") :]] = int(value)
+        elif name.startswith("bucket_"):
+            rollup["histogram"][int(name[len("bucket_") :])] = int(value)
+    return rollup
+
+
+def get_rollups(
+    username: str, model_name: str, granularity: str, start: str, end: str
+) -> list[dict]:
+    """Return the rollups of the model from the period of `start` to the
+    period of `end` (ISO timestamps), oldest first, with their `period`;
+    periods without requests are left out."""
+    start_key = get_rollup_key(username, model_name, granularity, start)
+    end_key = get_rollup_key(username, model_name, granularity, end)
+    return [
+        {"period": item["sk"].split("|")[1], **parse_rollup(item)}
+        for item in tables.query(
+            tables.AGGREGATES,
+            "pk = :pk AND sk BETWEEN :start AND :end",
+            {":pk": start_key["pk"], ":start": start_key["sk"], ":end": end_key["sk"]},
+        )
+    ]
+
+
+def merge(rollups: list[dict]) -> dict:
+    """The rollup of the requests of every rollup."""
+    merged = parse_rollup({})
+    for rollup in rollups:
+        for name in ["requests", "errors", "duration_sum"]:
+            merged[name] += rollup[name]
+        for name in ["status_codes", "histogram"]:
+            for key, value in rollup[name].items():
+                merged[name][key] = merged[name].get(key, 0) + value
+    return merged
+
+
+def get_percentile(histogram: dict[int, int], q: float) -> float | None:
+    """The q-quantile (0 < q <= 1) of the durations of the histogram."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = math.ceil(q * total)
+    count = 0
+    for bucket in sorted(histogram):
+        count += histogram[bucket]
+        if count >= rank:
+            return get_bucket_value(bucket)
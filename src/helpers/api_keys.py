@@ -0,0 +1,59 @@
+"""Key layout of the API-key rows of the Models table.
+
+API-key rows live in the user's partition (`pk=username|<username>`) under
+`sk=api_key|<hashed_key>`, so a key is read or deleted by its hash alone, and
+carry `api_key_model=<model_name>|<hashed_key>`, the sort key of the sparse
+`api_keys` index, to list the keys of one model (`*` for keys valid for every
+model).
+"""
+from typing import Iterator
+from helpers import tables
+
+INDEX_NAME = "api_keys"
+SK_PREFIX = "api_key|"
+
+
+def get_key(username: str, hashed_key: str) -> dict:
+    return {"pk": f"username|{username}", "sk": f"{SK_PREFIX}{hashed_key}"}
+
+
+def get_index_value(model_name: str, hashed_key: str) -> str:
+    return f"{model_name}|{hashed_key}"
+
+
+def get_key_condition(username: str, model_name: str | None) -> dict:
+    values = {":pk": f"username|{username}"}
+    if model_name:
+        values[":prefix"] = f"{model_name}|"
+        return {
+            "key_condition": "pk = :pk AND begins_with(api_key_model, :prefix)",
+            "values": values,
+            "index_name": INDEX_NAME,
+        }
+    values[":prefix"] = SK_PREFIX
+    return {"key_condition": "pk = :pk AND begins_with(sk, :prefix)", "values": values}
+
+
+def query(
+    username: str,
+    model_name: str | None = None,
+    limit: int | None = None,
+    exclusive_start_key: dict | None = None,
+) -> tuple[list[dict], dict | None]:
+    """Return a page of the API keys of the user (of `model_name` only, if
+    given) and the key to resume from (None on the last page)."""
+    return tables.query_page(
+        tables.MODELS,
+        **get_key_condition(username, model_name),
+        limit=limit,
+        exclusive_start_key=exclusive_start_key,
+    )
+
+
+def query_all(
+    username: str, model_name: str | None = None, fields: list[str] | None = None
+) -> Iterator[dict]:
+    """Yield every API key of the user (of `model_name` only, if given)."""
+    return tables.query(
+        tables.MODELS, **get_key_condition(username, model_name), fields=fields
+    )
@@ -0,0 +1,33 @@
+"""SHA-256 checksums of uploaded files.
+
+Clients send the checksum of each file (or of each part of a multipart upload)
+base64-encoded, as in S3's `x-amz-checksum-sha256` header; S3 rejects content
+that does not match it. The checksum of a presigned POST is optional: files
+uploaded without one are hashed by the staging trigger. The checksum S3 reports for a multipart upload is the
+SHA-256 of the checksums of its parts, followed by `-<number of parts>`.
+"""
+import base64
+import binascii
+
+
+def is_sha256(value) -> bool:
+    """Whether `value` is a base64-encoded SHA-256 digest."""
+    if not isinstance(value, str):
+        return False
+    try:
+        return len(base64.b64decode(value, validate=True)) == 32
+    except binascii.Error:
+        return False
+
+
+def post_field(checksum: str | None) -> dict:
+    """The field (and condition) of a presigned POST that makes S3 check the
+    checksum ({} without a checksum)."""
+    return {"x-amz-checksum-sha256": checksum} if checksum else {}
+
+
+def to_hex(checksum: str) -> str:
+    """Hex form of a checksum reported by S3 (`<hex>-<parts>` for a multipart
+    upload)."""
+    digest, _, parts = checksum.partition("-")
+    return base64.b64decode(digest).hex() + (f"-{parts}" if parts else "")
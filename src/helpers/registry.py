@@ -0,0 +1,176 @@
+"""Reads and single round-trip updates of model records in the Models table.
+
+Every update is one `UpdateItem` that sets only the given attributes and
+increments the record's `version`, so concurrent writers do not overwrite each
+other's attributes. Pass `version` to apply an update only if the record has
+not changed since it was read (optimistic locking).
+
+Model records are stored under `sk=model|<model_name>`. They used to be stored
+under `sk=<model_name>`; while `LEGACY_LAYOUT` is set (the stack sets the
+`legacy_models_layout` environment variable until
+`scripts/migrate_models_layout.py` has finished), `get_model` reads both keys
+in one round trip and prefers the new one, and a record still under the old
+key is copied to the new key before it is written.
+"""
+import os
+from helpers import tables
+import boto3
+
+_PREFIX = os.environ["prefix"]
+MODELS_TABLE_NAME = f"{_PREFIX}_Models"
+SK_PREFIX = "model|"
+LEGACY_LAYOUT = os.environ.get("legacy_models_layout", "true") == "true"
+
+dynamodb = boto3.resource("dynamodb")
+MODELS_TABLE = dynamodb.Table(MODELS_TABLE_NAME)
+
+
+class ConditionFailed(Exception):
+    """The record does not exist, does not satisfy the condition, or has a
+    different version than expected."""
+
+
+def get_key(username: str, model_name: str) -> dict:
+    return {"pk": f"username|{username}", "sk": f"{SK_PREFIX}{model_name}"}
+
+
+def get_legacy_key(username: str, model_name: str) -> dict:
+    return {"pk": f"username|{username}", "sk": model_name}
+
+
+def get_model(
+    username: str,
+    model_name: str,
+    fields: list[str] | None = None,
+    consistent: bool = False,
+) -> dict:
+    """Return the model record ({} if there is none)."""
+    key = get_key(username, model_name)
+    if not LEGACY_LAYOUT:
+        return tables.get_item(MODELS_TABLE_NAME, key, fields, consistent)
+
+    projection = tables.projection(fields and ["sk", *fields])
+    request = {
+        "Keys": [key, get_legacy_key(username, model_name)],
+        "ConsistentRead": consistent,
+        **projection,
+    }
+    items = []
+    while request:
+        response = dynamodb.batch_get_item(RequestItems={MODELS_TABLE_NAME: request})
+        items += response["Responses"].get(MODELS_TABLE_NAME, [])
+        request = response.get("UnprocessedKeys", {}).get(MODELS_TABLE_NAME)
+    items.sort(key=lambda item: item["sk"] != key["sk"])  # the new key first
+    item = items[0] if items else {}
+    if fields and "sk" not in fields:
+        item.pop("sk", None)
+    return item
+
+
+def copy_legacy_record(username: str, model_name: str):
+    """Copy the record from its legacy key to the new key, unless it is
+    there already, and mark the legacy record as migrated (taking it out of
+    the `models` index)."""
+    legacy_key = get_legacy_key(username, model_name)
+    item = MODELS_TABLE.get_item(Key=legacy_key, ConsistentRead=True).get("Item")
+    if not item or item.get("migrated"):
+        return
+
+    # the legacy record must not have changed since it was read
+    if "version" in item:
+        condition = "#version = :version"
+        values = {":version": item["version"]}
+    else:
+        condition, values = "attribute_not_exists(#version)", {}
+    mark = {
+        "Update": {
+            "TableName": MODELS_TABLE_NAME,
+            "Key": legacy_key,
+            "UpdateExpression": "SET migrated = :true REMOVE #model",
+            "ConditionExpression": condition,
+            "ExpressionAttributeNames": {"#version": "version", "#model": "model"},
+            "ExpressionAttributeValues": {":true": True, **values},
+        }
+    }
+    copy = {
+        "Put": {
+            "TableName": MODELS_TABLE_NAME,
+            "Item": {**item, **get_key(username, model_name)},
+            "ConditionExpression": "attribute_not_exists(pk)",
+        }
+    }
+    client = dynamodb.meta.client
+    try:
+        client.transact_write_items(TransactItems=[copy, mark])
+    except client.exceptions.TransactionCanceledException as err:
+        reasons = [x.get("Code") for x in err.response["CancellationReasons"]]
+        if reasons[0] != "ConditionalCheckFailed" or reasons[1] != "None":
+            raise err
+        # already copied: only mark the legacy record
+        client.transact_write_items(TransactItems=[mark])
+
+
+def update_model(
+    username: str,
+    model_name: str,
+    values: dict,
+    defaults: dict | None = None,
+    remove: list[str] | None = None,
+    condition: str | None = "attribute_exists(pk)",
+    condition_values: dict | None = None,
+    version: int | None = None,
+) -> dict:
+    """Set `values` (and `defaults` where the attribute is missing), remove the
+    attributes in `remove` from the model record and return the updated record.
+
+    `condition` is a condition expression on the existing record (None to
+    create the record if it does not exist); its placeholders are filled from
+    `condition_values`.
+    """
+    if LEGACY_LAYOUT:
+        copy_legacy_record(username, model_name)
+
+    names, expression_values, assignments = {}, {}, []
+    for k, (name, value) in enumerate({**(defaults or {}), **values}.items()):
+        names[f"#a{k}"] = name
+        expression_values[f":v{k}"] = value
+        if name in values:
+            assignments.append(f"#a{k} = :v{k}")
+        else:
+            assignments.append(f"#a{k} = if_not_exists(#a{k}, :v{k})")
+    assignments.append("#version = if_not_exists(#version, :zero) + :one")
+    names["#version"] = "version"
+    expression_values.update({":zero": 0, ":one": 1})
+
+    removals = []
+    for k, name in enumerate(remove or []):
+        names[f"#r{k}"] = name
+        removals.append(f"#r{k}")
+
+    conditions = [condition] if condition else []
+    if version is not None:
+        conditions.append("#version = :version")
+        expression_values[":version"] = version
+    expression_values.update(condition_values or {})
+
+    params = {
+        "Key": get_key(username, model_name),
+        "UpdateExpression": "SET "
+        + ", ".join(assignments)
+        + (" REMOVE " + ", ".join(removals) if removals else ""),
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": expression_values,
+        "ReturnValues": "ALL_NEW",
+    }
+    if conditions:
+        params["ConditionExpression"] = " AND ".join(
+            f"({condition})" for condition in conditions
+        )
+
+    try:
+        response = MODELS_TABLE.update_item(**params)
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException as err:
+        raise ConditionFailed(
+            f"Model '{model_name}' of '{username}' was not updated: {err}"
+        ) from err
+    return response["Attributes"]
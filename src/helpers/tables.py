@@ -0,0 +1,188 @@
+"""Reads and writes of the DynamoDB tables (Users, Creds, Models, Usages, Apis,
+Aggregates).
+
+Reads are key reads (`get_item`) or key-condition queries (`query`,
+`query_page`) with the attributes to return pushed down as a projection, never
+PartiQL built from request values. `query` follows `LastEvaluatedKey` and
+yields the items of every page; `query_page` returns one page and the key to
+resume from, which endpoints hand out as an opaque `next_token`
+(`encode_token`/`decode_token`). `batch_write` splits puts and deletes into
+batches of 25 and retries unprocessed items with backoff. `get_item` reads
+through a `Cache` when one is given.
+"""
+import os
+import json
+import base64
+import random
+from time import monotonic, sleep
+from typing import Iterable, Iterator
+import boto3
+
+_PREFIX = os.environ["prefix"]
+USERS = f"{_PREFIX}_Users"
+CREDS = f"{_PREFIX}_Creds"
+MODELS = f"{_PREFIX}_Models"
+USAGES = f"{_PREFIX}_Usages"
+APIS = f"{_PREFIX}_Apis"
+AGGREGATES = f"{_PREFIX}_Aggregates"
+
+_BATCH_WRITE_SIZE = 25  # max items per BatchWriteItem
+_MAX_ATTEMPTS = 8
+_BASE_DELAY = 0.05  # seconds
+_MAX_DELAY = 5  # seconds
+
+dynamodb = boto3.resource("dynamodb")
+_tables = {}
+
+
+class UnprocessedItems(Exception):
+    """Items of a batch write were still unprocessed after the last retry."""
+
+
+class Cache:
+    """Items read by `get_item`, kept for `ttl` seconds (`empty_ttl` for keys
+    without an item)."""
+
+    def __init__(self, ttl: float, empty_ttl: float | None = None):
+        self.ttl = ttl
+        self.empty_ttl = ttl if empty_ttl is None else empty_ttl
+        self.items: dict[str, tuple[float, dict]] = {}
+
+    def get(self, key: str) -> dict | None:
+        cached = self.items.get(key)
+        if cached and cached[0] > monotonic():
+            return cached[1]
+        return None
+
+    def put(self, key: str, item: dict):
+        ttl = self.ttl if item else self.empty_ttl
+        self.items[key] = (monotonic() + ttl, item)
+
+
+def table(table_name: str):
+    if table_name not in _tables:
+        _tables[table_name] = dynamodb.Table(table_name)
+    return _tables[table_name]
+
+
+def encode_token(last_evaluated_key: dict | None) -> str | None:
+    if not last_evaluated_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode()).decode()
+
+
+def decode_token(next_token: str) -> dict:
+    return json.loads(base64.urlsafe_b64decode(next_token.encode()))
+
+
+def projection(fields: list[str] | None) -> dict:
+    """ProjectionExpression of the fields (aliased: many attribute names, e.g.
+    "duration", are reserved words)."""
+    if not fields:
+        return {}
+    return {
+        "ProjectionExpression": ", ".join(f"#p{k}" for k in range(len(fields))),
+        "ExpressionAttributeNames": {f"#p{k}": x for k, x in enumerate(fields)},
+    }
+
+
+def get_item(
+    table_name: str,
+    key: dict,
+    fields: list[str] | None = None,
+    consistent: bool = False,
+    cache: Cache | None = None,
+) -> dict:
+    """Return the item ({} if there is none)."""
+    cache_key = json.dumps([table_name, key, fields], sort_keys=True)
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    response = table(table_name).get_item(
+        Key=key, ConsistentRead=consistent, **projection(fields)
+    )
+    item = response.get("Item") or {}
+    if cache:
+        cache.put(cache_key, item)
+    return item
+
+
+def query_page(
+    table_name: str,
+    key_condition: str,
+    values: dict,
+    fields: list[str] | None = None,
+    index_name: str | None = None,
+    ascending: bool = True,
+    limit: int | None = None,
+    exclusive_start_key: dict | None = None,
+) -> tuple[list[dict], dict | None]:
+    """Return a page of the items matching the key condition and the key to
+    resume from (None on the last page)."""
+    params = {
+        "KeyConditionExpression": key_condition,
+        "ExpressionAttributeValues": values,
+        "ScanIndexForward": ascending,
+        **projection(fields),
+    }
+    if index_name:
+        params["IndexName"] = index_name
+    if limit:
+        params["Limit"] = limit
+    if exclusive_start_key:
+        params["ExclusiveStartKey"] = exclusive_start_key
+
+    response = table(table_name).query(**params)
+    return response.get("Items", []), response.get("LastEvaluatedKey")
+
+
+def query(
+    table_name: str,
+    key_condition: str,
+    values: dict,
+    fields: list[str] | None = None,
+    index_name: str | None = None,
+    ascending: bool = True,
+) -> Iterator[dict]:
+    """Yield every item matching the key condition, page after page."""
+    exclusive_start_key = None
+    while True:
+        items, exclusive_start_key = query_page(
+            table_name,
+            key_condition,
+            values,
+            fields=fields,
+            index_name=index_name,
+            ascending=ascending,
+            exclusive_start_key=exclusive_start_key,
+        )
+        yield from items
+        if not exclusive_start_key:
+            return
+
+
+def batch_write(
+    table_name: str,
+    puts: Iterable[dict] = (),
+    deletes: Iterable[dict] = (),
+):
+    """Put the items and delete the keys, 25 per BatchWriteItem."""
+    requests = [{"PutRequest": {"Item": item}} for item in puts] + [
+        {"DeleteRequest": {"Key": key}} for key in deletes
+    ]
+    client = dynamodb.meta.client
+    for k in range(0, len(requests), _BATCH_WRITE_SIZE):
+        batch = requests[k : k + _BATCH_WRITE_SIZE]
+        for attempt in range(_MAX_ATTEMPTS):
+            response = client.batch_write_item(RequestItems={table_name: batch})
+            batch = response.get("UnprocessedItems", {}).get(table_name, [])
+            if not batch:
+                break
+            # full jitter
+            sleep(random.uniform(0, min(_MAX_DELAY, _BASE_DELAY * 2**attempt)))
+        else:
+            raise UnprocessedItems(
+                f"{len(batch)} items of {table_name} were not written"
+            )
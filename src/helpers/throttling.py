@@ -0,0 +1,207 @@
+"""Rate limiting and retries for AWS control-plane calls (API Gateway, ACM,
+Route 53).
+
+`client(service_name)` returns a boto3 client whose calls first take a token
+from the bucket of the operation, sized to the documented account quota, and
+retry throttling errors with jittered exponential backoff. Buckets are shared
+by every client of the execution environment. The quota itself is shared by
+every execution environment that can run at the same time: the stack sets
+their number (from the reserved concurrency of the callers) in the
+`throttling_share` environment variable, and each bucket gets that share of
+the quota. No call waits past the deadline set with `set_deadline(context)`:
+it raises `Throttled` instead, with the number of seconds after which to try
+again.
+
+Each call logs its throttles and wait time as CloudWatch embedded metrics
+(namespace "ControlPlane", dimensions Service and Operation).
+"""
+import os
+import json
+import random
+import threading
+from time import monotonic, sleep, time
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import boto3
+
+# requests per second and burst, per account and region (Route 53: per
+# account); operations not listed use the service's default
+RATE_LIMITS: dict[str, dict[str, tuple[float, int]]] = {
+    "apigateway": {
+        "default": (10, 40),
+        "CreateDeployment": (1 / 5, 1),
+        "CreateDomainName": (1 / 30, 1),
+        "CreateResource": (5, 5),
+        "CreateRestApi": (1 / 3, 1),
+        "DeleteDomainName": (1 / 30, 1),
+        "DeleteRestApi": (1 / 30, 1),
+        "GetResources": (5 / 2, 5),
+        "UpdateDomainName": (1 / 30, 1),
+    },
+    "acm": {
+        "default": (10, 10),
+        "RequestCertificate": (5, 5),
+        "ListCertificates": (8, 8),
+    },
+    "route53": {"default": (5, 5)},
+}
+THROTTLING_ERRORS = [
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "PriorRequestNotComplete",
+    "RequestLimitExceeded",
+]
+# retried the same way (botocore's own retries are turned off)
+TRANSIENT_ERRORS = ["InternalError", "InternalFailure", "ServiceUnavailable"]
+_BASE_DELAY = 0.5  # seconds
+_MAX_DELAY = 20  # seconds
+_MAX_ATTEMPTS = 8
+_DEADLINE_BUFFER = 5  # seconds left for the caller once a call gives up
+# execution environments sharing the quotas
+_SHARE = int(os.environ.get("throttling_share", "1"))
+
+
+class Throttled(Exception):
+    """The call is still throttled and waiting longer would pass the deadline."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+
+_buckets: dict[tuple[str, str], TokenBucket] = {}
+_buckets_lock = threading.Lock()
+_deadline: float | None = None  # monotonic time
+
+
+def set_deadline(context):
+    """Make calls give up (raise Throttled) rather than wait past the end of
+    the invocation."""
+    global _deadline
+    remaining = context.get_remaining_time_in_millis() / 1000
+    _deadline = monotonic() + remaining - _DEADLINE_BUFFER
+
+
+def get_bucket(service_name: str, operation: str) -> TokenBucket:
+    limits = RATE_LIMITS.get(service_name, {})
+    key = (service_name, operation if operation in limits else "default")
+    with _buckets_lock:
+        if key not in _buckets:
+            rate, burst = limits.get(key[1], (10, 10))
+            _buckets[key] = TokenBucket(rate / _SHARE, max(1, burst // _SHARE))
+        return _buckets[key]
+
+
+def wait(seconds: float, operation: str):
+    if _deadline is not None and monotonic() + seconds > _deadline:
+        raise Throttled(f"{operation} is throttled", retry_after=seconds)
+    sleep(seconds)
+
+
+def put_metrics(service_name: str, operation: str, throttles: int, wait_time: float):
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": "ControlPlane",
+                            "Dimensions": [["Service", "Operation"]],
+                            "Metrics": [
+                                {"Name": "Calls", "Unit": "Count"},
+                                {"Name": "Throttles", "Unit": "Count"},
+                                {"Name": "WaitTime", "Unit": "Milliseconds"},
+                            ],
+                        }
+                    ],
+                },
+                "Service": service_name,
+                "Operation": operation,
+                "Calls": 1,
+                "Throttles": throttles,
+                "WaitTime": round(wait_time * 1000),
+            }
+        )
+    )
+
+
+def call(service_name: str, operation: str, method, **kwargs):
+    bucket = get_bucket(service_name, operation)
+    throttles, wait_time = 0, 0.0
+    try:
+        for attempt in range(_MAX_ATTEMPTS):
+            delay = bucket.reserve()
+            if delay:
+                try:
+                    wait(delay, operation)
+                except Throttled:
+                    bucket.refund()  # the call is not made
+                    raise
+                wait_time += delay
+            try:
+                return method(**kwargs)
+            except ClientError as err:
+                code = err.response["Error"]["Code"]
+                if code not in THROTTLING_ERRORS + TRANSIENT_ERRORS:
+                    raise err
+                throttles += code in THROTTLING_ERRORS
+                if attempt == _MAX_ATTEMPTS - 1:
+                    raise Throttled(str(err), retry_after=_MAX_DELAY) from err
+                # full jitter
+                delay = random.uniform(0, min(_MAX_DELAY, _BASE_DELAY * 2**attempt))
+                wait(delay, operation)
+                wait_time += delay
+    finally:
+        put_metrics(service_name, operation, throttles, wait_time)
+
+
+class ThrottledClient:
+    """A boto3 client whose API calls go through `call`."""
+
+    def __init__(self, service_name: str, **kwargs):
+        # retries are made by `call`
+        config = Config(retries={"mode": "standard", "max_attempts": 1})
+        self._client = boto3.client(service_name, config=config, **kwargs)
+        self._service_name = service_name
+        self._operations = self._client.meta.method_to_api_mapping
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._client, name)
+        if name not in self._operations:
+            return attribute
+        operation = self._operations[name]
+
+        def method(**kwargs):
+            return call(self._service_name, operation, attribute, **kwargs)
+
+        return method
+
+
+def client(service_name: str, **kwargs) -> ThrottledClient:
+    return ThrottledClient(service_name, **kwargs)
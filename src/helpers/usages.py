@@ -0,0 +1,114 @@
+"""Key layout of the Usages table.
+
+The usage rows of a model live under `pk=<username>|<model_name>`. A model
+whose record has `usage_shards` = N > 1 spreads its writes over N partitions
+(shard s > 0 under `pk=<username>|<model_name>|<s>`), so that a busy model is
+not held to the throughput of one partition. Each request picks a shard at
+random. The shard count of a model is only ever raised (see
+`scripts/set_usage_shards.py`): reads cover every shard below it.
+
+The sort key, which is also the id of the log in the API, is the start time of
+the request followed by the shard and a random suffix,
+`<%Y-%m-%dT%H:%M:%S.%f>_<shard>_<suffix>`: concurrent requests of the same
+microsecond get different rows, and sort keys sort by time across shards. Rows
+written before sharding have the bare start time as sort key (shard 0).
+"""
+import heapq
+import random
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from helpers import tables
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+MAX_SHARDS = 32
+_SEPARATOR = "_"
+# sorts after every sort key of the same timestamp
+_AFTER = "~"
+
+
+def get_shard_count(model_info: dict) -> int:
+    return min(MAX_SHARDS, max(1, int(model_info.get("usage_shards") or 1)))
+
+
+def get_pk(username: str, model_name: str, shard: int = 0) -> str:
+    if shard:
+        return f"{username}|{model_name}|{shard}"
+    return f"{username}|{model_name}"
+
+
+def split_pk(pk: str) -> tuple[str, str]:
+    """Username and model name of a partition key of any shard."""
+    username, model_name = pk.split("|")[:2]
+    return username, model_name
+
+
+def new_key(username: str, model_name: str, start: datetime, shards: int) -> dict:
+    shard = random.randrange(shards)
+    sk = _SEPARATOR.join(
+        [start.strftime(TIMESTAMP_FORMAT), str(shard), secrets.token_hex(4)]
+    )
+    return {"pk": get_pk(username, model_name, shard), "sk": sk}
+
+
+def get_key(username: str, model_name: str, sk: str) -> dict:
+    """Key of the row whose sort key (log id) is `sk`."""
+    parts = sk.split(_SEPARATOR)
+    shard = int(parts[1]) if len(parts) == 3 else 0
+    return {"pk": get_pk(username, model_name, shard), "sk": sk}
+
+
+def get_timestamp(sk: str) -> str:
+    return sk.split(_SEPARATOR)[0]
+
+
+def get_bound(timestamp: str, ascending: bool, inclusive: bool) -> tuple[str, str]:
+    """Sort-key condition (operator, value) of the rows from `timestamp` on."""
+    if ascending:
+        return (">=", timestamp) if inclusive else (">", timestamp + _AFTER)
+    return ("<=", timestamp + _AFTER) if inclusive else ("<", timestamp)
+
+
+def query_page(
+    username: str,
+    model_name: str,
+    shards: int,
+    fields: list[str],
+    limit: int,
+    ascending: bool = True,
+    bound: tuple[str, str] | None = None,
+) -> tuple[list[dict], str | None]:
+    """Return a page of the usage rows of the model across its shards, in
+    sort-key order, and the sort key to continue after (None on the last
+    page): the first `limit` rows of each shard are read in parallel and
+    merged."""
+    fields = fields if "sk" in fields else ["sk", *fields]
+
+    def query_shard(shard: int) -> tuple[list[dict], dict | None]:
+        key_condition = "pk = :pk"
+        values = {":pk": get_pk(username, model_name, shard)}
+        if bound:
+            key_condition += f" AND sk {bound[0]} :bound"
+            values[":bound"] = bound[1]
+        return tables.query_page(
+            tables.USAGES,
+            key_condition,
+            values,
+            fields=fields,
+            ascending=ascending,
+            limit=limit,
+        )
+
+    with ThreadPoolExecutor(max_workers=shards) as executor:
+        pages = list(executor.map(query_shard, range(shards)))
+
+    merged = list(
+        heapq.merge(
+            *[items for items, _ in pages],
+            key=lambda item: item["sk"],
+            reverse=not ascending,
+        )
+    )
+    items = merged[:limit]
+    has_more = len(merged) > limit or any(lek for _, lek in pages)
+    return items, items[-1]["sk"] if has_more and items else None
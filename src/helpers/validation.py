@@ -5,10 +5,9 @@ import functools
 from hashlib import sha256
 import json
 
-from helpers import cors, dynamodb as ddb, secrets
+from helpers import cors, secrets, tables
 from helpers.logging import logger
 
-import boto3
 import jwt
 
 _ALGO = "HS256"
@@ -17,11 +16,8 @@ PREFIX = os.environ["prefix"]
 _REGION: str = os.environ["region_name"]
 _JWT_SECRET_NAME = os.environ["jwt_secret"]
 _SECRETS: dict[str, str] = secrets.get_secret(_JWT_SECRET_NAME, _REGION)
-_CREDS_TABLE_NAME = f"{PREFIX}_Creds"
 UTF_8 = "utf-8"
 
-dynamo = boto3.client("dynamodb")
-
 
 def create_api_token(username: str) -> Tuple[str, datetime]:
     exp = datetime.utcnow() + timedelta(days=1)
@@ -54,15 +50,14 @@ def validate_jwt(encoded_jwt: str) -> Tuple[bool, dict]:
 
 
 def get_creds_record(access_key: str) -> Tuple[bool, Dict[str, str]]:
+    creds = tables.table(tables.CREDS)
     try:
-        response = dynamo.get_item(
-            TableName=_CREDS_TABLE_NAME,
-            Key=ddb.to_({"pk": f"creds|{access_key}", "sk": "creds"}),
+        items = tables.get_item(
+            tables.CREDS, {"pk": f"creds|{access_key}", "sk": "creds"}
         )
-    except dynamo.exceptions.ResourceNotFoundException:
+    except creds.meta.client.exceptions.ResourceNotFoundException:
         return False, {}
 
-    items = ddb.from_(response.get("Item", {}))
     if not items:
         return False, {}
 
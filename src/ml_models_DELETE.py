@@ -1,81 +1,63 @@
 import os
 from datetime import datetime
 import json
-from helpers import cors, validation, dynamodb as ddb
+from uuid import uuid4 as uuid
+from helpers import api_keys, cors, tables, validation, registry
 from helpers.logging import logger
-from api_keys_list_GET import get_api_keys_info
 import boto3
 
 _PREFIX = os.environ["prefix"]
 _REGION_NAME = os.environ["region_name"]
-MODELS_S3_BUCKET = f"{_PREFIX}-models-{_REGION_NAME}"
-LOGS_S3_BUCKET = f"{_PREFIX}-logs-{_REGION_NAME}"
+_QUEUE = os.environ["queue"]  # cleanup jobs, consumed by delete_model
 
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
-dynamodb = boto3.resource("dynamodb")
-MODELS_TABLE_NAME = f"{_PREFIX}_Models"
-MODELS_TABLE = dynamodb.Table(MODELS_TABLE_NAME)
-
-# other boto3 clients
-apigw = boto3.client("apigateway")
-iam = boto3.client("iam")
-s3 = boto3.client("s3")
-
-
-def get_model(username: str, model_name: str) -> dict:
-    statement = f"SELECT * FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND sk='{model_name}';"
-    response = dynamodb_client.execute_statement(Statement=statement)
-    return ddb.from_(response.get("Items", [{}])[0])
+sqs = boto3.client("sqs")
 
 
 def delete_model(username: str, model_name: str) -> tuple[bool, str]:
+    """Soft delete the model record and return (success, deleted_at or error)."""
+    deleted_at = datetime.utcnow().isoformat()
     try:
-        record = get_model(username=username, model_name=model_name)
-    except Exception as err:
-        return (False, str(err))
-
-    record.update(
-        {
-            "is_deleted": True,
-            "deleted_at": datetime.utcnow().isoformat(),
-        }
-    )
-    logger.debug("new model record 1: %s", json.dumps(record, default=str))
-    try:
-        MODELS_TABLE.put_item(Item=record)
+        registry.update_model(
+            username=username,
+            model_name=model_name,
+            values={"is_deleted": True, "deleted_at": deleted_at},
+            remove=["model"],  # drops the model from the "models" index
+        )
     except Exception as err:
         logger.exception(err)
         return (False, str(err))
 
-    record = get_model(username=username, model_name=model_name)
-    logger.debug("new model record 2: %s", json.dumps(record, default=str))
-    return (True, "")
+    return (True, deleted_at)
 
 
 def delete_associated_api_keys(username: str, model_name: str) -> bool:
-    keys = get_api_keys_info(username=username, model_name=model_name)
+    keys = list(api_keys.query_all(username, model_name, fields=["pk", "sk"]))
     logger.debug("keys: %s", json.dumps(keys, default=str))
-    statement = f"DELETE FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND sk='{{hashed_key}}|{model_name}';"
-    statements = [
-        {"Statement": statement.format(hashed_key=item["hashed_key"])}
-        for item in keys["api-keys"]
-    ]
-
-    if not statements:
-        return True
-
-    response = dynamodb_client.batch_execute_statement(Statements=statements)
-    logger.debug("deletion response: %s", json.dumps(response, default=str))
-
-    errors = [x["Error"] for x in response["Responses"] if "Error" in x]
-    if errors:
-        logger.error("Deletion errors: %s", json.dumps(errors, default=str))
+    try:
+        tables.batch_write(tables.MODELS, deletes=keys)
+    except Exception as err:
+        logger.exception("Deletion error: %s", err)
         return False
 
     return True
 
 
+def schedule_cleanup(username: str, model_name: str, deleted_at: str):
+    # the usages, logs and files of the model are deleted in the background
+    _ = sqs.send_message(
+        QueueUrl=_QUEUE,
+        MessageGroupId=f"{username}|{model_name}",
+        MessageDeduplicationId=str(uuid()),
+        MessageBody=json.dumps(
+            {
+                "username": username,
+                "model_name": model_name,
+                "deleted_at": deleted_at,
+            }
+        ),
+    )
+
+
 @validation.check_authorization
 def handler(event: dict, context):
     username = event["username"]
@@ -100,15 +82,18 @@ def handler(event: dict, context):
         )
 
     # 2. delete model
-    success, error = delete_model(username, model_name)
+    success, deleted_at = delete_model(username, model_name)
     if not success:
-        logger.error(error)
+        logger.error(deleted_at)
         return cors.get_response(
             status_code=400,
             body={"error_message": f"Failed to delete model {model_name}"},
             methods="DELETE",
         )
 
+    # 3. delete its usages, logs and files
+    schedule_cleanup(username, model_name, deleted_at)
+
     return cors.get_response(
         status_code=200,
         body={"message": f"deleted model {model_name}"},
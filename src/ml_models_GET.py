@@ -1,24 +1,26 @@
 import os
-from helpers import cors, validation, dynamodb as ddb
-import boto3
+from helpers import cors, registry, validation
 
 _PREFIX = os.environ["prefix"]
 _REGION_NAME = os.environ["region_name"]
 MODELS_S3_BUCKET = f"{_PREFIX}-models-{_REGION_NAME}"
 
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
-dynamodb = boto3.resource("dynamodb")
-MODELS_TABLE_NAME = f"{_PREFIX}_Models"
-MODELS_TABLE = dynamodb.Table(MODELS_TABLE_NAME)
+_FIELDS = [
+    "library",
+    "filetype",
+    "created_at",
+    "updated_at",
+    # why the last upload of the file was rejected, if it was
+    "upload_error",
+    "preprocessing_upload_error",
+]
 
 
 def get_model_info(username: str, model_name: str) -> dict:
-    statement = f"SELECT sk, library, filetype, created_at, updated_at FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND sk='{model_name}';"
-    response = dynamodb_client.execute_statement(Statement=statement)
-    result = ddb.from_(response.get("Items", [{}])[0])
-
-    result["model_name"] = result.pop("sk")
+    """Return the model record ({} if there is none)."""
+    result = registry.get_model(username, model_name, fields=_FIELDS)
+    if result:
+        result["model_name"] = model_name
     return result
 
 
@@ -28,8 +30,16 @@ def handler(event: dict, context):
     path_params = event["path_params"]
     model_name = path_params["model_name"]
 
+    model_info = get_model_info(username=username, model_name=model_name)
+    if not model_info:
+        return cors.get_response(
+            status_code=404,
+            body={"error": f"Model '{model_name}' does not exist."},
+            methods="GET",
+        )
+
     return cors.get_response(
         status_code=200,
-        body=get_model_info(username=username, model_name=model_name),
+        body=model_info,
         methods="GET",
     )
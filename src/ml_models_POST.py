@@ -3,7 +3,7 @@ from uuid import uuid4 as uuid
 from datetime import datetime
 import string
 import json
-from helpers import cors, validation
+from helpers import checksums, cors, registry, validation
 from helpers.logging import logger
 import boto3
 from botocore.exceptions import ClientError
@@ -12,12 +12,9 @@ _PREFIX = os.environ["prefix"]
 _REGION_NAME = os.environ["region_name"]
 MODELS_S3_BUCKET = f"{_PREFIX}-models-{_REGION_NAME}"
 STAGING_S3_BUCKET = f"{_PREFIX}-staging-{_REGION_NAME}"
-MODELS_TABLE_NAME = f"{_PREFIX}_Models"
 
 apigw = boto3.client("apigateway")
 s3 = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
-MODELS_TABLE = dynamodb.Table(MODELS_TABLE_NAME)
 
 
 def upsert_ml_model_record(
@@ -30,24 +27,39 @@ def upsert_ml_model_record(
     has_preprocessing: bool = False,
     is_public: bool = False,
 ):
-    record = {
-        "pk": f"username|{username}",
-        "sk": model_name,
-        "library": lib_type,
-        "filetype": filetype,
-        "created_at": datetime.utcnow().isoformat(),
-        "updated_at": datetime.utcnow().isoformat(),
-        "deleted_at": None,
-        "preprocessing_deleted_at": None,
-        "is_uploaded": False,
-        "is_deleted": False,
-        "bucket": bucket,
-        "key": key,
-        "has_preprocessing": has_preprocessing,
-        "is_preprocessing_uploaded": False,
-        "is_public": is_public,
-    }
-    MODELS_TABLE.put_item(Item=record)
+    now = datetime.utcnow().isoformat()
+    registry.update_model(
+        username=username,
+        model_name=model_name,
+        values={
+            "model": model_name,  # sort key of the "models" index
+            "library": lib_type,
+            "filetype": filetype,
+            "created_at": now,
+            "updated_at": now,
+            "deleted_at": None,
+            "preprocessing_deleted_at": None,
+            "is_uploaded": False,
+            "is_deleted": False,
+            "bucket": bucket,
+            "key": key,
+            "has_preprocessing": has_preprocessing,
+            "is_preprocessing_uploaded": False,
+            "is_public": is_public,
+        },
+        # a new model: nothing of a previous file or cleanup carries over
+        remove=[
+            "sha256",
+            "regions",
+            "preprocessing_key",
+            "preprocessing_sha256",
+            "preprocessing_regions",
+            "upload_error",
+            "preprocessing_upload_error",
+            "cleanup",
+        ],
+        condition=None,
+    )
 
 
 # def get_api_id(username: str) -> str:
@@ -96,6 +108,9 @@ def validate_params(
     lib_type: str,
     filetype: str,
     model_name: str,
+    checksum: str | None,
+    has_preprocessing: bool,
+    preprocessing_checksum: str | None,
 ) -> list[str]:
     errors = []
 
@@ -129,6 +144,21 @@ def validate_params(
             f"Invalid (lib, filetype) pair: (lib, filetype) must be one of { MODEL_FILETYPES }"
         )
 
+    # validate checksums (optional base64 SHA-256 of the files, checked by S3
+    # on upload)
+    if checksum is not None and not checksums.is_sha256(checksum):
+        errors.append(
+            "Invalid param: 'checksum' must be the base64-encoded SHA-256 of the model file"
+        )
+    if (
+        has_preprocessing
+        and preprocessing_checksum is not None
+        and not checksums.is_sha256(preprocessing_checksum)
+    ):
+        errors.append(
+            "Invalid param: 'preprocessing_checksum' must be the base64-encoded SHA-256 of the preprocessing file"
+        )
+
     # validate model_name
     remaining = set(model_name).difference(
         set(string.ascii_letters + string.digits + "-_")
@@ -165,6 +195,9 @@ def handler(event: dict, context) -> dict:
         lib_type=lib_type,
         filetype=filetype,
         model_name=model_name,
+        checksum=params.get("checksum"),
+        has_preprocessing=has_preprocessing,
+        preprocessing_checksum=params.get("preprocessing_checksum"),
     )
 
     # return error message if errors
@@ -188,6 +221,7 @@ def handler(event: dict, context) -> dict:
     logger.debug("upserted record")
 
     # Create presigned post for the model
+    checksum_field = checksums.post_field(params.get("checksum"))
     model_response = create_presigned_post(
         bucket_name=STAGING_S3_BUCKET,
         object_name=str(uuid()),
@@ -198,6 +232,7 @@ def handler(event: dict, context) -> dict:
             "x-amz-meta-filetype": filetype,
             "x-amz-meta-mop": "model",  # "MOP" stands for "model or preprocessing"
             "Content-Type": f"model/{filetype}",
+            **checksum_field,
         },
         conditions=[
             {"x-amz-meta-username": username},
@@ -206,6 +241,7 @@ def handler(event: dict, context) -> dict:
             {"x-amz-meta-filetype": filetype},
             {"x-amz-meta-mop": "model"},
             {"Content-Type": f"model/{filetype}"},
+            *([checksum_field] if checksum_field else []),
         ],
     )
     logger.debug("Model response: %s", json.dumps(model_response))
@@ -213,6 +249,7 @@ def handler(event: dict, context) -> dict:
     preprocessing_response = {}
     if has_preprocessing:
         # Create presigned post for preprocessing function
+        checksum_field = checksums.post_field(params.get("preprocessing_checksum"))
         preprocessing_response = create_presigned_post(
             bucket_name=STAGING_S3_BUCKET,
             object_name=str(uuid()),
@@ -221,12 +258,14 @@ def handler(event: dict, context) -> dict:
                 "x-amz-meta-model_name": model_name,
                 "x-amz-meta-mop": "preprocessing",
                 "Content-Type": "preprocessing",
+                **checksum_field,
             },
             conditions=[
                 {"x-amz-meta-username": username},
                 {"x-amz-meta-model_name": model_name},
                 {"x-amz-meta-mop": "preprocessing"},
                 {"Content-Type": "preprocessing"},
+                *([checksum_field] if checksum_field else []),
             ],
         )
     logger.debug("Preprocessing response: %s", json.dumps(preprocessing_response))
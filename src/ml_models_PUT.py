@@ -3,7 +3,7 @@ from uuid import uuid4 as uuid
 from datetime import datetime
 import string
 import json
-from helpers import cors, validation, dynamodb as ddb
+from helpers import checksums, cors, validation, registry
 from helpers.logging import logger
 import boto3
 from botocore.exceptions import ClientError
@@ -12,94 +12,79 @@ _PREFIX = os.environ["prefix"]
 _REGION_NAME = os.environ["region_name"]
 MODELS_S3_BUCKET = f"{_PREFIX}-models-{_REGION_NAME}"
 STAGING_S3_BUCKET = f"{_PREFIX}-staging-{_REGION_NAME}"
-MODELS_TABLE_NAME = f"{_PREFIX}_Models"
 
 apigw = boto3.client("apigateway")
 s3 = boto3.client("s3")
-dynamodb_client = boto3.client("dynamodb")
-dynamodb = boto3.resource("dynamodb")
-MODELS_TABLE = dynamodb.Table(MODELS_TABLE_NAME)
 
 
-def get_model_info(username: str, model_name: str) -> dict:
-    statement = f"SELECT * FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND sk='{model_name}';"
-    response = dynamodb_client.execute_statement(Statement=statement)
-    return ddb.from_(response["Items"][0])
-
-
-def insert_ml_model_record(
+def upsert_ml_model_record(
     username: str,
     model_name: str,
     lib_type: str,
     filetype: str,
-    bucket: str,
-    key: str,
+    bucket: str | None,
+    key: str | None,
     has_preprocessing: bool = False,
     is_public: bool = False,
 ):
-    record = {
-        "pk": f"username|{username}",
-        "sk": model_name,
+    now = datetime.utcnow().isoformat()
+    values = {
+        # sort key of the "models" index, which only holds live models
+        "model": model_name,
         "library": lib_type,
         "filetype": filetype,
-        "created_at": datetime.utcnow().isoformat(),
-        "updated_at": datetime.utcnow().isoformat(),
+        "updated_at": now,
         "deleted_at": None,
-        "preprocessing_deleted_at": None,
-        "is_uploaded": False,
         "is_deleted": False,
-        "bucket": bucket,
-        "key": key,
+        "preprocessing_deleted_at": None,
         "has_preprocessing": has_preprocessing,
         "is_preprocessing_uploaded": False,
         "is_public": is_public,
     }
-    MODELS_TABLE.put_item(Item=record)
-
-
-def upsert_ml_model_record(
-    username: str,
-    model_name: str,
-    lib_type: str,
-    filetype: str,
-    bucket: str,
-    key: str,
-    has_preprocessing: bool = False,
-    is_public: bool = False,
-):
     try:
-        record = get_model_info(username=username, model_name=model_name)
-    except:
-        insert_ml_model_record(
+        # a live (or new) model keeps pointing at its current file until a new
+        # one is uploaded: the file attributes are only set on a new record
+        registry.update_model(
             username=username,
             model_name=model_name,
-            lib_type=lib_type,
-            filetype=filetype,
-            bucket=None,
-            key=None,
-            has_preprocessing=has_preprocessing,
-            is_public=is_public,
+            values=values,
+            defaults={
+                "created_at": now,
+                "is_uploaded": False,
+                "bucket": bucket,
+                "key": key,
+            },
+            # a new file is expected: earlier rejections no longer apply
+            remove=["upload_error", "preprocessing_upload_error"],
+            condition="NOT is_deleted = :is_deleted",
+            condition_values={":is_deleted": True},
         )
-    else:
-        record.update(
-            {
-                "pk": f"username|{username}",
-                "sk": model_name,
-                "library": lib_type,
-                "filetype": filetype,
-                "updated_at": datetime.utcnow().isoformat(),
-                "deleted_at": None,
-                "is_deleted": False,
-                "preprocessing_deleted_at": None,
-                "is_uploaded": True,
+    except registry.ConditionFailed:
+        # a deleted model is created again: its file may have been deleted
+        # since (delete_model, artifacts_gc), so nothing of it carries over,
+        # as with ml_models_POST
+        registry.update_model(
+            username=username,
+            model_name=model_name,
+            values={
+                **values,
+                "created_at": now,
+                "is_uploaded": False,
                 "bucket": bucket,
                 "key": key,
-                "has_preprocessing": has_preprocessing,
-                "is_preprocessing_uploaded": False,
-                "is_public": is_public,
-            }
+            },
+            remove=[
+                "sha256",
+                "regions",
+                "preprocessing_key",
+                "preprocessing_sha256",
+                "preprocessing_regions",
+                "upload_error",
+                "preprocessing_upload_error",
+                "cleanup",
+            ],
+            condition=None,
         )
-        MODELS_TABLE.put_item(Item=record)
 
 
 # def get_api_id(username: str) -> str:
@@ -148,6 +133,9 @@ def validate_params(
     lib_type: str,
     filetype: str,
     model_name: str,
+    checksum: str | None,
+    has_preprocessing: bool,
+    preprocessing_checksum: str | None,
 ) -> list[str]:
     errors = []
 
@@ -181,6 +169,21 @@ def validate_params(
             f"Invalid (lib, filetype) pair: (lib, filetype) must be one of { MODEL_FILETYPES }"
         )
 
+    # validate checksums (optional base64 SHA-256 of the files, checked by S3
+    # on upload)
+    if checksum is not None and not checksums.is_sha256(checksum):
+        errors.append(
+            "Invalid param: 'checksum' must be the base64-encoded SHA-256 of the model file"
+        )
+    if (
+        has_preprocessing
+        and preprocessing_checksum is not None
+        and not checksums.is_sha256(preprocessing_checksum)
+    ):
+        errors.append(
+            "Invalid param: 'preprocessing_checksum' must be the base64-encoded SHA-256 of the preprocessing file"
+        )
+
     # validate model_name
     remaining = set(model_name).difference(
         set(string.ascii_letters + string.digits + "-_")
@@ -217,6 +220,9 @@ def handler(event: dict, context) -> dict:
         lib_type=lib_type,
         filetype=filetype,
         model_name=model_name,
+        checksum=params.get("checksum"),
+        has_preprocessing=has_preprocessing,
+        preprocessing_checksum=params.get("preprocessing_checksum"),
     )
 
     # return error message if errors
@@ -240,6 +246,7 @@ def handler(event: dict, context) -> dict:
     logger.debug("upserted record")
 
     # Create presigned post for the model
+    checksum_field = checksums.post_field(params.get("checksum"))
     model_response = create_presigned_post(
         bucket_name=STAGING_S3_BUCKET,
         object_name=str(uuid()),
@@ -250,6 +257,7 @@ def handler(event: dict, context) -> dict:
             "x-amz-meta-filetype": filetype,
             "x-amz-meta-mop": "model",  # "MOP" stands for "model or preprocessing"
             "Content-Type": f"model/{filetype}",
+            **checksum_field,
         },
         conditions=[
             {"x-amz-meta-username": username},
@@ -258,6 +266,7 @@ def handler(event: dict, context) -> dict:
             {"x-amz-meta-filetype": filetype},
             {"x-amz-meta-mop": "model"},
             {"Content-Type": f"model/{filetype}"},
+            *([checksum_field] if checksum_field else []),
         ],
     )
     logger.debug("Model response: %s", json.dumps(model_response))
@@ -265,6 +274,7 @@ def handler(event: dict, context) -> dict:
     preprocessing_response = {}
     if has_preprocessing:
         # Create presigned post for preprocessing function
+        checksum_field = checksums.post_field(params.get("preprocessing_checksum"))
         preprocessing_response = create_presigned_post(
             bucket_name=STAGING_S3_BUCKET,
             object_name=str(uuid()),
@@ -273,12 +283,14 @@ def handler(event: dict, context) -> dict:
                 "x-amz-meta-model_name": model_name,
                 "x-amz-meta-mop": "preprocessing",
                 "Content-Type": "preprocessing",
+                **checksum_field,
             },
             conditions=[
                 {"x-amz-meta-username": username},
                 {"x-amz-meta-model_name": model_name},
                 {"x-amz-meta-mop": "preprocessing"},
                 {"Content-Type": "preprocessing"},
+                *([checksum_field] if checksum_field else []),
             ],
         )
     logger.debug("Preprocessing response: %s", json.dumps(preprocessing_response))
@@ -1,46 +1,77 @@
-from typing import Any
-import os
 import json
-from helpers import cors, validation, dynamodb as ddb
+from helpers import cors, tables, validation
 from helpers.logging import logger
-import boto3
 
-_PREFIX = os.environ["prefix"]
-MODELS_TABLE_NAME = f"{_PREFIX}_Models"
+# sparse index: only rows of models that are not deleted have its sort key
+MODELS_INDEX_NAME = "models"
 
-
-# boto3
-dynamodb = boto3.client("dynamodb")
-
-
-def pop(x: dict, key: str, default: bool) -> bool:
-    try:
-        val = x.pop(key)
-        logger.debug(
-            "is_deleted: %s", json.dumps({"val": val, "type": type(val)}, default=str)
-        )
-        return val
-    except KeyError:
-        return default
+_FIELDS = ["model", "library", "filetype", "created_at", "updated_at", "is_public"]
+_DEFAULT_LIMIT = 10  # page size when only next-token is given
 
 
 # model_name, model_type, persistence_type, updated_at
-def get_models(username: str) -> list[dict]:
-    statement = f"SELECT sk, library, filetype, created_at, updated_at, is_deleted, is_public FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND library IS NOT MISSING;"
-    response = dynamodb.execute_statement(Statement=statement)
-    results = [ddb.from_(x) for x in response.get("Items", [])]
+def get_models(username: str, limit: int | None, next_token: str | None) -> dict:
+    """Return a page of the user's models, or all of them without `limit`."""
+    if limit is None:
+        results = list(
+            tables.query(
+                tables.MODELS,
+                "pk = :pk",
+                {":pk": f"username|{username}"},
+                fields=_FIELDS,
+                index_name=MODELS_INDEX_NAME,
+            )
+        )
+        last_evaluated_key = None
+    else:
+        results, last_evaluated_key = tables.query_page(
+            tables.MODELS,
+            "pk = :pk",
+            {":pk": f"username|{username}"},
+            fields=_FIELDS,
+            index_name=MODELS_INDEX_NAME,
+            limit=limit,
+            exclusive_start_key=tables.decode_token(next_token) if next_token else None,
+        )
     logger.debug("ml-models: %s", json.dumps(results, default=str))
     for result in results:
-        result["model_name"] = result.pop("sk")
-    return [result for result in results if not pop(result, "is_deleted", False)]
+        result["model_name"] = result.pop("model")
+
+    return {
+        "models": results,
+        "next_token": tables.encode_token(last_evaluated_key),
+    }
 
 
 @validation.check_authorization
 def handler(event: dict, context):
+    params = event["params"]
+
+    # get next token
+    next_token = params.get("next-token")
+
+    # get limit (without limit nor next-token, every model is returned)
+    if params.get("limit") is None and not next_token:
+        limit = None
+    else:
+        try:
+            val = int(params.get("limit"))
+            limit = val if val < 100 and val > 0 else _DEFAULT_LIMIT
+        except:
+            limit = _DEFAULT_LIMIT
+
     try:
-        results = get_models(event["username"])
+        models = get_models(event["username"], limit=limit, next_token=next_token)
     except Exception as err:
         logger.exception(err)
-        results = []
+        return cors.get_response(
+            status_code=400 if next_token else 500,
+            body={
+                "error": "Invalid next-token."
+                if next_token
+                else "Unable to list models."
+            },
+            methods="GET",
+        )
 
-    return cors.get_response(status_code=200, body={"models": results}, methods="GET")
+    return cors.get_response(status_code=200, body=models, methods="GET")
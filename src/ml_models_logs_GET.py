@@ -1,17 +1,16 @@
 import os
 from datetime import datetime
 import json
-from helpers import cors, validation, dynamodb as ddb
+from helpers import cors, tables, usages, validation
 from helpers.logging import logger
 import boto3
 
 _PREFIX = os.environ["prefix"]
 _REGION = os.environ["region_name"]
-USAGES_TABLE_NAME = f"{_PREFIX}_Usages"
 LOGS_BUCKET_NAME = f"{_PREFIX}-logs-{_REGION}"
 
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
+_FIELDS = ["status_code", "location", "duration", "input", "output", "error"]
+
 s3 = boto3.client("s3")
 
 
@@ -29,27 +28,19 @@ def get_link(object_name: str, expiration: int = 60) -> str:
 def get_log_info(
     username: str,
     model_name: str,
-    timestamp: str | None,
+    log_id: str,
 ) -> tuple[bool, dict]:
-    statement = " ".join(
-        [
-            'SELECT "status_code", "location", "duration", "input", "output", "error"',
-            f"FROM {USAGES_TABLE_NAME}",
-            f"WHERE pk='{username}|{model_name}'",
-            f"AND sk='{timestamp}'",
-        ]
+    item = tables.get_item(
+        tables.USAGES,
+        usages.get_key(username, model_name, log_id),
+        fields=_FIELDS,
     )
-    logger.debug("statement: %s", statement)
-    response = dynamodb_client.execute_statement(Statement=statement, Limit=1)
-    items = [ddb.from_(x) for x in (response.get("Items") or [{}])]
-    if len(items) == 1:
-        item = items[0]
-    else:
-        logger.error("items: ", items)
+    if not item:
+        logger.info("No log %s of %s|%s", log_id, username, model_name)
         return False, {
             "status_code": 404,
             "method": "GET",
-            "body": {"error": "No logs for the provided timestamp was found."},
+            "body": {"error": "No log with the provided id was found."},
         }
 
     try:
@@ -92,11 +83,14 @@ def handler(event: dict, context):
     # get params
     username = event["username"]
     model_name = event["path_params"]["model_name"]
-    ts = event["path_params"]["log_timestamp"]
+    # the log id (sort key), named log_timestamp in the route; ids of logs
+    # written before sharding are the bare timestamp
+    log_id = event["path_params"]["log_timestamp"]
 
-    # validate timestamp
+    # validate log id
     try:
-        timestamp = ts if datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%f") else None
+        datetime.strptime(usages.get_timestamp(log_id), usages.TIMESTAMP_FORMAT)
+        _ = usages.get_key(username, model_name, log_id)
     except:
         return cors.get_response(
             status_code=404,
@@ -108,7 +102,7 @@ def handler(event: dict, context):
     succcess, log_info = get_log_info(
         username=username,
         model_name=model_name,
-        timestamp=timestamp,
+        log_id=log_id,
     )
     if not succcess:
         return cors.get_response(**log_info)
@@ -1,15 +1,9 @@
-import os
 from datetime import datetime
 import json
-from helpers import cors, validation, dynamodb as ddb
+from helpers import cors, registry, tables, usages, validation
 from helpers.logging import logger
-import boto3
 
-_PREFIX = os.environ["prefix"]
-USAGES_TABLE_NAME = f"{_PREFIX}_Usages"
-
-# dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
+_FIELDS = ["sk", "status_code", "duration", "input", "output", "error"]
 
 
 def get_logs_info(
@@ -21,40 +15,30 @@ def get_logs_info(
     next_token: str | None,
     inclusive: bool,
 ) -> dict:
-    fields = ["sk", "status_code", "duration", "input", "output", "error"]
-    field_string = ", ".join([f'"{x}"' for x in fields])  # wrap fields in double quotes
-    sort_clause = ""
-    if asc and start_from:
-        sort_clause = (
-            f"AND sk >= '{start_from}'" if inclusive else f"AND sk > '{start_from}'"
-        )
-    elif (not asc) and start_from:
-        sort_clause = (
-            f"AND sk <= '{start_from}'" if inclusive else f"AND sk < '{start_from}'"
-        )
-    statement = " ".join(
-        [
-            f"SELECT {field_string}",
-            f"FROM {USAGES_TABLE_NAME}",
-            f"WHERE pk='{username}|{model_name}'",
-            sort_clause,
-            f"ORDER BY sk {'ASC' if asc else 'DESC'};",
-        ]
-    )
-    logger.debug("statement: %s", statement)
+    model_info = registry.get_model(username, model_name, fields=["usage_shards"])
+    # continue after the last log of the previous page
+    bound = None
     if next_token:
-        response = dynamodb_client.execute_statement(
-            Statement=statement, NextToken=next_token
-        )
-    else:
-        response = dynamodb_client.execute_statement(Statement=statement, Limit=limit)
-    logger.debug("response: %s", json.dumps(response, default=str))
+        bound = (">" if asc else "<", tables.decode_token(next_token)["sk"])
+    elif start_from:
+        bound = usages.get_bound(start_from, ascending=asc, inclusive=inclusive)
+
+    results, last_sk = usages.query_page(
+        username=username,
+        model_name=model_name,
+        shards=usages.get_shard_count(model_info),
+        fields=_FIELDS,
+        limit=limit,
+        ascending=asc,
+        bound=bound,
+    )
+    logger.debug("results: %s", json.dumps(results, default=str))
 
     # parse results
-    results = [ddb.from_(x) for x in response.get("Items", [])]
     keys = [
         {
-            "timestamp": result["sk"],
+            "log_id": result["sk"],
+            "timestamp": usages.get_timestamp(result["sk"]),
             "status_code": int(result["status_code"]),
             "duration": int(result["duration"]),
             "input": result["input"],
@@ -64,10 +48,8 @@ def get_logs_info(
         for result in results
     ]
 
-    # get next token if present
-    next = response["NextToken"] if "NextToken" in response else None
-
-    return {"logs": keys, "next_token": next}
+    next_token = tables.encode_token({"sk": last_sk}) if last_sk else None
+    return {"logs": keys, "next_token": next_token}
 
 
 @validation.check_authorization
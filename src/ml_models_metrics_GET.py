@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+import json
+from helpers import aggregates, cors, registry, validation
+from helpers.logging import logger
+
+_DEFAULT_GRANULARITY = "hour"
+# range returned when `from` is not given
+_DEFAULT_RANGES = {
+    "minute": timedelta(hours=1),
+    "hour": timedelta(days=1),
+    "day": timedelta(days=30),
+}
+_MAX_PERIODS = 1500
+_PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+
+def parse_time(value: str) -> datetime:
+    # ISO 8601, e.g. 2024-01-31, 2024-01-31T10:00, 2024-01-31T10:00:00Z or
+    # 2024-01-31T12:00:00+02:00; returned as a naive UTC time
+    time = datetime.fromisoformat(value.removesuffix("Z"))
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return time
+
+
+def summarize(rollup: dict) -> dict:
+    requests = rollup["requests"]
+    latency = {
+        "mean": rollup["duration_sum"] / requests if requests else None,
+        **{
+            name: aggregates.get_percentile(rollup["histogram"], q)
+            for name, q in _PERCENTILES.items()
+        },
+    }
+    return {
+        "count": requests,
+        "errors": rollup["errors"],
+        "status_codes": rollup["status_codes"],
+        "latency_ms": {
+            name: round(value, 1) if value is not None else None
+            for name, value in latency.items()
+        },
+    }
+
+
+def get_metrics(
+    username: str, model_name: str, granularity: str, start: datetime, end: datetime
+) -> dict:
+    rollups = aggregates.get_rollups(
+        username, model_name, granularity, start.isoformat(), end.isoformat()
+    )
+    return {
+        "model_name": model_name,
+        "granularity": granularity,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "metrics": [
+            {"period": rollup["period"], **summarize(rollup)} for rollup in rollups
+        ],
+        "total": summarize(aggregates.merge(rollups)),
+    }
+
+
+def get_error_response(status_code: int, message: str) -> dict:
+    return cors.get_response(
+        status_code=status_code,
+        body={"error": message},
+        methods="GET",
+    )
+
+
+@validation.check_authorization
+def handler(event: dict, context):
+    params = event["params"]
+    username = event["username"]
+    model_name = event["path_params"]["model_name"]
+
+    # get granularity (default to hour)
+    granularity = (params.get("granularity") or _DEFAULT_GRANULARITY).lower()
+    if granularity not in aggregates.GRANULARITIES:
+        return get_error_response(
+            400, f"granularity must be one of {', '.join(aggregates.GRANULARITIES)}."
+        )
+
+    # get range (default to the last hour, day or 30 days up to now)
+    try:
+        end = parse_time(params["to"]) if params.get("to") else datetime.utcnow()
+        start = (
+            parse_time(params["from"])
+            if params.get("from")
+            else end - _DEFAULT_RANGES[granularity]
+        )
+    except ValueError:
+        return get_error_response(400, "from and to must be ISO 8601 times.")
+    if start > end:
+        return get_error_response(400, "from must not be after to.")
+    if end - start > aggregates.GRANULARITIES[granularity].step * _MAX_PERIODS:
+        return get_error_response(
+            400, f"At most {_MAX_PERIODS} {granularity}s can be requested at once."
+        )
+
+    model = registry.get_model(
+        username, model_name, fields=["created_at", "is_deleted"]
+    )
+    if not model or model.get("is_deleted"):
+        return get_error_response(404, f"Model '{model_name}' does not exist.")
+
+    metrics = get_metrics(username, model_name, granularity, start, end)
+    logger.debug("metrics: %s", json.dumps(metrics, default=str))
+
+    return cors.get_response(
+        status_code=200,
+        body=metrics,
+        methods="GET",
+    )
@@ -0,0 +1,31 @@
+from helpers import cors, validation
+from ml_models_uploads_POST import STAGING_S3_BUCKET, s3
+
+
+@validation.check_authorization
+def handler(event: dict, context) -> dict:
+    username = event["username"]
+    model_name = event["path_params"]["model_name"]
+    upload_id = event["path_params"]["upload_id"]
+    key = event["query_params"].get("key") or ""
+    if not key.startswith(f"{username}/{model_name}/"):
+        return cors.get_response(
+            status_code=404,
+            body={"error": "The upload you requested does not exist."},
+            methods="DELETE",
+        )
+
+    try:
+        s3.abort_multipart_upload(Bucket=STAGING_S3_BUCKET, Key=key, UploadId=upload_id)
+    except s3.exceptions.NoSuchUpload:
+        return cors.get_response(
+            status_code=404,
+            body={"error": "The upload you requested does not exist."},
+            methods="DELETE",
+        )
+
+    return cors.get_response(
+        status_code=200,
+        body={"message": f"Aborted upload {upload_id}"},
+        methods="DELETE",
+    )
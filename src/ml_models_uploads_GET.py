@@ -0,0 +1,81 @@
+import json
+from helpers import cors, validation
+from helpers.logging import logger
+from ml_models_uploads_POST import (
+    STAGING_S3_BUCKET,
+    EXPIRATION,
+    get_part_urls,
+    parse_checksums,
+    s3,
+)
+
+
+def list_parts(key: str, upload_id: str) -> list[dict]:
+    parts = []
+    paginator = s3.get_paginator("list_parts")
+    for page in paginator.paginate(
+        Bucket=STAGING_S3_BUCKET, Key=key, UploadId=upload_id
+    ):
+        parts += [
+            {
+                "part_number": part["PartNumber"],
+                "etag": part["ETag"],
+                "checksum": part.get("ChecksumSHA256"),
+            }
+            for part in page.get("Parts", [])
+        ]
+    return parts
+
+
+@validation.check_authorization
+def handler(event: dict, context) -> dict:
+    """Return the parts uploaded so far and fresh URLs for the missing parts
+    (of the parts whose `checksums` are given), to resume an interrupted
+    upload."""
+    username = event["username"]
+    model_name = event["path_params"]["model_name"]
+    upload_id = event["path_params"]["upload_id"]
+    key = event["query_params"].get("key") or ""
+    if not key.startswith(f"{username}/{model_name}/"):
+        return cors.get_response(
+            status_code=404,
+            body={"error": "The upload you requested does not exist."},
+            methods="GET",
+        )
+
+    part_checksums = parse_checksums(event["params"].get("checksums") or [])
+    if part_checksums is None:
+        return cors.get_response(
+            status_code=400,
+            body={
+                "error": "'checksums' must list the base64-encoded SHA-256 of each part, in order."
+            },
+            methods="GET",
+        )
+
+    try:
+        parts = list_parts(key=key, upload_id=upload_id)
+    except s3.exceptions.NoSuchUpload:
+        return cors.get_response(
+            status_code=404,
+            body={"error": "The upload you requested does not exist."},
+            methods="GET",
+        )
+    logger.debug("parts: %s", json.dumps(parts))
+
+    uploaded = {part["part_number"] for part in parts}
+    missing = {
+        n: checksum for n, checksum in enumerate(part_checksums, 1) if n not in uploaded
+    }
+
+    return cors.get_response(
+        status_code=200,
+        body={
+            "upload_id": upload_id,
+            "key": key,
+            "uploaded": parts,
+            "parts": get_part_urls(key=key, upload_id=upload_id, parts=missing),
+            "expires_in": EXPIRATION,
+        },
+        methods="GET",
+    )
@@ -0,0 +1,5 @@
+from helpers import cors
+
+
+def handler(event: dict, context) -> dict:
+    return cors.get_response(status_code=204, methods="POST")
@@ -0,0 +1,169 @@
+import os
+import math
+import json
+from uuid import uuid4 as uuid
+from helpers import checksums, cors, registry, validation
+from helpers.logging import logger
+import boto3
+
+_PREFIX = os.environ["prefix"]
+_REGION_NAME = os.environ["region_name"]
+STAGING_S3_BUCKET = f"{_PREFIX}-staging-{_REGION_NAME}"
+
+s3 = boto3.client("s3")
+
+MIN_PART_SIZE = 5 * 1024**2  # S3 minimum for every part but the last
+DEFAULT_PART_SIZE = 64 * 1024**2
+MAX_PARTS = 10_000
+EXPIRATION = 3600  # seconds
+
+
+def get_part_urls(key: str, upload_id: str, parts: dict[int, str]) -> list[dict]:
+    """Presigned URLs of the parts ({part number: checksum}); each URL only
+    accepts the content matching the checksum."""
+    return [
+        {
+            "part_number": part_number,
+            "url": s3.generate_presigned_url(
+                "upload_part",
+                Params={
+                    "Bucket": STAGING_S3_BUCKET,
+                    "Key": key,
+                    "UploadId": upload_id,
+                    "PartNumber": part_number,
+                    "ChecksumSHA256": checksum,
+                },
+                ExpiresIn=EXPIRATION,
+            ),
+        }
+        for part_number, checksum in parts.items()
+    ]
+
+
+def parse_checksums(value) -> list[str] | None:
+    """The checksums of the parts, in order: a JSON list in the body or a
+    comma-separated query parameter (None if invalid)."""
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list) or not all(map(checksums.is_sha256, value)):
+        return None
+    return value
+
+
+def validate_params(params: dict) -> tuple[list[str], dict]:
+    errors = []
+
+    mop = params.get("mop") or "model"  # "MOP" stands for "model or preprocessing"
+    if mop not in ("model", "preprocessing"):
+        errors.append(
+            "Invalid value for param 'mop': must be 'model' or 'preprocessing'"
+        )
+
+    try:
+        size = int(params.get("size") or 0)
+        part_size = int(params.get("part_size") or DEFAULT_PART_SIZE)
+    except ValueError:
+        return ["Params 'size' and 'part_size' must be integers (bytes)"], {}
+    if size <= 0:
+        errors.append("Missing param: 'size' must be the size of the file in bytes")
+    if part_size < MIN_PART_SIZE:
+        errors.append(
+            f"Invalid value for param 'part_size': minimum is {MIN_PART_SIZE}"
+        )
+    elif math.ceil(size / part_size) > MAX_PARTS:
+        errors.append(
+            f"Invalid value for param 'part_size': a file of {size} bytes needs "
+            f"parts of at least {math.ceil(size / MAX_PARTS)} bytes"
+        )
+
+    # base64 SHA-256 of each part, checked by S3 when the part is uploaded
+    part_checksums = parse_checksums(params.get("checksums"))
+    if part_checksums is None or (
+        size > 0
+        and part_size >= MIN_PART_SIZE
+        and len(part_checksums) != math.ceil(size / part_size)
+    ):
+        errors.append(
+            "Missing or invalid param: 'checksums' must list the base64-encoded SHA-256 of each part, in order"
+        )
+
+    return errors, {
+        "mop": mop,
+        "size": size,
+        "part_size": part_size,
+        "checksums": part_checksums,
+    }
+
+
+@validation.check_authorization
+def handler(event: dict, context) -> dict:
+    username = event["username"]
+    model_name = event["path_params"]["model_name"]
+
+    errors, params = validate_params(event["params"])
+    if errors:
+        logger.warning("Error response: %s", json.dumps(errors, default=str))
+        return cors.get_response(
+            status_code=400, body={"errors": errors}, methods="POST"
+        )
+
+    # the model is created (and its lib/filetype set) with PUT /ml-models/{model_name}
+    model = registry.get_model(username=username, model_name=model_name)
+    if not model or model.get("is_deleted"):
+        return cors.get_response(
+            status_code=404,
+            body={"error": f"Model '{model_name}' does not exist."},
+            methods="POST",
+        )
+    if params["mop"] == "preprocessing" and not model.get("has_preprocessing"):
+        return cors.get_response(
+            status_code=400,
+            body={"error": f"Model '{model_name}' has no preprocessing function."},
+            methods="POST",
+        )
+
+    # same metadata as the presigned POST of ml_models_PUT (read by s3_staging_trigger)
+    if params["mop"] == "model":
+        metadata = {
+            "username": username,
+            "model_name": model_name,
+            "lib": model["library"],
+            "filetype": model["filetype"],
+            "mop": "model",
+        }
+        content_type = f"model/{model['filetype']}"
+    else:
+        metadata = {
+            "username": username,
+            "model_name": model_name,
+            "mop": "preprocessing",
+        }
+        content_type = "preprocessing"
+
+    key = f"{username}/{model_name}/{uuid()}"
+    upload = s3.create_multipart_upload(
+        Bucket=STAGING_S3_BUCKET,
+        Key=key,
+        Metadata=metadata,
+        ContentType=content_type,
+        ChecksumAlgorithm="SHA256",
+    )
+    parts = get_part_urls(
+        key=key,
+        upload_id=upload["UploadId"],
+        parts=dict(enumerate(params["checksums"], 1)),
+    )
+    logger.debug("Created multipart upload %s (%s parts)", key, len(parts))
+
+    return cors.get_response(
+        status_code=201,
+        body={
+            "message": "Upload each part with PUT to its URL, then complete the upload with PUT /ml-models/{model_name}/uploads/{upload_id}.",
+            "upload_id": upload["UploadId"],
+            "key": key,
+            "part_size": params["part_size"],
+            "parts": parts,
+            "expires_in": EXPIRATION,
+        },
+        methods="POST",
+    )
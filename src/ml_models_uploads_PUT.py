@@ -0,0 +1,73 @@
+import json
+from helpers import checksums, cors, validation
+from helpers.logging import logger
+from ml_models_uploads_GET import list_parts
+from ml_models_uploads_POST import STAGING_S3_BUCKET, s3
+
+
+@validation.check_authorization
+def handler(event: dict, context) -> dict:
+    """Complete a multipart upload; s3_staging_trigger then publishes the file."""
+    username = event["username"]
+    model_name = event["path_params"]["model_name"]
+    upload_id = event["path_params"]["upload_id"]
+    body = json.loads(event["body"])
+    key = body.get("key") or ""
+    if not key.startswith(f"{username}/{model_name}/"):
+        return cors.get_response(
+            status_code=404,
+            body={"error": "The upload you requested does not exist."},
+            methods="PUT",
+        )
+
+    # parts of an upload created with ChecksumAlgorithm=SHA256 are completed
+    # with their checksums
+    if not all(
+        checksums.is_sha256(part.get("checksum")) for part in body.get("parts") or []
+    ):
+        return cors.get_response(
+            status_code=400,
+            body={"error": "Each part must have its base64-encoded SHA-256 checksum."},
+            methods="PUT",
+        )
+
+    try:
+        # without "parts", complete with every part S3 has received
+        parts = body.get("parts") or list_parts(key=key, upload_id=upload_id)
+        s3.complete_multipart_upload(
+            Bucket=STAGING_S3_BUCKET,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": sorted(
+                    [
+                        {
+                            "PartNumber": int(part["part_number"]),
+                            "ETag": part["etag"],
+                            "ChecksumSHA256": part["checksum"],
+                        }
+                        for part in parts
+                    ],
+                    key=lambda part: part["PartNumber"],
+                )
+            },
+        )
+    except s3.exceptions.NoSuchUpload:
+        return cors.get_response(
+            status_code=404,
+            body={"error": "The upload you requested does not exist."},
+            methods="PUT",
+        )
+    except s3.exceptions.ClientError as err:
+        logger.exception(err)
+        return cors.get_response(
+            status_code=400,
+            body={"error": err.response["Error"]["Message"]},
+            methods="PUT",
+        )
+
+    return cors.get_response(
+        status_code=200,
+        body={"message": f"Upload complete. Model '{model_name}' is being published."},
+        methods="PUT",
+    )
@@ -2,6 +2,7 @@ import os
 import json
 from uuid import uuid4 as uuid
 from flows.new_user_api import create_api_for_sub_domain
+from helpers import throttling
 
 import boto3
 
@@ -20,8 +21,9 @@ def grab_fields(message: dict) -> tuple[bool, dict]:
 
 def handler(event: dict, context):
     print("Event: ", json.dumps(event))
+    throttling.set_deadline(context)
     if "Records" not in event:
-        valid, record = grab_fields(event["Records"])
+        valid, record = grab_fields(event)
         if not valid:
             raise Exception(
                 "Missing one or more of the following fields from Event body: username, domain_name"
@@ -37,13 +39,25 @@ def handler(event: dict, context):
         print("Sent")
         return
 
+    # a flow that has to wait is retried later: its message is hidden for
+    # the delay and reported as failed, so that SQS delivers it again (FIFO
+    # queues do not support per-message delays)
+    failures = []
     for record in event["Records"]:
         body = json.loads(record["body"])
-        valid, record = grab_fields(body)
+        valid, fields = grab_fields(body)
         if not valid:
             raise Exception(
                 "Missing one or more of the following fields from SQS message: username, domain_name"
             )
 
-        api = create_api_for_sub_domain(**record)
-        print("Created api: ", json.dumps(api, default=str))
+        delay = create_api_for_sub_domain(**fields)
+        if delay:
+            sqs.change_message_visibility(
+                QueueUrl=_QUEUE,
+                ReceiptHandle=record["receiptHandle"],
+                VisibilityTimeout=delay,
+            )
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    return {"batchItemFailures": failures}
@@ -0,0 +1,56 @@
+import os
+import json
+import socket
+import ssl
+from http.client import HTTPSConnection
+from time import time
+from helpers.logging import logger
+
+# api.<domain>, and the regional endpoint of its custom domain in this region
+DOMAIN_NAME = os.environ["domain_name"]
+REGIONAL_ENDPOINT = os.environ["regional_endpoint"]
+# "healthcheck" is a reserved username (see users_POST.py): the model never
+# exists, so the proxy looks it up and answers 404 without running anything
+PROBE_PATH = "/healthcheck/probe"
+EXPECTED_STATUS = 404
+TIMEOUT = 10  # seconds
+
+
+class RegionalConnection(HTTPSConnection):
+    """HTTPS connection to the regional endpoint that presents and verifies the
+    custom domain name (SNI), as a client routed to this region would."""
+
+    def connect(self):
+        sock = socket.create_connection((REGIONAL_ENDPOINT, 443), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=DOMAIN_NAME)
+
+
+def handler(event: dict, context) -> dict:
+    # Sends a request through this region's API Gateway custom domain (TLS
+    # certificate, API mapping, routes) to the proxy. Raising makes the
+    # invocation count in the function's Errors metric, which backs the
+    # Route 53 health check of this region.
+    start = time()
+    connection = RegionalConnection(
+        DOMAIN_NAME, timeout=TIMEOUT, context=ssl.create_default_context()
+    )
+    try:
+        connection.request(
+            "POST",
+            PROBE_PATH,
+            body=json.dumps({"payload": []}),
+            headers={"Content-Type": "application/json", "User-Agent": "healthcheck"},
+        )
+        response = connection.getresponse()
+        body = response.read().decode(errors="replace")
+    finally:
+        connection.close()
+    duration = int((time() - start) * 1000)  # in milliseconds
+
+    logger.info("probe status code: %s, duration: %s ms", response.status, duration)
+    # anything else (e.g. API Gateway's 403 for an unmapped route, or a 5xx)
+    # means the request did not reach the proxy or the proxy failed
+    if response.status != EXPECTED_STATUS:
+        raise Exception(f"Probe returned {response.status}: {body[:500]}")
+
+    return {"status_code": response.status, "duration": duration}
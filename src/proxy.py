@@ -1,9 +1,11 @@
+import base64
 import os
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 from datetime import datetime
 import json
 from hashlib import sha256
-from helpers import cors, dynamodb as ddb
+from helpers import api_keys, cors, registry, usages
 from helpers.decimal_encoder import DecimalEncoder
 from helpers.logging import logger
 import boto3
@@ -15,11 +17,15 @@ MODELS_S3_BUCKET = f"{_PREFIX}-models-{_REGION_NAME}"
 EXECUTION_LAMBDA_ARN = os.environ["lambda"]
 PREPROCESSING_LAMBDA_ARN = os.environ["preprocessing_lambda"]
 
+# Lambda caps synchronous responses at 6 MB (the output is JSON encoded twice
+# in the response), so larger outputs are returned as a link to S3 instead.
+MAX_INLINE_RESPONSE_SIZE = 5_000_000  # bytes
+OUTPUT_LINK_EXPIRATION = 900  # seconds
+
 lambda_ = boto3.client("lambda")
 s3 = boto3.client("s3")
 
 # dynamodb boto3
-dynamodb_client = boto3.client("dynamodb")
 dynamodb = boto3.resource("dynamodb")
 MODELS_TABLE_NAME = f"{_PREFIX}_Models"
 MODELS_TABLE = dynamodb.Table(MODELS_TABLE_NAME)
@@ -29,9 +35,7 @@ USAGES_TABLE = dynamodb.Table(USAGES_TABLE_NAME)
 
 def add_to_usages_table(
     status_code: int,
-    username: str,
-    model_name: str,
-    start_time: str,
+    key: dict,
     location: str,
     duration: int,
     input: str | None,
@@ -40,8 +44,7 @@ def add_to_usages_table(
 ):
     try:
         record = {
-            "pk": f"{username}|{model_name}",
-            "sk": start_time,
+            **key,
             "status_code": status_code,
             "location": location,
             "duration": duration,
@@ -55,40 +58,50 @@ def add_to_usages_table(
         logger.exception(err)
 
 
+def get_api_key_info(username: str, model_name: str, api_key: str | None) -> dict:
+    """Return the record of the API key if it is valid for the model."""
+    if not api_key:
+        return {}
+    hashed_value = sha256(api_key.encode()).hexdigest()
+    # consistent read: a deleted key stops working at once (in this region)
+    response = MODELS_TABLE.get_item(
+        Key=api_keys.get_key(username, hashed_value),
+        ProjectionExpression="model_name, expires_at",
+        ConsistentRead=True,
+    )
+    key_info = response.get("Item") or {}
+    if key_info.get("model_name") not in [model_name, "*"]:
+        logger.debug("hash of key received: %s", hashed_value)
+        return {}
+    return key_info
+
+
 def get_model_info(
     username: str,
     model_name: str,
-) -> tuple[dict, dict[str, str]]:
-    statement = f"""
-    SELECT * FROM {MODELS_TABLE_NAME}
-    WHERE pk='username|{username}' AND (CONTAINS("sk", '{model_name}') OR CONTAINS("sk", '*'));
-    """
-    response = dynamodb_client.execute_statement(Statement=statement)
-    results = [ddb.from_(x) for x in response.get("Items", [])]
-    logger.debug("get_model_info results: %s", json.dumps(results, default=str))
-    if not results:
-        raise Exception(f"Unable to locate model '{model_name}'")
-
-    try:
-        model_info = next(result for result in results if result["sk"] == model_name)
-    except StopIteration:
-        model_info = {}
-
+    api_key: str | None,
+) -> tuple[dict, dict]:
+    # the model record and the API key record, in parallel
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        model_future = executor.submit(registry.get_model, username, model_name)
+        key_future = executor.submit(get_api_key_info, username, model_name, api_key)
+        model_info = model_future.result()
+        key_info = key_future.result()
     logger.debug("model_info: %s", json.dumps(model_info, default=str))
-    hashed_keys = {
-        result["hashed_key"]: result.get("expires_at") or ""
-        for result in results
-        if result["sk"] != model_name
-    }
-    logger.debug("hashed_keys: %s", hashed_keys)
+    logger.debug("key_info: %s", json.dumps(key_info, default=str))
+    if not model_info:
+        logger.info("Unable to locate model '%s'", model_name)
 
-    return model_info, hashed_keys
+    return model_info, key_info
 
 
 def parse_event(event: dict) -> tuple[bool, dict]:
-    headers = event["headers"]
+    # REST API events use payload format 1.0, HTTP API events use 2.0
+    is_v2 = event.get("version") == "2.0"
+    headers = event.get("headers") or {}
     request_context = event["requestContext"]
-    path: str = event["path"].strip("/").strip()
+    raw_path = event["rawPath"] if is_v2 else event["path"]
+    path: str = raw_path.strip("/").strip()
     if path.count("/") != 1:
         logger.error("Something's wrong with path: %s", path)
         return False, {
@@ -96,23 +109,37 @@ def parse_event(event: dict) -> tuple[bool, dict]:
             "message": "The resource you requested does not exist.",
         }
 
+    raw_body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        raw_body = base64.b64decode(raw_body).decode()
     try:
-        body = json.loads(event["body"])
+        body = json.loads(raw_body)
     except:
         return False, {
             "status_code": 400,
             "message": "Error parsing payload. Please make sure that the request body is a JSON string.",
         }
 
+    if is_v2:
+        http = request_context["http"]
+        http_method = http["method"]
+        identity = {"sourceIp": http["sourceIp"], "userAgent": http["userAgent"]}
+        request_epoch_time = request_context["timeEpoch"]
+    else:
+        http_method = event["httpMethod"]
+        identity = request_context["identity"]
+        request_epoch_time = request_context["requestTimeEpoch"]
+
     parsed_event = {
-        "http_method": event["httpMethod"],
+        "http_method": http_method,
         "path": path,
         "headers": headers,
         "body": body,
-        "query_params": event["queryStringParameters"],
-        "path_params": event["pathParameters"],
-        "identity": request_context["identity"],
-        "request_epoch_time": request_context["requestTimeEpoch"],
+        "raw_body": raw_body,
+        "query_params": event.get("queryStringParameters"),
+        "path_params": event.get("pathParameters"),
+        "identity": identity,
+        "request_epoch_time": request_epoch_time,
     }
 
     return True, parsed_event
@@ -125,12 +152,16 @@ def read_object(bucket: str, key: str) -> str:
     return body.read().decode()
 
 
-def preprocess(username: str, model_name: str, payload: dict) -> tuple[dict, int]:
+def preprocess(
+    username: str, model_name: str, payload: dict, model_info: dict
+) -> tuple[dict, int]:
     result, status_code = payload, 200
-    # Get source code of preprocessing function
+    # Get source code of preprocessing function (records written before
+    # content-addressed storage have no "preprocessing_key")
     source = read_object(
         bucket=MODELS_S3_BUCKET,
-        key=f"{username}/{model_name}_preprocessing",
+        key=model_info.get("preprocessing_key")
+        or f"{username}/{model_name}_preprocessing",
     )
     extended_payload = {
         "payload": payload,
@@ -159,7 +190,8 @@ def handler(event: dict, context) -> dict:
             methods="POST",
         )
 
-    start_time = datetime.utcnow().isoformat()
+    started_at = datetime.utcnow()
+    start_time = started_at.isoformat()
     start = time()
     logger.info("start time: %s, %s", start_time, start)
 
@@ -177,43 +209,48 @@ def handler(event: dict, context) -> dict:
     logger.debug("payload: %s", payload)
 
     # Create payload for the execution lambda (and, potentially, preprocessing lambda)
-    model_info, hashed_keys = get_model_info(username=username, model_name=model_name)
-    logger.info("model_info, hashed_keys: %s, %s", model_info, hashed_keys)
+    model_info, key_info = get_model_info(
+        username=username,
+        model_name=model_name,
+        api_key=parsed_event["headers"].get("api-key"),
+    )
+    logger.info("model_info, key_info: %s, %s", model_info, key_info)
     has_preprocessing = model_info.get("has_preprocessing") or False
 
     # Validate the user has permission (return error response if there is one, else assume everything's fine)
     error = raises_error(
         model_info=model_info,
         parsed_event=parsed_event,
-        hashed_keys=hashed_keys,
+        key_info=key_info,
     )
     if error:
         logger.error("Error: %s", json.dumps(error, default=str))
         return error
 
     # Preprocess payload
-    tmp = payload
+    preprocessed_payload = payload
     if has_preprocessing:
         tmp, status_code = preprocess(
             username=username,
             model_name=model_name,
             payload=payload,
+            model_info=model_info,
         )
-    logger.debug("tmp: %s", tmp)
-    if status_code != 200:
-        return cors.get_response(
-            body=tmp["error"],
-            status_code=400,
-            additional_headers="*",
-            methods="POST",
-        )
-    preprocessed_payload = tmp["output"]
+        logger.debug("tmp: %s", tmp)
+        if status_code != 200:
+            return cors.get_response(
+                body=tmp["error"],
+                status_code=400,
+                additional_headers="*",
+                methods="POST",
+            )
+        preprocessed_payload = tmp["output"]
 
     # run program
     output_and_error = {}
     try:
         output_and_error, result = main(
-            model_location=path,
+            model_location=model_info.get("key") or path,
             payload=preprocessed_payload,
             model_info=model_info,
         )
@@ -235,8 +272,17 @@ def handler(event: dict, context) -> dict:
     output = output_and_error.get("output")
     error = output_and_error.get("error")
 
+    # the usage row (sharded for busy models) and the log id
+    usage_key = usages.new_key(
+        username=username,
+        model_name=model_name,
+        start=started_at,
+        shards=usages.get_shard_count(model_info),
+    )
+    log_id = usage_key["sk"]
+
     # save to s3
-    location = f"{path.strip('/')}/{start_time}.json"
+    location = f"{path.strip('/')}/{log_id}.json"
     s3.put_object(
         Body=json.dumps(
             {
@@ -270,11 +316,11 @@ def handler(event: dict, context) -> dict:
     )
     add_to_usages_table(
         status_code=result["statusCode"],
-        username=username,
-        model_name=model_name,
-        start_time=start_time,
+        key=usage_key,
         duration=duration,
-        input=event["body"] if len(event["body"]) < limit else None,
+        input=(
+            parsed_event["raw_body"] if len(parsed_event["raw_body"]) < limit else None
+        ),
         output=(
             output_string
             if not isinstance(output_string, str) or len(output_string) < limit
@@ -288,13 +334,44 @@ def handler(event: dict, context) -> dict:
         location=location,
     )
 
+    # return large outputs (or outputs requested with ?output=link) as a link
+    query_params = parsed_event["query_params"] or {}
+    if result["statusCode"] == 200 and (
+        query_params.get("output") == "link"
+        or len(json.dumps(result)) > MAX_INLINE_RESPONSE_SIZE
+    ):
+        result = get_output_link_response(
+            output=output,
+            key=f"{path.strip('/')}/{log_id}.output.json",
+        )
+
     return result
 
 
+def get_output_link_response(output, key: str) -> dict:
+    s3.put_object(
+        Body=json.dumps({"output": output}, cls=DecimalEncoder, default=str),
+        Bucket=LOGS_S3_BUCKET,
+        Key=key,
+        ContentType="application/json",
+    )
+    url = s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": LOGS_S3_BUCKET, "Key": key},
+        ExpiresIn=OUTPUT_LINK_EXPIRATION,
+    )
+    return cors.get_response(
+        body={"output_url": url, "expires_in": OUTPUT_LINK_EXPIRATION},
+        status_code=200,
+        additional_headers="*",
+        methods="POST",
+    )
+
+
 def raises_error(
     model_info: dict,
     parsed_event: dict,
-    hashed_keys: dict[str, str],
+    key_info: dict,
 ) -> dict | None:
     # If model does not exist
     if not model_info:
@@ -316,6 +393,23 @@ def raises_error(
             methods="POST",
         )
 
+    # If the model (or its preprocessing) has yet to be copied to this region
+    # (records without "regions" predate replication and are served as is)
+    replicated = _REGION_NAME in model_info.get("regions", [_REGION_NAME])
+    if model_info.get("has_preprocessing"):
+        replicated &= _REGION_NAME in model_info.get(
+            "preprocessing_regions", [_REGION_NAME]
+        )
+    if not replicated:
+        return cors.get_response(
+            body={
+                "error": "ML model is not yet available in this region. Please retry shortly."
+            },
+            status_code=503,
+            additional_headers="*",
+            methods="POST",
+        )
+
     # If the model is marked as "is_deleted"
     if model_info["is_deleted"]:
         return cors.get_response(
@@ -335,28 +429,20 @@ def raises_error(
         )
 
     # If model is not public but no api key provided matches
-    hashed_value = None
-    if not model_info["is_public"]:
-        api_key = parsed_event["headers"].get("api-key") or ""
-        hashed_value = sha256(api_key.encode()).hexdigest()
-        if hashed_value not in hashed_keys:
-            logger.debug("hash of key received: %s", hashed_value)
-            logger.debug("hashed keys: %s", hashed_keys)
-            logger.debug("hashed_value in hashed_keys: %s", hashed_value in hashed_keys)
-            return cors.get_response(
-                body={"error": "A valid API key is required for this ML model."},
-                status_code=403,
-                additional_headers="*",
-                methods="POST",
-            )
+    if not model_info["is_public"] and not key_info:
+        return cors.get_response(
+            body={"error": "A valid API key is required for this ML model."},
+            status_code=403,
+            additional_headers="*",
+            methods="POST",
+        )
 
     # If model is not public and api key has expired
     current_time = datetime.utcnow().isoformat()
     if (
         not model_info["is_public"]
-        and hashed_value in hashed_keys
-        and hashed_keys[hashed_value]
-        and hashed_keys[hashed_value] < current_time
+        and key_info.get("expires_at")
+        and key_info["expires_at"] < current_time
     ):
         return cors.get_response(
             body={"error": "The API key you provided has already expired."},
@@ -1,30 +1,45 @@
 import os
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 from collections import namedtuple
 import boto3
-from helpers import dynamodb as ddb
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from helpers import checksums, registry
 from helpers.logging import logger
 
 s3_tuple = namedtuple("s3_tuple", ["bucket", "key"])
 
 s3 = boto3.client("s3")
-s3r = boto3.resource("s3")
 
 _PREFIX = os.environ["prefix"]
 
+# Copies of objects above the threshold are done with parallel UploadPartCopy
+# calls (server side), 64 MB per part.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=64 * 1024**2,
+    multipart_chunksize=64 * 1024**2,
+    max_concurrency=16,
+)
+# number of records of one event processed at the same time
+_MAX_RECORD_WORKERS = 4
 
-# dynamodb boto3
-MODELS_TABLE_NAME = f"{_PREFIX}_Models"
-dynamodb_client = boto3.client("dynamodb")
-dynamodb = boto3.resource("dynamodb")
-MODELS_TABLE = dynamodb.Table(MODELS_TABLE_NAME)
+# files are stored once per content, as artifacts/<sha256 hex digest> (see
+# helpers/checksums.py for multipart uploads)
+ARTIFACTS_PREFIX = "artifacts"
+# tag of an artifact reused by an upload (read by artifacts_gc.py)
+LAST_USED_TAG = "last_used"
+# read size when hashing an upload that came without a checksum
+_HASH_CHUNK_SIZE = 8 * 1024**2
+MOPS = ["model", "preprocessing"]
 
-
-def get_model(username: str, model_name: str) -> dict:
-    statement = f"SELECT * FROM {MODELS_TABLE_NAME} WHERE pk='username|{username}' AND sk='{model_name}';"
-    response = dynamodb_client.execute_statement(Statement=statement)
-    return ddb.from_(response.get("Items", [{}])[0])
+# region_0 is this function's region, region_1... are the other regions
+REGIONS = [
+    value for name, value in os.environ.items() if re.fullmatch(r"region_\d+", name)
+]
 
 
 def upsert_ml_model_record(
@@ -33,49 +48,179 @@ def upsert_ml_model_record(
     for_model: bool,
     bucket: str,
     key: str,
+    sha256: str,
+    regions: list[str],
 ):
-    record = get_model(username=username, model_name=model_name)
-    record.update(
-        {
+    """Mark the file as uploaded."""
+    prefix = "" if for_model else "preprocessing_"
+    registry.update_model(
+        username=username,
+        model_name=model_name,
+        values={
             "updated_at": datetime.utcnow().isoformat(),
             "bucket": bucket,
-            "key": key,
-        }
+            # key of the file in the models buckets
+            f"{prefix}key": key,
+            f"{prefix}sha256": sha256,
+            "is_uploaded" if for_model else "is_preprocessing_uploaded": True,
+            # regions whose models bucket holds the current version of the file
+            "regions" if for_model else "preprocessing_regions": regions,
+        },
+        remove=[f"{prefix}upload_error"],
+    )
+
+
+def set_upload_error(username: str, model_name: str, for_model: bool, error: str):
+    """Record why the last upload of the file was rejected."""
+    prefix = "" if for_model else "preprocessing_"
+    registry.update_model(
+        username=username,
+        model_name=model_name,
+        values={
+            "updated_at": datetime.utcnow().isoformat(),
+            f"{prefix}upload_error": error,
+        },
+    )
+
+
+def set_regions(
+    username: str, model_name: str, for_model: bool, sha256: str, regions: list[str]
+):
+    """Record the regions holding the file, unless the record points at
+    another file by now (other updates of the record do not matter)."""
+    prefix = "" if for_model else "preprocessing_"
+    registry.update_model(
+        username=username,
+        model_name=model_name,
+        values={"regions" if for_model else "preprocessing_regions": regions},
+        condition=f"{prefix}sha256 = :sha256",
+        condition_values={":sha256": sha256},
     )
-    record["is_uploaded" if for_model else "is_preprocessing_uploaded"] = True
-    MODELS_TABLE.put_item(Item=record)
 
 
 def get_attributes(bucket_name: str, object_name: str) -> dict:
+    # HEAD: the metadata (and checksum) without downloading the object
     try:
-        response = s3.get_object(Bucket=bucket_name, Key=object_name)
-    except s3.exceptions.NoSuchKey:
-        raise Exception("The resource you requested does not exist.")
+        response = s3.head_object(
+            Bucket=bucket_name, Key=object_name, ChecksumMode="ENABLED"
+        )
+    except ClientError as err:
+        if err.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            raise Exception("The resource you requested does not exist.")
+        raise
 
-    return response["Metadata"]
+    return response
 
 
-def handler(event: dict, context):
-    logger.debug("Event: %s", json.dumps(event))
+def get_sha256(bucket_name: str, object_name: str, head: dict) -> str:
+    # S3 verified this checksum on upload; an upload without one (presigned
+    # POST of a client that sent no checksum) is hashed while streaming it
+    checksum = head.get("ChecksumSHA256")
+    if checksum:
+        return checksums.to_hex(checksum)
+    digest = hashlib.sha256()
+    body = s3.get_object(Bucket=bucket_name, Key=object_name)["Body"]
+    for chunk in body.iter_chunks(chunk_size=_HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
 
-    for record in event["Records"]:
+
+def object_exists(client, bucket_name: str, object_name: str) -> bool:
+    try:
+        client.head_object(Bucket=bucket_name, Key=object_name)
+    except ClientError as err:
+        if err.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return False
+        raise
+    return True
+
+
+def touch(client, bucket_name: str, object_name: str):
+    # keeps artifacts_gc.py from deleting a file that is about to be used again
+    client.put_object_tagging(
+        Bucket=bucket_name,
+        Key=object_name,
+        Tagging={
+            "TagSet": [{"Key": LAST_USED_TAG, "Value": datetime.utcnow().isoformat()}]
+        },
+    )
+
+
+def reject(bucket_name: str, object_name: str, metadata: dict, error: str):
+    """Delete an upload that cannot be accepted, recording why on its model
+    (if it names one)."""
+    logger.error("Rejecting %s: %s", object_name, error)
+    if metadata.get("username") and metadata.get("model_name"):
         try:
-            main(record)
-        except Exception as err:
-            logger.error(
-                "Error: %s", json.dumps({"event": record, "error": err}, default=str)
+            set_upload_error(
+                username=metadata["username"],
+                model_name=metadata["model_name"],
+                for_model=metadata.get("mop") != "preprocessing",
+                error=error,
             )
-            logger.exception(err)
+        except registry.ConditionFailed as err:
+            logger.warning("Not recording the upload error: %s", err)
+    s3.delete_object(Bucket=bucket_name, Key=object_name)
+
+
+def process_record(record: dict) -> bool:
+    try:
+        main(record)
+    except Exception as err:
+        logger.error(
+            "Error: %s", json.dumps({"event": record, "error": err}, default=str)
+        )
+        logger.exception(err)
+        return False
+    return True
 
 
-def move_object(from_: s3_tuple, to_: s3_tuple):
-    # Copy object A as object B
+def handler(event: dict, context):
+    logger.debug("Event: %s", json.dumps(event))
+
+    with ThreadPoolExecutor(max_workers=_MAX_RECORD_WORKERS) as executor:
+        processed = list(executor.map(process_record, event["Records"]))
+
+    # failing the invocation makes Lambda retry the event (the staged object
+    # is only deleted once it has been copied everywhere)
+    failed = processed.count(False)
+    if failed:
+        raise Exception(f"{failed} of {len(processed)} records failed")
+
+
+def copy_object(from_: s3_tuple, to_: s3_tuple):
     copy_source = {"Bucket": from_.bucket, "Key": from_.key}
-    bucket = s3r.Bucket(to_.bucket)
-    bucket.copy(copy_source, to_.key)
+    s3.copy(copy_source, to_.bucket, to_.key, Config=TRANSFER_CONFIG)
+
+
+def replicate_object(source: s3_tuple, regions: list[str]) -> list[str]:
+    """Copy `source` into the models bucket of each region (in parallel) and
+    return the regions the copy succeeded in."""
+
+    def copy(region: str) -> str | None:
+        client = boto3.client("s3", region_name=region)
+        bucket = f"{_PREFIX}-models-{region}"
+        try:
+            # content-addressed: an existing object is the same file
+            if object_exists(client, bucket, source.key):
+                touch(client, bucket, source.key)
+            else:
+                client.copy(
+                    CopySource={"Bucket": source.bucket, "Key": source.key},
+                    Bucket=bucket,
+                    Key=source.key,
+                    SourceClient=s3,
+                    Config=TRANSFER_CONFIG,
+                )
+        except Exception as err:
+            logger.exception("Unable to replicate %s to %s: %s", source, region, err)
+            return None
+        return region
 
-    # Delete the former object A
-    s3r.Object(from_.bucket, from_.key).delete()
+    if not regions:
+        return []
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        return [region for region in executor.map(copy, regions) if region]
 
 
 def main(event: dict):
@@ -84,25 +229,73 @@ def main(event: dict):
 
     s3_bucket = event["s3"]["bucket"]["name"]
     s3_object = event["s3"]["object"]["key"]
+    if not object_exists(s3, s3_bucket, s3_object):
+        # deleted once processed: this is a retry of an event that succeeded
+        logger.info("%s has already been processed", s3_object)
+        return
 
     # get metadata
-    s3_metadata = get_attributes(bucket_name=s3_bucket, object_name=s3_object)
+    head = get_attributes(bucket_name=s3_bucket, object_name=s3_object)
+    s3_metadata = head["Metadata"]
     logger.debug("s3_metadata: %s", json.dumps(s3_metadata, default=str))
 
-    # move object
-    if s3_metadata["mop"] == "model":
-        s3_key = f"{s3_metadata['username']}/{s3_metadata['model_name']}"
-    else:
-        s3_key = f"{s3_metadata['username']}/{s3_metadata['model_name']}_preprocessing"
+    # uploads are made with the metadata of the presigned POST (or of the
+    # multipart upload)
+    if not s3_metadata.get("username") or not s3_metadata.get("model_name"):
+        reject(s3_bucket, s3_object, s3_metadata, "The upload names no model.")
+        return
+    if s3_metadata.get("mop") not in MOPS:
+        reject(
+            s3_bucket,
+            s3_object,
+            s3_metadata,
+            f"The upload is neither a {' nor a '.join(MOPS)} file.",
+        )
+        return
+
+    sha256 = get_sha256(s3_bucket, s3_object, head)
+
+    # copy object, unless the models bucket already has the same file
+    s3_key = f"{ARTIFACTS_PREFIX}/{sha256}"
     from_ = s3_tuple(s3_bucket, s3_object)
     to_ = s3_tuple(MODELS_S3_BUCKET, s3_key)
-    move_object(from_=from_, to_=to_)
-
-    # update db
-    upsert_ml_model_record(
-        username=s3_metadata["username"],
-        model_name=s3_metadata["model_name"],
-        for_model=s3_metadata["mop"] == "model",
-        bucket=s3_bucket,
-        key=s3_key,
-    )
+    if object_exists(s3, MODELS_S3_BUCKET, s3_key):
+        logger.info("%s already exists, skipping the copy", s3_key)
+        touch(s3, MODELS_S3_BUCKET, s3_key)
+    else:
+        copy_object(from_=from_, to_=to_)
+
+    # update db: the model can be served from this region right away...
+    record = {
+        "username": s3_metadata["username"],
+        "model_name": s3_metadata["model_name"],
+        "for_model": s3_metadata["mop"] == "model",
+        "bucket": s3_bucket,
+        "key": s3_key,
+        "sha256": sha256,
+    }
+    upsert_ml_model_record(**record, regions=[_REGION_NAME])
+
+    # ...and from the other regions once it has been copied there, unless
+    # another file has been uploaded for the model in the meantime
+    other_regions = [region for region in REGIONS if region != _REGION_NAME]
+    replicated = replicate_object(to_, other_regions)
+    if replicated:
+        try:
+            set_regions(
+                username=record["username"],
+                model_name=record["model_name"],
+                for_model=record["for_model"],
+                sha256=sha256,
+                regions=[_REGION_NAME, *replicated],
+            )
+        except registry.ConditionFailed as err:
+            logger.warning("Not recording replication: %s", err)
+
+    # a region without the file keeps answering 503 for the model: fail, so
+    # that the event is retried (the regions that have it are skipped)
+    missing = sorted(set(other_regions) - set(replicated))
+    if missing:
+        raise Exception(f"Unable to replicate {s3_key} to {', '.join(missing)}")
+
+    s3.delete_object(Bucket=from_.bucket, Key=from_.key)
@@ -2,8 +2,7 @@ import os
 from typing import Tuple
 import json
 from hashlib import sha256
-import boto3
-from helpers import cors, dynamodb as ddb, validation
+from helpers import cors, tables, validation
 from helpers.decimal_encoder import DecimalEncoder
 from helpers.logging import logger
 
@@ -12,10 +11,7 @@ from helpers.logging import logger
 PREFIX = os.environ["prefix"]
 AUTH_HEADERS = "Content-Type, username, password"
 
-dynamodb = boto3.client("dynamodb")
-
 UTF_8 = "utf-8"
-_USERS_TABLE_NAME = f"{PREFIX}_Users"
 
 
 def is_password_correct(password: str, salt: str, hashed: str) -> bool:
@@ -52,12 +48,7 @@ def parse(event: dict) -> Tuple[dict, dict]:
 
 
 def get_user(username: str) -> dict:
-    response: dict = dynamodb.get_item(
-        TableName=_USERS_TABLE_NAME,
-        Key=ddb.to_({"pk": username, "sk": "username"}),
-    )
-    items = response.get("Item", {})
-    return ddb.from_(items)
+    return tables.get_item(tables.USERS, {"pk": username, "sk": "username"})
 
 
 def get_error_response(err: Exception | str) -> dict:
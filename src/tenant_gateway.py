@@ -0,0 +1,56 @@
+import os
+import json
+from helpers import cors, tables
+from helpers.logging import logger
+
+_REGION_NAME = os.environ["region_name"]
+_DOMAIN_NAME = os.environ["domain_name"]
+
+# tenants are cached per execution environment; unknown hosts for less time
+# so that a new tenant is served shortly after signing up
+_TENANT_TTL = 300  # seconds
+_UNKNOWN_TENANT_TTL = 30  # seconds
+
+_tenants = tables.Cache(ttl=_TENANT_TTL, empty_ttl=_UNKNOWN_TENANT_TTL)
+
+
+def get_tenant(username: str) -> dict:
+    """Return the Apis record of the tenant ({} if there is none)."""
+    return tables.get_item(
+        tables.APIS, {"pk": username, "sk": _REGION_NAME}, cache=_tenants
+    )
+
+
+def get_username(host: str) -> str | None:
+    # <username>.<domain>
+    suffix = f".{_DOMAIN_NAME}"
+    host = host.split(":")[0]
+    if not host.lower().endswith(suffix):
+        return None
+    username = host[: -len(suffix)]
+    return username if username and "." not in username else None
+
+
+def handler(event: dict, context):
+    logger.debug("Event: %s", json.dumps(event))
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    method = event["requestContext"]["http"]["method"]
+    path = event["rawPath"]
+
+    username = get_username(headers.get("host", ""))
+    if not username or not get_tenant(username):
+        return cors.get_response(
+            status_code=404,
+            body={"error": "Unknown API."},
+            methods="GET",
+        )
+
+    # GET /ping
+    if method == "GET" and path == "/ping":
+        return cors.get_response(status_code=200, methods="GET")
+
+    return cors.get_response(
+        status_code=404,
+        body={"error": f"Route {method} {path} does not exist."},
+        methods="GET",
+    )
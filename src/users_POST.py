@@ -2,7 +2,7 @@ import os
 import json
 from hashlib import sha256
 from uuid import uuid4 as uuid
-from helpers import cors, validation
+from helpers import aggregates, cors, tables, validation
 from helpers.logging import logger
 
 import boto3
@@ -10,13 +10,12 @@ import boto3
 
 PREFIX = os.environ["prefix"]
 UTF_8 = "utf-8"
-_USERS_TABLE_NAME = f"{PREFIX}_Users"
-dynamodb_client = boto3.client("dynamodb")
-dynamodb = boto3.resource("dynamodb")
-_USERS_TABLE = dynamodb.Table(_USERS_TABLE_NAME)
 
 sqs = boto3.client("sqs")
 
+# the synthetic probe of the inference API calls /healthcheck/... (src/probe.py)
+_RESERVED_USERNAMES = {"healthcheck"}
+
 
 def parse(event: dict) -> dict:
     """Return a parsed version of the API Gateway event (with password salted and hashed)."""
@@ -31,6 +30,10 @@ def parse(event: dict) -> dict:
     salt = str(uuid())
     hashed_password: str = sha256((password + salt).encode(UTF_8)).hexdigest()
 
+    # validate username
+    if headers["username"].lower() in _RESERVED_USERNAMES:
+        raise Exception(f"""The username "{headers['username']}" is reserved.""")
+
     # other stuff
     request_context = event["requestContext"]
     identity = request_context["identity"]
@@ -55,27 +58,20 @@ def parse(event: dict) -> dict:
 
 
 def add_user_to_users_table(username: str, payload: dict):
+    users = tables.table(tables.USERS)
     try:
         record = {"pk": username, "sk": "username", **payload}
-        _USERS_TABLE.put_item(
+        users.put_item(
             Item=record,
             ConditionExpression="attribute_not_exists(pk)",
         )
-    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+    except users.meta.client.exceptions.ConditionalCheckFailedException:
         raise Exception(f"""The username "{username}" already exists.""")
 
 
 def get_number_of_users() -> int:
-    response = dynamodb_client.scan(
-        TableName=_USERS_TABLE,
-        Limit=101,
-        Select="SPECIFIC_ATTRIBUTES",
-        ProjectionExpression="pk",
-        ConsistentRead=False,
-    )
-    print("users: ", json.dumps(response))
-    num_users = response["ScannedCount"]
-    return num_users
+    # kept up to date from the Users stream (src/aggregates.py)
+    return aggregates.get_number_of_users()
 
 
 def get_error_response(err: Exception) -> dict: